@@ -0,0 +1,128 @@
+"""文本切分的吞吐量对比：modules.text_chunker 与 langchain 的 RecursiveCharacterTextSplitter
+
+用确定性的合成中文文档（段落、换行、中英文标点混合）测量切分耗时（MB/秒）、片段数和片段长度分布，
+以及分块读入（流式输入）时的耗时；另外在子进程中测量两者的导入耗时。没有安装langchain时只测text_chunker。
+
+用法:
+    python benchmarks/bench_chunker.py --size-mb 100 --json chunker_report.json
+    python benchmarks/bench_chunker.py --size-mb 10 --chunk-size 500 --chunk-overlap 50
+"""
+import os
+import sys
+import time
+import json
+import argparse
+import subprocess
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import config
+from modules.text_chunker import iter_chunks
+from bench_suite import synthetic_texts, environment
+
+_ENGLISH = ["The index is rebuilt after every upgrade. ", "Check the logs first! ", "Is the cache warm? "]
+
+
+def synthetic_document(size_mb, seed=0):
+    """拼接合成片段为约size_mb MB（UTF-8）的文档
+
+    每段由2~12个片段组成（多数段落比CHUNK_SIZE长，与PDF、Word中提取的文本相近），段间换行或空一行，
+    夹带少量英文句子。中文没有空格，段落过长时只能在标点处切分。
+    """
+    rng = np.random.default_rng(seed)
+    texts = synthetic_texts(0, 2000, seed)
+    paragraphs = []
+    i = 0
+    while i < len(texts):
+        count = int(rng.integers(2, 13))
+        paragraph = "".join(texts[i:i + count])
+        if len(paragraphs) % 5 == 0:
+            paragraph += _ENGLISH[len(paragraphs) % len(_ENGLISH)]
+        paragraphs.append(paragraph + ("\n\n" if rng.random() < 0.3 else "\n"))
+        i += count
+    block = "".join(paragraphs)
+    repeats = max(1, int(size_mb * 1024 * 1024 / len(block.encode("utf-8"))))
+    return block * repeats
+
+
+def import_seconds(statement):
+    """在新的解释器中测量一条导入语句的耗时，失败（未安装）时返回None"""
+    code = f"import time; start = time.perf_counter(); {statement}; print(time.perf_counter() - start)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT_DIR, capture_output=True, text=True)
+    return round(float(result.stdout.strip()), 4) if result.returncode == 0 else None
+
+
+def summarize(name, texts, seconds, size_bytes):
+    lengths = np.array([len(text) for text in texts]) if texts else np.zeros(1)
+    return {"splitter": name, "seconds": round(seconds, 3), "mb_per_second": round(size_bytes / 2 ** 20 / seconds, 2),
+            "chunks": len(texts), "mean_length": round(float(lengths.mean()), 1),
+            "p5_length": int(np.percentile(lengths, 5)), "max_length": int(lengths.max())}
+
+
+def load_langchain_splitter():
+    try:
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+    except ImportError:
+        try:
+            from langchain.text_splitter import RecursiveCharacterTextSplitter
+        except ImportError:
+            return None
+    return RecursiveCharacterTextSplitter
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="文本切分的吞吐量对比")
+    parser.add_argument("--size-mb", type=float, default=100, help="合成文档的大小（MB，UTF-8）")
+    parser.add_argument("--chunk-size", type=int, default=config.CHUNK_SIZE)
+    parser.add_argument("--chunk-overlap", type=int, default=config.CHUNK_OVERLAP)
+    parser.add_argument("--block-kb", type=int, default=64, help="流式输入时每块的大小（KB）")
+    parser.add_argument("--skip-langchain", action="store_true", help="不测langchain")
+    parser.add_argument("--json", default=None, help="把结果写入JSON文件")
+    args = parser.parse_args(argv)
+
+    document = synthetic_document(args.size_mb)
+    size_bytes = len(document.encode("utf-8"))
+    print(f"合成文档: {size_bytes / 2 ** 20:.1f} MB，{len(document)} 个字符")
+    results = []
+
+    start = time.perf_counter()
+    texts = [chunk.text for chunk in iter_chunks(document, args.chunk_size, args.chunk_overlap)]
+    results.append(summarize("text_chunker", texts, time.perf_counter() - start, size_bytes))
+
+    block = args.block_kb * 1024
+    start = time.perf_counter()
+    pieces = (document[i:i + block] for i in range(0, len(document), block))
+    streamed = [chunk.text for chunk in iter_chunks(pieces, args.chunk_size, args.chunk_overlap)]
+    results.append(summarize("text_chunker_streamed", streamed, time.perf_counter() - start, size_bytes))
+    del texts, streamed
+
+    splitter_class = None if args.skip_langchain else load_langchain_splitter()
+    if splitter_class is not None:
+        splitter = splitter_class(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap, length_function=len)
+        start = time.perf_counter()
+        texts = splitter.split_text(document)
+        results.append(summarize("langchain_recursive", texts, time.perf_counter() - start, size_bytes))
+    elif not args.skip_langchain:
+        print("未安装langchain，跳过RecursiveCharacterTextSplitter")
+
+    imports = {"text_chunker": import_seconds("import modules.text_chunker"),
+               "langchain_recursive": import_seconds("from langchain_text_splitters import RecursiveCharacterTextSplitter")
+               or import_seconds("from langchain.text_splitter import RecursiveCharacterTextSplitter")}
+
+    for result in results:
+        print(f"{result['splitter']:>22}: {result['seconds']:8.2f}s  {result['mb_per_second']:7.2f} MB/s  "
+              f"{result['chunks']:>8} 片段  平均 {result['mean_length']:.0f} 字  p5 {result['p5_length']}  "
+              f"最长 {result['max_length']}")
+    print("导入耗时: " + "，".join(f"{name} {seconds:.3f}s" for name, seconds in imports.items() if seconds is not None))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"environment": environment(), "args": vars(args), "results": results, "import_seconds": imports},
+                      f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
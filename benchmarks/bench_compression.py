@@ -0,0 +1,109 @@
+"""向量压缩方式的内存/延迟/召回率对比
+
+以float32精确检索（flat）的结果为基准，对每种压缩方式（none/fp16/int8/pq）统计每个向量占用的字节数、
+单条查询延迟和recall@k；开启--rerank时再测一组"取k*factor个候选、用全精度向量重排"的结果。
+
+用法:
+    python benchmarks/bench_compression.py --n 200000 --dim 768 --k 3
+    python benchmarks/bench_compression.py --store vector_store --index-type ivf_flat --json compression.json
+"""
+import os
+import sys
+import time
+import json
+import argparse
+import numpy as np
+import faiss
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.index_factory import (build_index, configure_search, train_index, add_in_blocks, exact_rerank,
+                                   COMPRESSIONS)
+from bench_index import synthetic_vectors, load_store_vectors, recall_at_k
+
+
+def bytes_per_vector(index):
+    """序列化后的索引大小除以向量数（包含码本、聚类中心等固定开销）"""
+    return len(faiss.serialize_index(index)) / max(index.ntotal, 1)
+
+
+def measure(index, queries, k, vectors=None, factor=1):
+    """逐条查询并统计延迟；传入vectors时取k*factor个候选后用全精度向量重排"""
+    latencies = []
+    results = np.full((len(queries), k), -1, dtype=np.int64)
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        _, indices = index.search(queries[i:i + 1], k * factor)
+        if vectors is not None:
+            ranked = exact_rerank(vectors, queries[i], indices[0][indices[0] >= 0], k)
+            row = [idx for _, idx in ranked]
+        else:
+            row = indices[0]
+        latencies.append((time.perf_counter() - start) * 1000)
+        results[i, :len(row)] = row
+    latencies = np.array(latencies)
+    return results, {
+        "p50_ms": round(float(np.percentile(latencies, 50)), 4),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 4),
+        "qps": round(float(1000 / latencies.mean()), 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量压缩方式的内存/延迟/召回率对比")
+    parser.add_argument("--n", type=int, default=100000, help="合成向量数量")
+    parser.add_argument("--dim", type=int, default=768, help="合成向量维度")
+    parser.add_argument("--store", help="使用该向量存储目录中的向量代替合成数据")
+    parser.add_argument("--queries", type=int, default=500, help="查询数量")
+    parser.add_argument("--k", type=int, default=3, help="recall@k中的k")
+    parser.add_argument("--index-type", default="flat", choices=("flat", "ivf_flat", "hnsw"), help="索引类型")
+    parser.add_argument("--compressions", default=",".join(COMPRESSIONS), help="参与对比的压缩方式")
+    parser.add_argument("--rerank-factor", type=int, default=4, help="重排时取k的多少倍候选，0表示不测重排")
+    parser.add_argument("--json", help="把结果写入该JSON文件")
+    args = parser.parse_args()
+
+    if args.store:
+        vectors = load_store_vectors(args.store)
+    else:
+        vectors = synthetic_vectors(args.n + args.queries, args.dim)
+    # 查询取自数据分布本身（加少量扰动），其余作为库向量
+    rng = np.random.default_rng(1)
+    queries = np.ascontiguousarray(vectors[rng.choice(len(vectors), args.queries, replace=False)], dtype=np.float32)
+    queries += 0.05 * rng.standard_normal(queries.shape).astype(np.float32)
+    faiss.normalize_L2(queries)
+    n, dim = vectors.shape
+    print(f"库向量: {n} x {dim}，查询: {len(queries)}，k={args.k}，索引类型: {args.index_type}")
+
+    flat = add_in_blocks(build_index("flat", dim), vectors)
+    _, ground_truth = flat.search(queries, args.k)
+    del flat
+
+    reports = []
+    for compression in args.compressions.split(","):
+        start = time.perf_counter()
+        index = train_index(build_index(args.index_type, dim, n, compression), vectors)
+        add_in_blocks(index, vectors)
+        configure_search(index)
+        build_s = time.perf_counter() - start
+        size = bytes_per_vector(index)
+
+        modes = [("none", None, 1)]
+        if args.rerank_factor > 0 and compression != "none":
+            modes.append(("exact", vectors, args.rerank_factor))
+        for rerank, rerank_vectors, factor in modes:
+            result, latency = measure(index, queries, args.k, rerank_vectors, factor)
+            report = {"compression": compression, "rerank": rerank, "bytes_per_vector": round(size, 1),
+                      "build_s": round(build_s, 2), f"recall@{args.k}": round(recall_at_k(ground_truth, result), 4),
+                      **latency}
+            reports.append(report)
+            print(json.dumps(report, ensure_ascii=False))
+        del index
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"n": n, "dim": dim, "k": args.k, "index_type": args.index_type, "results": reports},
+                      f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
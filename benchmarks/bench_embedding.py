@@ -0,0 +1,116 @@
+"""嵌入后端（torch / onnx / onnx_int8）的吞吐量和精度对比
+
+对同一批合成中文片段，测量每个后端的加载时间、批量编码吞吐量（片段/秒）和单条查询的编码延迟；
+以torch后端的向量为基准，统计逐条余弦相似度和检索的recall@k（用各自的向量在片段中检索top-k，与torch的结果比较）。
+onnx类后端需要先运行 python download_models.py 导出模型，未导出或未安装依赖的后端跳过。
+
+用法:
+    python benchmarks/bench_embedding.py --n 2000 --queries 200 --json embedding_report.json
+    python benchmarks/bench_embedding.py --backends onnx onnx_int8 --batch-size 32
+"""
+import os
+import sys
+import time
+import json
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from modules.embedding_backends import EMBEDDING_BACKENDS, load_embedding_model, onnx_model_file
+from bench_suite import synthetic_texts, synthetic_queries, local_model_path, percentiles, environment
+from bench_index import recall_at_k
+
+
+def unit(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def top_k(corpus, queries, k):
+    return np.argsort(-(queries @ corpus.T), axis=1)[:, :k]
+
+
+def run_backend(backend, model_path, texts, queries, batch_size, k, reference=None):
+    """测量一个后端；reference为torch后端的(片段向量, 查询向量)，提供时计算精度"""
+    timings = {}
+    start = time.perf_counter()
+    model = load_embedding_model(backend, model_path, timings=timings)
+    load_seconds = time.perf_counter() - start
+    # 预热（ONNX Runtime首次运行时初始化内存池，torch首次运行较慢）
+    model.encode(texts[:batch_size], batch_size=batch_size)
+
+    start = time.perf_counter()
+    corpus = model.encode(texts, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+    elapsed = time.perf_counter() - start
+
+    latencies, query_vectors = [], []
+    for query in queries:
+        start = time.perf_counter()
+        query_vectors.append(model.encode([query], batch_size=1, convert_to_numpy=True)[0])
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    result = {"backend": backend, "load_seconds": round(load_seconds, 3), "chunks": len(texts),
+              "chunks_per_second": round(len(texts) / elapsed, 1), "query": percentiles(latencies)}
+    corpus, query_vectors = unit(corpus), unit(query_vectors)
+    if reference is not None:
+        reference_corpus, reference_queries = reference
+        cosine = np.concatenate([(corpus * reference_corpus).sum(axis=1),
+                                 (query_vectors * reference_queries).sum(axis=1)])
+        result["min_cosine"] = round(float(cosine.min()), 5)
+        result["mean_cosine"] = round(float(cosine.mean()), 5)
+        result[f"recall@{k}"] = round(recall_at_k(top_k(reference_corpus, reference_queries, k),
+                                                  top_k(corpus, query_vectors, k)), 4)
+    return result, (corpus, query_vectors)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="嵌入后端的吞吐量和精度对比")
+    parser.add_argument("--backends", nargs="+", default=list(EMBEDDING_BACKENDS), choices=EMBEDDING_BACKENDS)
+    parser.add_argument("--model", default=None, help="本地模型目录，默认为models/下的EMBEDDING_MODEL")
+    parser.add_argument("--n", type=int, default=2000, help="编码的片段数")
+    parser.add_argument("--queries", type=int, default=200, help="单条编码的查询数")
+    parser.add_argument("--batch-size", type=int, default=config.EMBEDDING_BATCH_SIZE, help="批量编码的批大小")
+    parser.add_argument("--k", type=int, default=config.TOP_K_RETRIEVAL, help="recall@k的k")
+    parser.add_argument("--json", default=None, help="把结果写入JSON文件")
+    args = parser.parse_args(argv)
+
+    model_path = args.model or local_model_path()
+    if not model_path:
+        print("models/ 下没有本地嵌入模型，请先运行 python download_models.py")
+        return 1
+    texts = synthetic_texts(0, args.n)
+    queries = synthetic_queries(args.queries, args.n)["question"]
+
+    results, reference = [], None
+    # torch后端先测，作为精度基准
+    for backend in sorted(args.backends, key=lambda name: name != "torch"):
+        if backend != "torch" and not os.path.exists(onnx_model_file(model_path, backend)):
+            print(f"{backend}: 未找到导出的ONNX模型，跳过（先运行 python download_models.py）")
+            continue
+        try:
+            result, vectors = run_backend(backend, model_path, texts, queries, args.batch_size, args.k, reference)
+        except ImportError as e:
+            print(f"{backend}: 缺少依赖（{e}），跳过")
+            continue
+        if backend == "torch":
+            reference = vectors
+        results.append(result)
+        accuracy = ""
+        if "min_cosine" in result:
+            accuracy = (f"  余弦 最低{result['min_cosine']:.4f}/平均{result['mean_cosine']:.4f}"
+                        f"  recall@{args.k}={result[f'recall@{args.k}']:.3f}")
+        print(f"{backend:>10}: 加载 {result['load_seconds']:.2f}s  {result['chunks_per_second']:>8.1f} 片段/秒  "
+              f"查询 p50={result['query']['p50_ms']:.2f}ms p99={result['query']['p99_ms']:.2f}ms{accuracy}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"environment": environment(), "args": vars(args), "results": results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
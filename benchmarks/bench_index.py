@@ -0,0 +1,119 @@
+"""索引类型的召回率/延迟对比
+
+以flat（精确检索）的结果为基准，统计各索引类型在不同nprobe/efSearch下的recall@k和单条查询延迟。
+
+用法:
+    python benchmarks/bench_index.py --n 200000 --dim 768 --k 3
+    python benchmarks/bench_index.py --store vector_store   # 使用现有知识库的向量
+"""
+import os
+import sys
+import time
+import json
+import argparse
+import numpy as np
+import faiss
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.index_factory import build_index, configure_search, train_index, add_in_blocks, INDEX_TYPES
+
+
+def synthetic_vectors(n, dim, n_clusters=256, seed=0):
+    """生成带聚类结构的单位向量，近似真实文本嵌入的分布"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, n_clusters, n)
+    vectors = centers[labels] + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def load_store_vectors(store_dir):
+    """读取知识库中已提交的向量"""
+    with open(os.path.join(store_dir, "manifest.json"), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    return np.memmap(os.path.join(store_dir, "vectors.f32"), dtype=np.float32, mode='r',
+                     shape=(manifest["ntotal"], manifest["dim"]))
+
+
+def recall_at_k(ground_truth, result):
+    """结果中命中精确top-k的比例"""
+    hits = sum(len(set(gt) & set(res[res >= 0])) for gt, res in zip(ground_truth, result))
+    return hits / ground_truth.size
+
+
+def measure(index, queries, k):
+    """逐条查询，统计延迟分位数（模拟在线单条检索）"""
+    latencies = []
+    results = np.empty((len(queries), k), dtype=np.int64)
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        _, indices = index.search(queries[i:i + 1], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results[i] = indices[0]
+    latencies = np.array(latencies)
+    return results, {
+        "p50_ms": round(float(np.percentile(latencies, 50)), 4),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 4),
+        "qps": round(float(1000 / latencies.mean()), 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="索引类型的召回率/延迟对比")
+    parser.add_argument("--n", type=int, default=100000, help="合成向量数量")
+    parser.add_argument("--dim", type=int, default=768, help="合成向量维度")
+    parser.add_argument("--store", help="使用该向量存储目录中的向量代替合成数据")
+    parser.add_argument("--queries", type=int, default=500, help="查询数量")
+    parser.add_argument("--k", type=int, default=3, help="recall@k中的k")
+    parser.add_argument("--types", default=",".join(INDEX_TYPES), help="参与对比的索引类型")
+    parser.add_argument("--nprobe", default="1,4,16,64", help="IVF类索引测试的nprobe取值")
+    parser.add_argument("--ef", default="16,64,256", help="HNSW测试的efSearch取值")
+    parser.add_argument("--json", help="把结果写入该JSON文件")
+    args = parser.parse_args()
+
+    if args.store:
+        vectors = load_store_vectors(args.store)
+    else:
+        vectors = synthetic_vectors(args.n + args.queries, args.dim)
+    # 查询取自数据分布本身（加少量扰动），其余作为库向量
+    rng = np.random.default_rng(1)
+    queries = np.ascontiguousarray(vectors[rng.choice(len(vectors), args.queries, replace=False)], dtype=np.float32)
+    queries += 0.05 * rng.standard_normal(queries.shape).astype(np.float32)
+    faiss.normalize_L2(queries)
+    n, dim = vectors.shape
+    print(f"库向量: {n} x {dim}，查询: {len(queries)}，k={args.k}")
+
+    flat = add_in_blocks(build_index("flat", dim), vectors)
+    _, ground_truth = flat.search(queries, args.k)
+
+    reports = []
+    for index_type in args.types.split(","):
+        start = time.perf_counter()
+        index = train_index(build_index(index_type, dim, n), vectors)
+        add_in_blocks(index, vectors)
+        build_s = time.perf_counter() - start
+
+        if index_type in ("ivf_flat", "ivf_pq"):
+            settings = [{"nprobe": int(v)} for v in args.nprobe.split(",")]
+        elif index_type == "hnsw":
+            settings = [{"ef_search": int(v)} for v in args.ef.split(",")]
+        else:
+            settings = [{}]
+
+        for params in settings:
+            configure_search(index, **params)
+            result, latency = measure(index, queries, args.k)
+            report = {"index_type": index_type, **params, "build_s": round(build_s, 2),
+                      f"recall@{args.k}": round(recall_at_k(ground_truth, result), 4), **latency}
+            reports.append(report)
+            print(json.dumps(report, ensure_ascii=False))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"n": n, "dim": dim, "k": args.k, "results": reports}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
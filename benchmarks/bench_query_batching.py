@@ -0,0 +1,151 @@
+"""检索微批的吞吐量/延迟对比
+
+在不同并发数下比较两种方式：每个请求各自调用VectorStore.search（逐条编码、逐条检索），
+以及通过QueryBatcher合并为一次编码和一次index.search。报告每秒查询数和p50/p99延迟。
+
+默认使用模拟的嵌入模型：每次encode调用有固定开销，再加上与条数成正比的开销。与真实模型一样，
+计算期间释放GIL，但同一时刻只进行一次前向计算（一次前向已占满所有CPU核心）。
+指定--model时使用本地的SentenceTransformer模型。
+
+用法:
+    python benchmarks/bench_query_batching.py --chunks 20000 --concurrency 1 4 16 64
+    python benchmarks/bench_query_batching.py --model models/shibing624_text2vec-base-chinese --json batching.json
+"""
+import io
+import os
+import sys
+import time
+import json
+import zlib
+import shutil
+import argparse
+import tempfile
+import threading
+import contextlib
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.vector_store import VectorStore
+from modules.query_batcher import QueryBatcher
+
+
+class SimulatedEmbeddingModel:
+    """模拟的嵌入模型：按文本哈希生成固定的单位向量，耗时 = call_ms + item_ms * 条数，各次调用串行执行"""
+    def __init__(self, dim=768, call_ms=8.0, item_ms=0.5):
+        self.dim = dim
+        self.call_ms = call_ms
+        self.item_ms = item_ms
+        self.calls = 0
+        self._compute_lock = threading.Lock()
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True, show_progress_bar=False, **kwargs):
+        with self._compute_lock:
+            self.calls += 1
+            time.sleep((self.call_ms + self.item_ms * len(texts)) / 1000)
+        vectors = np.empty((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            vectors[i] = np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(self.dim)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors
+
+
+def build_store(store_dir, model, n_chunks):
+    """在临时目录中构建一个含n_chunks个片段的知识库（构建期间不计入模拟开销）"""
+    call_ms, item_ms = getattr(model, "call_ms", 0), getattr(model, "item_ms", 0)
+    if isinstance(model, SimulatedEmbeddingModel):
+        model.call_ms = model.item_ms = 0
+    store = VectorStore(embedding_model=model, store_dir=store_dir)
+    texts = [f"第{i}段：这是用于基准测试的合成文本片段，编号{i}。" for i in range(n_chunks)]
+    store.add_texts(texts, "benchmark", batch_size=1024)
+    if isinstance(model, SimulatedEmbeddingModel):
+        model.call_ms, model.item_ms = call_ms, item_ms
+    return store
+
+
+def run_level(search_fn, concurrency, queries_per_worker, tag):
+    """concurrency个线程各自连续发出queries_per_worker个不重复的查询，返回吞吐量和延迟分位数"""
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(worker_id):
+        local = []
+        for i in range(queries_per_worker):
+            query = f"{tag}-{worker_id}-{i} 合成查询"
+            start = time.perf_counter()
+            search_fn(query)
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(w,)) for w in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies = np.array(latencies) * 1000
+    return {
+        "qps": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99))
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="检索微批基准测试")
+    parser.add_argument("--chunks", type=int, default=20000, help="知识库片段数")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64], help="并发数")
+    parser.add_argument("--queries", type=int, default=200, help="每个并发级别的总查询数")
+    parser.add_argument("--model", default=None, help="本地SentenceTransformer模型目录，默认使用模拟模型")
+    parser.add_argument("--call-ms", type=float, default=8.0, help="模拟模型每次encode的固定开销（毫秒）")
+    parser.add_argument("--item-ms", type=float, default=0.5, help="模拟模型每条文本的开销（毫秒）")
+    parser.add_argument("--batch-size", type=int, default=32, help="微批最大查询数")
+    parser.add_argument("--wait-ms", type=float, default=5.0, help="微批等待窗口（毫秒）")
+    parser.add_argument("--json", default=None, help="把结果写入JSON文件")
+    args = parser.parse_args(argv)
+
+    if args.model:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(args.model)
+    else:
+        model = SimulatedEmbeddingModel(call_ms=args.call_ms, item_ms=args.item_ms)
+
+    store_dir = tempfile.mkdtemp(prefix="bench_batching_")
+    report = {"chunks": args.chunks, "model": args.model or "simulated", "levels": []}
+    try:
+        # 向量存储每次检索都会打印日志，测试期间屏蔽
+        with contextlib.redirect_stdout(io.StringIO()):
+            store = build_store(store_dir, model, args.chunks)
+        batcher = QueryBatcher(store, max_batch_size=args.batch_size, max_wait_ms=args.wait_ms)
+
+        print(f"{'并发':>6} {'方式':>8} {'QPS':>10} {'p50(ms)':>10} {'p99(ms)':>10} {'平均批大小':>10}")
+        for concurrency in args.concurrency:
+            per_worker = max(1, args.queries // concurrency)
+            for mode in ("direct", "batched"):
+                batcher.stats = {"queries": 0, "batches": 0}
+                search_fn = store.search if mode == "direct" else batcher.search
+                with contextlib.redirect_stdout(io.StringIO()):
+                    result = run_level(search_fn, concurrency, per_worker, f"{mode}{concurrency}")
+                stats = batcher.stats
+                result.update(concurrency=concurrency, mode=mode,
+                              avg_batch=stats["queries"] / stats["batches"] if stats["batches"] else 1.0)
+                report["levels"].append(result)
+                print(f"{concurrency:>6} {mode:>8} {result['qps']:>10.1f} {result['p50_ms']:>10.1f} "
+                      f"{result['p99_ms']:>10.1f} {result['avg_batch']:>10.1f}")
+        batcher.close()
+    finally:
+        shutil.rmtree(store_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+"""端到端基准测试：导入吞吐量、检索延迟和大模型流式输出
+
+不依赖网络和DashScope，可在任意机器上重复运行，输出JSON供不同提交之间对比：
+- 导入：用确定性的合成中文语料（按主题组合的句子，夹带编号）逐级导入同一个知识库，
+  记录每一级的片段/秒，以及检索前等待后台压缩、索引升级完成的时间
+- 检索：每一级导入完成后，分别测量自然语言问题和编号类查询（走关键词快速路径）的p50/p99延迟
+- 嵌入模型：默认使用确定性的哈希嵌入（按字符哈希累加随机向量，相同文本得到相同向量，
+  共享字词的文本相似度更高），models/目录下有本地模型时，另外用真实模型测一组较小的规模
+- 大模型：启动tools/fake_openai_server，按设定的首token延迟和输出速率回放流式回答，
+  测量LLMService在不同并发下的首token时间、总耗时和每秒token数
+
+用法:
+    python benchmarks/bench_suite.py --json suite.json
+    python benchmarks/bench_suite.py --sizes 10000 100000 --queries 200 --skip-llm
+    python benchmarks/bench_suite.py --sizes 10000 --baseline suite_main.json   # 与之前的结果对比
+"""
+import io
+import os
+import sys
+import time
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import contextlib
+import subprocess
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import config
+from modules.vector_store import VectorStore
+from modules.index_factory import index_type_of, compression_of
+
+# 合成语料的主题词、修饰词和句式，组合后得到风格接近说明文档的中文片段
+_TOPICS = ["数据库", "向量检索", "缓存", "分布式事务", "消息队列", "负载均衡", "日志采集", "权限管理",
+           "全文索引", "模型训练", "文件存储", "接口网关", "任务调度", "监控告警", "配置中心", "容器编排"]
+_ACTIONS = ["初始化", "扩容", "迁移", "备份", "恢复", "升级", "压缩", "清理", "校验", "重建"]
+_QUALIFIERS = ["在高并发场景下", "在夜间维护窗口内", "在单机部署时", "在跨机房部署时", "在数据量增长后",
+               "在首次上线前", "在故障切换后", "在低内存环境中"]
+_SENTENCES = [
+    "{q}，{t}的{a}需要先确认当前版本和依赖关系。",
+    "{t}{a}失败时会返回错误码{code}，请检查配置文件中的相关参数。",
+    "运维人员{q}执行{t}{a}，通常耗时{n}分钟左右。",
+    "{t}的{a}流程分为准备、执行和验证三个阶段，每个阶段都会记录日志。",
+    "如果{t}出现异常，应优先查看编号为{code}的告警记录，再决定是否{a}。",
+    "{q}，建议把{t}的{a}拆分为多个小批次，避免影响线上服务。",
+]
+
+
+def synthetic_texts(start, count, seed=0):
+    """生成编号为[start, start+count)的合成片段；同一编号在任何批次中生成的文本都相同"""
+    texts = []
+    for i in range(start, start + count):
+        rng = np.random.default_rng((seed, i))
+        parts = []
+        for _ in range(int(rng.integers(3, 6))):
+            template = _SENTENCES[int(rng.integers(len(_SENTENCES)))]
+            parts.append(template.format(
+                t=_TOPICS[int(rng.integers(len(_TOPICS)))], a=_ACTIONS[int(rng.integers(len(_ACTIONS)))],
+                q=_QUALIFIERS[int(rng.integers(len(_QUALIFIERS)))], n=int(rng.integers(1, 60)),
+                code=f"E{i:07d}"))
+        texts.append("".join(parts))
+    return texts
+
+
+def synthetic_queries(count, n_chunks, seed=1):
+    """生成两类查询：自然语言问题，以及知识库中存在的错误码（编号类查询）"""
+    rng = np.random.default_rng(seed)
+    questions = []
+    for i in range(count):
+        topic = _TOPICS[int(rng.integers(len(_TOPICS)))]
+        action = _ACTIONS[int(rng.integers(len(_ACTIONS)))]
+        qualifier = _QUALIFIERS[int(rng.integers(len(_QUALIFIERS)))]
+        # 末尾的序号保证每个查询都不同，不会命中查询向量缓存和检索结果缓存
+        questions.append(f"{qualifier}怎么做{topic}{action}？（{i}）")
+    codes = [f"E{int(i):07d}" for i in rng.integers(0, n_chunks, count)]
+    return {"question": questions, "identifier": codes}
+
+
+class HashingEmbeddingModel:
+    """确定性的哈希嵌入：每个字符（及相邻两字）哈希到一个固定的随机向量，累加后归一化
+
+    与SentenceTransformer的encode接口相同。不模拟真实模型的计算开销，测得的是存储和索引本身的吞吐量。
+    """
+    def __init__(self, dim=256, buckets=1 << 15, seed=0):
+        self.dim = dim
+        self.buckets = buckets
+        self.table = np.random.default_rng(seed).standard_normal((buckets, dim)).astype(np.float32)
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True, show_progress_bar=False, **kwargs):
+        vectors = np.empty((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.int64)
+            if len(codes) == 0:
+                codes = np.zeros(1, dtype=np.int64)
+            grams = np.concatenate([codes, codes[:-1] * 65599 + codes[1:]]) % self.buckets
+            vectors[row] = self.table[grams].sum(axis=0)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors
+
+
+def local_model_path():
+    """models/目录下已下载的嵌入模型路径，不存在时返回None"""
+    path = os.path.join(config.MODEL_DIR, config.EMBEDDING_MODEL.replace('/', '_'))
+    return path if os.path.isdir(path) else None
+
+
+def percentiles(latencies_ms):
+    latencies_ms = np.asarray(latencies_ms, dtype=np.float64)
+    return {
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 3),
+        "mean_ms": round(float(latencies_ms.mean()), 3)
+    }
+
+
+def wait_for_background(store, timeout=3600.0):
+    """等待后台的压缩、索引升级和关键词索引补建完成，返回等待的秒数"""
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        with store._lock:
+            busy = store._compacting or store._promoting or store._lexical_catching_up
+        if not busy:
+            break
+        time.sleep(0.05)
+    return time.perf_counter() - start
+
+
+def measure_queries(store, queries, top_k):
+    """逐条检索，返回延迟分位数和平均命中数"""
+    latencies, hits = [], 0
+    for query in queries:
+        start = time.perf_counter()
+        results = store.search(query, top_k=top_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len(results)
+    report = percentiles(latencies)
+    report["avg_hits"] = round(hits / max(len(queries), 1), 2)
+    return report
+
+
+def run_store_benchmark(model, model_name, sizes, n_queries, batch_size, doc_chunks, top_k):
+    """逐级导入同一个知识库，每到一级测量一次检索延迟"""
+    store_dir = tempfile.mkdtemp(prefix="bench_suite_")
+    levels = []
+    try:
+        # 向量存储的导入和检索都会打印日志，测试期间屏蔽
+        with contextlib.redirect_stdout(io.StringIO()):
+            store = VectorStore(embedding_model=model, store_dir=store_dir)
+        done = 0
+        for size in sorted(sizes):
+            ingest_s = 0.0
+            while done < size:
+                # 每个"文档"doc_chunks个片段，文本在计时外生成
+                count = min(doc_chunks, size - done)
+                texts = synthetic_texts(done, count)
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    store.add_texts(texts, f"bench_{done // doc_chunks}.txt", batch_size=batch_size)
+                ingest_s += time.perf_counter() - start
+                done += count
+            added = size - (levels[-1]["ntotal"] if levels else 0)
+            with contextlib.redirect_stdout(io.StringIO()):
+                settle_s = wait_for_background(store)
+                queries = synthetic_queries(n_queries, size, seed=size)
+                level = {
+                    "model": model_name,
+                    "ntotal": size,
+                    "ingest_chunks": added,
+                    "ingest_s": round(ingest_s, 3),
+                    "ingest_chunks_per_s": round(added / ingest_s, 1) if ingest_s > 0 else None,
+                    "settle_s": round(settle_s, 3),
+                    "index": f"{index_type_of(store.index)}/{compression_of(store.index)}",
+                    "queries": {kind: measure_queries(store, items, top_k) for kind, items in queries.items()}
+                }
+            levels.append(level)
+            question, identifier = level["queries"]["question"], level["queries"]["identifier"]
+            print(f"[{model_name}] {size:>9} 片段  导入 {level['ingest_chunks_per_s']:>9} 片段/秒  "
+                  f"索引 {level['index']:<12} 问题 p50/p99 {question['p50_ms']:.2f}/{question['p99_ms']:.2f} ms  "
+                  f"编号 p50/p99 {identifier['p50_ms']:.2f}/{identifier['p99_ms']:.2f} ms")
+    finally:
+        shutil.rmtree(store_dir, ignore_errors=True)
+    return levels
+
+
+def run_llm_benchmark(concurrency_levels, requests_per_level, first_token_delay, tokens_per_second, answer_tokens):
+    """用模拟服务回放流式回答，测量LLMService的首token时间、总耗时和输出速率"""
+    import modules.llm_service as llm_service
+    from tools.fake_openai_server import start_server
+
+    answer = ("模拟回答" * (answer_tokens // 4 + 1))[:answer_tokens]
+    server = start_server(answer=answer, first_token_delay=first_token_delay, tokens_per_second=tokens_per_second)
+    levels = []
+    try:
+        service = llm_service.LLMService()
+        service.base_url = server.base_url
+        service.update_api_key("bench")
+        messages = [{"role": "user", "content": "基准测试"}]
+        for concurrency in concurrency_levels:
+            samples = []
+            lock = threading.Lock()
+
+            def worker(count):
+                for _ in range(count):
+                    start = time.perf_counter()
+                    first = []
+                    tokens = []
+
+                    def callback(delta, is_done):
+                        if not is_done and delta:
+                            if not first:
+                                first.append(time.perf_counter())
+                            tokens.append(delta)
+
+                    success = service.get_streaming_completion(messages, callback)
+                    end = time.perf_counter()
+                    with lock:
+                        samples.append((success, (first[0] if first else end) - start, end - start, len(tokens)))
+
+            per_worker = max(1, requests_per_level // concurrency)
+            threads = [threading.Thread(target=worker, args=(per_worker,)) for _ in range(concurrency)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+
+            ok = [sample for sample in samples if sample[0] is True]
+            ttft = [sample[1] * 1000 for sample in ok] or [0.0]
+            total = [sample[2] * 1000 for sample in ok] or [0.0]
+            level = {
+                "concurrency": concurrency,
+                "requests": len(samples),
+                "errors": len(samples) - len(ok),
+                "ttft": percentiles(ttft),
+                "total": percentiles(total),
+                "tokens_per_s": round(sum(sample[3] for sample in ok) / elapsed, 1),
+                "requests_per_s": round(len(ok) / elapsed, 2)
+            }
+            levels.append(level)
+            print(f"[llm] 并发 {concurrency:>4}  首token p50/p99 {level['ttft']['p50_ms']:.1f}/"
+                  f"{level['ttft']['p99_ms']:.1f} ms  总耗时 p50 {level['total']['p50_ms']:.1f} ms  "
+                  f"{level['tokens_per_s']} token/秒  错误 {level['errors']}")
+    finally:
+        server.stop()
+    return levels
+
+
+def environment():
+    """运行环境和影响结果的配置，写入报告便于对比"""
+    import faiss
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "faiss": getattr(faiss, "__version__", None),
+        "config": {name: getattr(config, name, None) for name in (
+            "INDEX_TYPE", "AUTO_INDEX_TYPE", "INDEX_PROMOTION_THRESHOLD", "VECTOR_COMPRESSION", "VECTOR_RERANK",
+            "HYBRID_SEARCH_ENABLED", "LEXICAL_FAST_PATH", "EMBEDDING_BACKEND", "EMBEDDING_BATCH_SIZE",
+            "TOP_K_RETRIEVAL")}
+    }
+
+
+def compare(report, baseline):
+    """与基准报告中相同模型、相同规模的结果对比，打印变化比例"""
+    previous = {(level["model"], level["ntotal"]): level for level in baseline.get("store", [])}
+    print(f"\n与 {baseline.get('environment', {}).get('commit')} 的结果对比（正数表示变慢）:")
+    for level in report["store"]:
+        old = previous.get((level["model"], level["ntotal"]))
+        if old is None:
+            continue
+        changes = []
+        if old.get("ingest_chunks_per_s") and level.get("ingest_chunks_per_s"):
+            changes.append(f"导入 {old['ingest_chunks_per_s'] / level['ingest_chunks_per_s'] - 1:+.1%}")
+        for kind, current in level["queries"].items():
+            before = old.get("queries", {}).get(kind)
+            if before and before["p50_ms"] > 0 and before["p99_ms"] > 0:
+                changes.append(f"{kind} p50 {current['p50_ms'] / before['p50_ms'] - 1:+.1%} "
+                               f"p99 {current['p99_ms'] / before['p99_ms'] - 1:+.1%}")
+        print(f"[{level['model']}] {level['ntotal']:>9} 片段  " + "  ".join(changes))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="导入吞吐量、检索延迟和大模型流式输出的基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000],
+                        help="逐级导入到的片段数")
+    parser.add_argument("--dim", type=int, default=256, help="哈希嵌入的维度")
+    parser.add_argument("--queries", type=int, default=500, help="每一级每类查询的数量")
+    parser.add_argument("--top-k", type=int, default=config.TOP_K_RETRIEVAL, help="每次检索返回的片段数")
+    parser.add_argument("--batch-size", type=int, default=config.EMBEDDING_BATCH_SIZE, help="导入时的编码批大小")
+    parser.add_argument("--doc-chunks", type=int, default=2000, help="每个合成文档的片段数")
+    parser.add_argument("--model", default="auto",
+                        help="真实嵌入模型目录；auto表示models/下有模型时使用，none表示不测")
+    parser.add_argument("--backend", default=config.EMBEDDING_BACKEND, choices=("torch", "onnx", "onnx_int8"),
+                        help="真实嵌入模型的计算后端")
+    parser.add_argument("--model-sizes", type=int, nargs="+", default=[10000], help="真实模型逐级导入到的片段数")
+    parser.add_argument("--skip-llm", action="store_true", help="不测大模型流式输出")
+    parser.add_argument("--llm-concurrency", type=int, nargs="+", default=[1, 8, 32], help="大模型请求并发数")
+    parser.add_argument("--llm-requests", type=int, default=64, help="每个并发级别的请求数")
+    parser.add_argument("--first-token-delay", type=float, default=0.3, help="模拟服务的首token延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="模拟服务的输出速率")
+    parser.add_argument("--answer-tokens", type=int, default=200, help="模拟回答的token数")
+    parser.add_argument("--baseline", default=None, help="之前保存的JSON报告，打印与其相比的变化")
+    parser.add_argument("--json", default=None, help="把结果写入JSON文件")
+    args = parser.parse_args(argv)
+
+    report = {"environment": environment(), "args": vars(args), "store": [], "llm": []}
+
+    report["store"].extend(run_store_benchmark(
+        HashingEmbeddingModel(args.dim), f"hashing-{args.dim}", args.sizes, args.queries,
+        args.batch_size, args.doc_chunks, args.top_k))
+
+    model_path = local_model_path() if args.model == "auto" else (None if args.model == "none" else args.model)
+    if model_path:
+        from modules.embedding_backends import load_embedding_model
+        model = load_embedding_model(args.backend, model_path)
+        model_name = os.path.basename(model_path.rstrip("/\\"))
+        if args.backend != "torch":
+            model_name = f"{model_name}-{args.backend}"
+        report["store"].extend(run_store_benchmark(
+            model, model_name, args.model_sizes, args.queries,
+            args.batch_size, args.doc_chunks, args.top_k))
+    elif args.model == "auto":
+        print("models/ 下没有本地嵌入模型，跳过真实模型的测试")
+
+    if not args.skip_llm:
+        report["llm"] = run_llm_benchmark(args.llm_concurrency, args.llm_requests, args.first_token_delay,
+                                          args.tokens_per_second, args.answer_tokens)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            compare(report, json.load(f))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -24,25 +24,131 @@ API_KEY = ""  # 移除硬编码的API Key
 BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
 MODEL_NAME = "qwen-plus"
 
+# 大模型请求配置
+LLM_MAX_CONCURRENT_REQUESTS = 4  # 同时进行的大模型请求数上限，超出的请求排队等待
+LLM_MAX_CONNECTIONS = 10  # 共享HTTP连接池的最大连接数
+LLM_MAX_KEEPALIVE_CONNECTIONS = 5  # 连接池中保持的空闲连接数
+LLM_CONNECT_TIMEOUT = 10  # 建立连接的超时（秒）
+LLM_FIRST_TOKEN_TIMEOUT = 30  # 从发出请求到收到第一个token的超时（秒），超时后重试
+LLM_TOTAL_TIMEOUT = 300  # 单次回答（含重试）的总超时（秒）
+LLM_MAX_RETRIES = 3  # 429、5xx、连接错误和首token超时的最多重试次数（开始输出后不再重试）
+LLM_RETRY_BASE_DELAY = 0.5  # 指数退避的基础等待时间（秒），实际等待在[0, base*2^n]中随机取值
+LLM_RETRY_MAX_DELAY = 20  # 单次重试的最长等待时间（秒），服务端的Retry-After优先
+LLM_HEDGE_ENABLED = False  # 首token迟迟未到时是否再发一个相同请求，取先返回的一个
+LLM_HEDGE_DELAY = None  # 发出对冲请求前的等待时间（秒），None表示取最近首token延迟的p95
+LLM_HEDGE_DEFAULT_DELAY = 3.0  # 首token延迟样本不足时使用的对冲等待时间（秒）
+LLM_HEDGE_MIN_SAMPLES = 20  # 用p95作为对冲等待时间所需的最少样本数
+
 # 向量模型配置
 EMBEDDING_MODEL = "shibing624/text2vec-base-chinese"  # 中文向量模型
+EMBEDDING_BACKEND = "torch"  # 嵌入计算后端：torch（PyTorch）/ onnx（ONNX Runtime）/ onnx_int8（ONNX Runtime + int8动态量化）；onnx类需先运行 python download_models.py 导出，找不到导出的模型时使用torch
+ONNX_NUM_THREADS = 0  # ONNX Runtime每次推理使用的线程数，0表示按CPU核数
+ONNX_MIN_COSINE = 0.999  # 导出后验证：onnx与PyTorch模型的向量余弦相似度不能低于此值
+ONNX_INT8_MIN_COSINE = 0.98  # 同上，int8量化模型（量化有少量精度损失）
 
 # 路径配置 - 使用运行时路径函数
 KNOWLEDGE_BASE_DIR = get_resource_path("knowledge_base")
 VECTOR_STORE_DIR = get_resource_path("vector_store")
 MODEL_DIR = get_resource_path("models")
 
-# 确保目录存在
-os.makedirs(KNOWLEDGE_BASE_DIR, exist_ok=True)
-os.makedirs(VECTOR_STORE_DIR, exist_ok=True)
-os.makedirs(MODEL_DIR, exist_ok=True)
+def ensure_directories():
+    """确保目录存在并记录路径（由main在启动时调用一次，导入config本身不产生副作用）"""
+    os.makedirs(KNOWLEDGE_BASE_DIR, exist_ok=True)
+    os.makedirs(VECTOR_STORE_DIR, exist_ok=True)
+    os.makedirs(MODEL_DIR, exist_ok=True)
 
-# 打印调试信息
-print(f"知识库目录: {KNOWLEDGE_BASE_DIR}")
-print(f"向量存储目录: {VECTOR_STORE_DIR}")
-print(f"模型目录: {MODEL_DIR}")
+    # 记录调试信息（config不依赖modules，直接使用标准库的日志记录器）
+    import logging
+    logger = logging.getLogger("rag.config")
+    logger.info(f"知识库目录: {KNOWLEDGE_BASE_DIR}")
+    logger.info(f"向量存储目录: {VECTOR_STORE_DIR}")
+    logger.info(f"模型目录: {MODEL_DIR}")
 
 # RAG配置
 CHUNK_SIZE = 500
 CHUNK_OVERLAP = 50
-TOP_K_RETRIEVAL = 3
\ No newline at end of file
+TOP_K_RETRIEVAL = 3
+CONTEXT_TOKEN_BUDGET = 3000  # 提示词中参考信息的token预算（按估算值），超出时丢弃排名靠后的内容
+
+# 导入配置
+EMBEDDING_BATCH_SIZE = 64  # 每批编码并写入索引的文本片段数，决定导入时的峰值内存
+
+# 向量存储持久化配置
+COMPACT_MIN_PENDING = 2000  # 快照之后至少积累这么多向量才触发后台压缩
+COMPACT_RATIO = 0.5  # 积累量超过快照规模的这个比例时触发压缩，保证压缩的均摊成本为常数
+
+# 知识库集合配置
+DEFAULT_COLLECTION = "default"  # 默认集合，数据直接存放在VECTOR_STORE_DIR下（与旧版本的目录结构相同）；其他集合在VECTOR_STORE_DIR/collections/<名称>下
+COLLECTION_SEARCH_WORKERS = 8  # 跨集合检索时并行检索的线程数（FAISS检索期间释放GIL）
+COLLECTION_IDLE_UNLOAD = 1800  # 集合超过这么多秒未被使用时卸载，释放索引占用的内存；0表示不自动卸载，默认集合始终加载
+
+# 索引配置
+INDEX_TYPE = "auto"  # flat / ivf_flat / ivf_pq / hnsw；auto 表示先用 flat，向量数超过阈值后自动升级
+AUTO_INDEX_TYPE = "ivf_flat"  # auto 模式下升级的目标索引类型
+INDEX_PROMOTION_THRESHOLD = 50000  # 向量数超过该值后在后台训练并切换到近似索引
+INDEX_TRAIN_SAMPLE = 100000  # 训练IVF聚类中心时最多抽取的样本数
+IVF_NLIST = 4096  # IVF聚类中心数上限（实际取 min(IVF_NLIST, 4*sqrt(n))）
+IVF_NPROBE = 16  # 检索时访问的聚类中心数，越大召回越高、越慢
+PQ_M = 64  # PQ子空间数（需整除向量维度，不能整除时自动取约数）
+PQ_NBITS = 8  # 每个子空间的编码位数
+HNSW_M = 32  # HNSW每个节点的邻居数
+HNSW_EF_CONSTRUCTION = 200  # HNSW建图时的搜索宽度
+HNSW_EF_SEARCH = 64  # HNSW检索时的搜索宽度，越大召回越高、越慢
+VECTOR_COMPRESSION = "none"  # 索引中向量的存储方式：none(float32) / fp16 / int8 / pq；int8和pq在向量数超过升级阈值后随升级生效
+VECTOR_RERANK = True  # 向量有压缩时，用磁盘上的全精度向量对候选重新计算相似度并排序
+RERANK_FACTOR = 4  # 重排时从索引中取top_k的多少倍候选
+
+# 检索缓存配置
+QUERY_EMBEDDING_CACHE_SIZE = 1024  # 缓存的查询向量条数
+QUERY_EMBEDDING_CACHE_TTL = 3600  # 查询向量缓存有效期（秒）
+SEARCH_RESULT_CACHE_SIZE = 512  # 缓存的检索结果条数，知识库变化时整体失效
+SEARCH_RESULT_CACHE_TTL = 600  # 检索结果缓存有效期（秒）
+
+# 混合检索配置（关键词倒排索引 + 向量检索）
+HYBRID_SEARCH_ENABLED = True  # 是否同时做BM25关键词检索，并与向量检索结果融合
+LEXICAL_NGRAM = 2  # 汉字按几个字切分为检索词（修改后倒排索引会在启动时重建）
+BM25_K1 = 1.2  # BM25词频饱和参数
+BM25_B = 0.75  # BM25长度归一化参数
+LEXICAL_CANDIDATES = 20  # 参与融合的关键词检索候选数
+LEXICAL_MIN_COVERAGE = 0.7  # 关键词命中的片段需覆盖查询词IDF权重的比例，低于该值不作为结果
+RRF_K = 60  # 倒数排名融合（RRF）的平滑常数
+LEXICAL_FAST_PATH = True  # 像编号、错误码的查询只做关键词检索，不计算查询向量（没有命中时仍走向量检索）
+
+# 回答缓存配置
+ANSWER_CACHE_ENABLED = True  # 是否缓存大模型的回答
+ANSWER_CACHE_FILE = os.path.join(VECTOR_STORE_DIR, "answer_cache.sqlite3")
+ANSWER_CACHE_MAX_ENTRIES = 2000  # 最多缓存的回答数，超出时淘汰最久未使用的
+ANSWER_CACHE_TTL = 7 * 24 * 3600  # 回答的有效期（秒）
+ANSWER_CACHE_SIMILARITY = None  # 近似重复提问的查询向量相似度阈值（如0.95），None表示只做精确匹配
+
+# 知识库目录同步配置
+KB_SYNC_ON_STARTUP = True  # 启动时同步知识库目录（只导入新增或变化的文件）
+KB_SYNC_WATCH_INTERVAL = 0  # 大于0时每隔这么多秒轮询一次知识库目录，0表示不轮询
+
+# 批量导入配置
+INGEST_WORKERS = max(1, (os.cpu_count() or 2) - 1)  # 解析和分割文档的进程数
+INGEST_MAX_PENDING = 2 * INGEST_WORKERS  # 最多同时在解析中、尚未写入索引的文件数（背压）
+
+# HTTP服务配置（server.py）
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8000
+SERVER_RETRIEVAL_WORKERS = 32  # 执行检索的线程数（开启微批时线程主要在等待批次结果）
+SERVER_ADMIN_TOKEN = ""  # 导入、删除、卸载接口需要的令牌（请求头 Authorization: Bearer <令牌>），为空时这些接口不可用
+
+# 检索微批配置
+QUERY_BATCH_ENABLED = True  # HTTP服务是否把并发的检索合并为一次编码和一次index.search
+QUERY_BATCH_MAX_SIZE = 32  # 每批最多合并的查询数
+QUERY_BATCH_WAIT_MS = 5  # 收到第一个查询后最多等待这么多毫秒凑批
+
+# 日志与追踪配置
+LOG_LEVEL = "INFO"  # 日志级别：DEBUG时输出每次检索的命中详情，WARNING时只输出警告和错误
+LOG_FORMAT = "text"  # 日志格式：text 或 json（每行一个JSON对象，便于日志系统采集）
+TRACING_ENABLED = False  # 是否记录每次问答各阶段的耗时（关闭时几乎没有开销）；HTTP服务可用--trace开启
+TRACE_FILE = os.path.join(get_resource_path("logs"), "traces.jsonl")  # 每次问答一行的追踪记录，None表示只汇总为指标
+TRACE_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # 耗时直方图的分桶（秒）
+
+# 界面配置
+STREAM_RENDER_INTERVAL_MS = 40  # 流式回答刷新到聊天窗口的最小间隔（毫秒），合并这段时间内收到的所有token
+CHAT_HISTORY_MAX_MESSAGES = 5000  # 内存中保留的聊天消息数，超出时淘汰最早的
+CHAT_RENDER_WINDOW = 200  # 聊天窗口中最多同时渲染的消息数
+CHAT_PAGE_SIZE = 50  # 滚动到顶部或底部时每次加载的消息数
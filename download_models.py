@@ -1,8 +1,12 @@
 import os
 import shutil
+import argparse
 from sentence_transformers import SentenceTransformer
 from transformers import AutoTokenizer, AutoModel
-from config import MODEL_DIR, EMBEDDING_MODEL
+from config import MODEL_DIR, EMBEDDING_MODEL, ONNX_MIN_COSINE, ONNX_INT8_MIN_COSINE
+
+def model_path():
+    return os.path.join(MODEL_DIR, EMBEDDING_MODEL.replace('/', '_'))
 
 def download_models():
     """预下载所有需要的模型到本地目录"""
@@ -28,7 +32,7 @@ def download_models():
     
     # 确保模型被正确保存
     print("保存模型...")
-    model_save_path = os.path.join(MODEL_DIR, EMBEDDING_MODEL.replace('/', '_'))
+    model_save_path = model_path()
     os.makedirs(model_save_path, exist_ok=True)
     
     # 手动保存模型
@@ -70,5 +74,40 @@ def download_models():
                         print(f"复制: {src_file} -> {dst_file}")
                         shutil.copy2(src_file, dst_file)
 
+def export_onnx_models():
+    """把下载的模型导出为ONNX（fp32和int8量化两个版本），并与PyTorch模型对比向量的余弦相似度"""
+    try:
+        import onnxruntime  # noqa: F401
+    except ImportError:
+        print("未安装onnxruntime，跳过ONNX导出（EMBEDDING_BACKEND为torch时不需要）")
+        return None
+    from modules.atomic_io import atomic_write_json
+    from modules.embedding_backends import (export_onnx, load_embedding_model, compare_embeddings,
+                                            onnx_dir, VALIDATION_TEXTS)
+
+    print("导出ONNX模型...")
+    files = export_onnx(model_path())
+    reference = SentenceTransformer(model_path(), device="cpu")
+    thresholds = {"onnx": ONNX_MIN_COSINE, "onnx_int8": ONNX_INT8_MIN_COSINE}
+    report = {}
+    for backend in files:
+        result = compare_embeddings(reference, load_embedding_model(backend, model_path()), VALIDATION_TEXTS)
+        result["threshold"] = thresholds[backend]
+        result["passed"] = result["min_cosine"] >= thresholds[backend]
+        report[backend] = result
+        status = "通过" if result["passed"] else f"低于{thresholds[backend]}，不建议使用该后端"
+        print(f"{backend}: 与PyTorch模型的余弦相似度 最低 {result['min_cosine']:.5f}，"
+              f"平均 {result['mean_cosine']:.5f}（{status}）")
+    # 验证结果和模型放在一起，便于之后查看
+    atomic_write_json(os.path.join(onnx_dir(model_path()), "validation.json"), report)
+    return report
+
 if __name__ == "__main__":
-    download_models()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="下载嵌入模型，并导出ONNX版本")
+    parser.add_argument("--no-onnx", action="store_true", help="不导出ONNX模型")
+    parser.add_argument("--onnx-only", action="store_true", help="不重新下载，只从已下载的模型导出ONNX")
+    args = parser.parse_args()
+    if not args.onnx_only:
+        download_models()
+    if not args.no_onnx:
+        export_onnx_models()
\ No newline at end of file
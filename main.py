@@ -1,6 +1,17 @@
+import time
+_start_time = time.perf_counter()
+
 import os
 import sys
+import multiprocessing
+from config import ensure_directories
+from modules.store_registry import start_warm_up, on_ready, startup_timings, format_startup_report
+from modules.logger import get_logger, setup_logging
 from ui.app_ui import AppUI
+# 界面模块只导入轻量依赖，sentence_transformers、torch、faiss在后台预热时才导入
+startup_timings["import_app"] = time.perf_counter() - _start_time
+
+logger = get_logger(__name__)
 
 def setup_packaged_environment():
     """为打包环境设置必要的配置"""
@@ -17,19 +28,31 @@ def setup_packaged_environment():
             dir_path = os.path.join(app_dir, dir_name)
             if not os.path.exists(dir_path):
                 os.makedirs(dir_path)
-                print(f"创建目录: {dir_path}")
+                logger.info(f"创建目录: {dir_path}")
         
-        print(f"应用程序运行在打包环境中，工作目录: {app_dir}")
+        logger.info(f"应用程序运行在打包环境中，工作目录: {app_dir}")
     else:
-        print(f"应用程序运行在开发环境中，工作目录: {os.getcwd()}")
+        logger.info(f"应用程序运行在开发环境中，工作目录: {os.getcwd()}")
 
 def main():
+    # 设置日志级别和格式（见config中的LOG_LEVEL、LOG_FORMAT）
+    setup_logging()
     # 设置环境
     setup_packaged_environment()
+    ensure_directories()
+    
+    # 在后台加载嵌入模型和索引，窗口先显示出来
+    start_warm_up()
     
     # 启动UI
     app = AppUI()
+    app.update_idletasks()
+    startup_timings["ui_ready"] = time.perf_counter() - _start_time
+    # 预热完成后记录冷启动各阶段耗时
+    on_ready(lambda error: logger.info(format_startup_report()))
     app.mainloop()
 
 if __name__ == "__main__":
+    # 打包后的程序在Windows上启动导入子进程时需要
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
@@ -0,0 +1,159 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+import numpy as np
+from config import (ANSWER_CACHE_FILE, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL,
+                    ANSWER_CACHE_SIMILARITY)
+
+# 规范化查询时去掉的结尾标点
+_TRAILING_PUNCTUATION = "?？。.!！~～ "
+
+
+def normalize_query(query):
+    """规范化查询文本：全角转半角、合并空白、英文小写、去掉结尾标点"""
+    query = unicodedata.normalize("NFKC", query)
+    query = re.sub(r"\s+", " ", query).strip().lower()
+    return query.rstrip(_TRAILING_PUNCTUATION)
+
+
+def context_fingerprint(chunk_ids):
+    """检索到的片段ID的指纹，顺序无关（其他集合的片段ID是"集合名:片段ID"形式的字符串，排在整数ID之后）"""
+    return ",".join(str(i) for i in sorted(chunk_ids, key=lambda i: (isinstance(i, str), i)))
+
+
+class AnswerCache:
+    """持久化的回答缓存
+
+    以"规范化查询 + 检索到的片段ID指纹"为键缓存大模型的回答，可选地按查询向量的相似度
+    匹配近似重复的提问（要求检索到的片段完全相同且不为空；没有检索到片段时只做精确匹配，
+    否则任何相似度够高的无关提问都会命中）。每条记录带有知识库的修订号，
+    知识库变化后旧记录全部失效。超过容量时淘汰最久未使用的记录。
+    """
+    def __init__(self, db_path=ANSWER_CACHE_FILE, max_entries=ANSWER_CACHE_MAX_ENTRIES,
+                 ttl=ANSWER_CACHE_TTL, similarity=ANSWER_CACHE_SIMILARITY):
+        """
+        Args:
+            db_path: SQLite数据库文件路径
+            max_entries: 最多缓存的回答数
+            ttl: 回答的有效期（秒），None表示不过期
+            similarity: 近似重复匹配的余弦相似度阈值，None表示只做精确匹配
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._revision = None
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                key TEXT PRIMARY KEY,
+                variant TEXT NOT NULL,
+                context_fp TEXT NOT NULL,
+                kb_revision INTEGER NOT NULL,
+                answer TEXT NOT NULL,
+                embedding BLOB,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_context ON answers (context_fp, variant)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def _key(query, variant, context_fp):
+        raw = f"{variant}\x00{normalize_query(query)}\x00{context_fp}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _sync_revision(self, kb_revision):
+        """知识库修订号变化时删除所有旧回答（调用方需持有锁）"""
+        if self._revision != kb_revision:
+            self._conn.execute("DELETE FROM answers WHERE kb_revision != ?", (kb_revision,))
+            self._conn.commit()
+            self._revision = kb_revision
+
+    def get(self, query, variant, chunk_ids, kb_revision, embedding=None):
+        """查找缓存的回答，未命中返回None
+
+        Args:
+            query: 用户查询
+            variant: 提示词类型（不同的系统提示词产生的回答不能混用）
+            chunk_ids: 检索到的片段ID
+            kb_revision: 当前知识库修订号
+            embedding: 查询向量，提供时（且设置了similarity、检索到了片段）启用近似重复匹配
+        """
+        context_fp = context_fingerprint(chunk_ids)
+        now = time.time()
+        with self._lock:
+            self._sync_revision(kb_revision)
+            min_created = now - self.ttl if self.ttl else 0
+            row = self._conn.execute(
+                "SELECT key, answer FROM answers WHERE key = ? AND created_at >= ?",
+                (self._key(query, variant, context_fp), min_created)).fetchone()
+
+            if row is None and embedding is not None and self.similarity is not None and chunk_ids:
+                # 近似重复：检索到相同片段、且查询向量足够相似的历史提问
+                query_vector = self._unit(embedding)
+                best_score = self.similarity
+                for key, answer, blob in self._conn.execute(
+                        "SELECT key, answer, embedding FROM answers "
+                        "WHERE context_fp = ? AND variant = ? AND created_at >= ? AND embedding IS NOT NULL",
+                        (context_fp, variant, min_created)):
+                    score = float(np.dot(query_vector, np.frombuffer(blob, dtype=np.float32)))
+                    if score >= best_score:
+                        best_score, row = score, (key, answer)
+
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE answers SET last_used = ? WHERE key = ?", (now, row[0]))
+            self._conn.commit()
+            self.hits += 1
+            return row[1]
+
+    def put(self, query, variant, chunk_ids, kb_revision, answer, embedding=None):
+        """缓存一条回答，超过容量时淘汰最久未使用的记录"""
+        context_fp = context_fingerprint(chunk_ids)
+        blob = self._unit(embedding).tobytes() if embedding is not None else None
+        now = time.time()
+        with self._lock:
+            self._sync_revision(kb_revision)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self._key(query, variant, context_fp), variant, context_fp, kb_revision,
+                 answer, blob, now, now))
+            overflow = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM answers WHERE key IN "
+                    "(SELECT key FROM answers ORDER BY last_used LIMIT ?)", (overflow,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM answers")
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "size": size,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0
+            }
+
+    @staticmethod
+    def _unit(embedding):
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
@@ -0,0 +1,30 @@
+import asyncio
+import threading
+
+# 进程内共享的后台事件循环，同步代码通过它运行协程（如大模型请求）
+_lock = threading.Lock()
+_loop = None
+
+
+def get_loop():
+    """获取后台事件循环，首次调用时在守护线程中启动"""
+    global _loop
+    with _lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="asyncio-loop", daemon=True).start()
+            _loop = loop
+        return _loop
+
+
+def submit(coro):
+    """把协程提交到后台事件循环，返回concurrent.futures.Future
+
+    对返回的Future调用cancel()会取消协程（在协程中抛出CancelledError）。
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+def run(coro):
+    """在后台事件循环中运行协程并阻塞等待结果"""
+    return submit(coro).result()
@@ -0,0 +1,57 @@
+import os
+import json
+
+
+def fsync_file(f):
+    """把文件缓冲区刷到磁盘"""
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def atomic_write(path, write_fn, mode='wb'):
+    """原子写文件：先写临时文件并落盘，再重命名覆盖目标文件
+    
+    写入过程中崩溃只会留下临时文件，目标文件要么是旧内容要么是完整的新内容。
+    
+    Args:
+        path: 目标文件路径
+        write_fn: 接收已打开文件对象的写入函数
+        mode: 临时文件的打开模式
+    """
+    tmp_path = f"{path}.tmp"
+    try:
+        encoding = None if 'b' in mode else 'utf-8'
+        with open(tmp_path, mode, encoding=encoding) as f:
+            write_fn(f)
+            fsync_file(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def atomic_write_bytes(path, data):
+    """原子写入二进制内容"""
+    atomic_write(path, lambda f: f.write(data))
+
+
+def atomic_write_json(path, obj):
+    """原子写入JSON文件"""
+    atomic_write(path, lambda f: json.dump(obj, f, ensure_ascii=False, indent=2), mode='w')
+
+
+def read_json(path, default=None):
+    """读取JSON文件，文件不存在时返回默认值"""
+    if not os.path.exists(path):
+        return default
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def remove_quietly(path):
+    """删除文件，文件不存在或删除失败时忽略"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,104 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from config import INGEST_WORKERS, INGEST_MAX_PENDING
+from .document_loader import DocumentLoader
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+# 每个工作进程各自持有一个DocumentLoader
+_worker_loader = None
+
+
+def parse_file(file_path):
+    """加载并分割单个文件（在工作进程中执行），返回文本片段列表"""
+    global _worker_loader
+    if _worker_loader is None:
+        _worker_loader = DocumentLoader()
+    text = _worker_loader.load_document(file_path)
+    return _worker_loader.split_text(text)
+
+
+class BulkIngestor:
+    """多文件并行导入
+
+    文档的解析和分割（CPU密集、受GIL限制）在进程池中并行执行，结果按提交顺序交给
+    当前线程，由单一写入者编码并写入向量存储。正在解析、尚未写入的文件数不超过max_pending，
+    写入跟不上时不再提交新文件，内存占用有上限。单个文件失败不影响其他文件。
+    """
+    def __init__(self, vector_store, max_workers=INGEST_WORKERS, max_pending=INGEST_MAX_PENDING):
+        self.vector_store = vector_store
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(1, max_pending)
+
+    def iter_parsed(self, file_paths):
+        """并行解析文件，按输入顺序逐个产出(file_path, chunks, error)"""
+        file_paths = list(file_paths)
+        if len(file_paths) <= 1 or self.max_workers == 1:
+            # 文件很少时不启动进程池
+            for file_path in file_paths:
+                try:
+                    yield file_path, parse_file(file_path), None
+                except Exception as e:
+                    yield file_path, None, e
+            return
+
+        workers = min(self.max_workers, len(file_paths))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            remaining = iter(file_paths)
+            for file_path in remaining:
+                pending.append((file_path, executor.submit(parse_file, file_path)))
+                if len(pending) >= self.max_pending:
+                    break
+            while pending:
+                file_path, future = pending.popleft()
+                try:
+                    chunks, error = future.result(), None
+                except Exception as e:
+                    chunks, error = None, e
+                # 取走一个结果后再提交一个新文件
+                next_path = next(remaining, None)
+                if next_path is not None:
+                    pending.append((next_path, executor.submit(parse_file, next_path)))
+                yield file_path, chunks, error
+
+    def ingest(self, items, on_file_done=None, progress_callback=None):
+        """批量导入文件
+
+        Args:
+            items: [(file_path, source_name)]，同名来源已存在时替换旧内容（新内容写入成功后才删除旧内容）
+            on_file_done: 每个文件完成后调用，接收参数(file_path, source_name, chunk_count, error)；
+                          没有可导入文本的文件chunk_count为0、error为None
+            progress_callback: 传给add_texts的批次进度回调，接收参数(done, total)
+
+        Returns:
+            dict: {"succeeded": 成功文件数, "empty": 没有可导入文本的文件数, "chunks": 写入的片段数,
+                   "failed": {来源名称: 错误信息}}
+        """
+        sources = dict(items)
+        summary = {"succeeded": 0, "empty": 0, "chunks": 0, "failed": {}}
+        for file_path, chunks, error in self.iter_parsed(sources.keys()):
+            source_name = sources[file_path]
+            if error is None:
+                try:
+                    if chunks:
+                        self.vector_store.replace_source(chunks, source_name, progress_callback=progress_callback)
+                    elif self.vector_store.has_source(source_name):
+                        # 文件变为空，旧内容已过时
+                        self.vector_store.delete_source(source_name)
+                except Exception as e:
+                    error = e
+            if error is None and not chunks:
+                logger.info(f"文件中没有可导入的文本: {os.path.basename(file_path)}")
+                summary["empty"] += 1
+            elif error is None:
+                summary["succeeded"] += 1
+                summary["chunks"] += len(chunks)
+            else:
+                logger.warning(f"导入文件失败: {os.path.basename(file_path)}: {error}")
+                summary["failed"][source_name] = str(error)
+            if on_file_done:
+                on_file_done(file_path, source_name, len(chunks) if error is None else 0, error)
+        return summary
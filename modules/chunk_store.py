@@ -0,0 +1,247 @@
+import os
+import json
+import mmap
+import time
+import numpy as np
+from .atomic_io import fsync_file
+
+# 每个文本片段的元数据列：来源ID、文档ID、片段在文档中的位置
+META_DTYPE = np.dtype([('source_id', '<i4'), ('doc_id', '<i4'), ('position', '<i4')])
+
+
+def format_chunk(source, text):
+    """把片段格式化为带来源标题的文本（用于编码和提示词）"""
+    return f"来源: {source}\n\n{text}"
+
+
+class ChunkStore:
+    """列式文本片段存储
+
+    - chunks.blob: 所有片段的UTF-8文本首尾相接
+    - chunks.offsets: 每个片段在blob中的结束偏移（int64）
+    - chunks.meta: 每个片段的元数据（META_DTYPE）
+    - chunks.sources: 来源名称表，每行一个JSON字符串，行号即来源ID
+    - chunks.docs: 文档表，每行一个JSON对象（来源ID、导入时间），行号即文档ID
+
+    所有文件只追加不重写，通过内存映射按需读取，检索时只解码命中的几行。
+    已提交的数据量由调用方写在manifest中（见state()），打开时截断未提交的尾部。
+    """
+    def __init__(self, store_dir):
+        self.blob_file = os.path.join(store_dir, "chunks.blob")
+        self.offsets_file = os.path.join(store_dir, "chunks.offsets")
+        self.meta_file = os.path.join(store_dir, "chunks.meta")
+        self.sources_file = os.path.join(store_dir, "chunks.sources")
+        self.docs_file = os.path.join(store_dir, "chunks.docs")
+
+        self.count = 0
+        self.blob_bytes = 0
+        self.next_doc_id = 0
+        self.sources = []
+        self._source_ids = {}
+        # 文档ID -> {source_id, ingested_at, first, end, count}，first/end为片段ID范围（左闭右开）
+        self.docs = []
+
+        self._blob = None
+        self._offsets = None
+        self._meta = None
+        self._mapped_count = -1
+
+    @staticmethod
+    def empty_state():
+        return {"count": 0, "blob_bytes": 0, "sources": 0, "next_doc_id": 0}
+
+    def state(self):
+        """当前已写入的数据量，由调用方写入manifest作为提交记录"""
+        return {
+            "count": self.count,
+            "blob_bytes": self.blob_bytes,
+            "sources": len(self.sources),
+            "next_doc_id": self.next_doc_id
+        }
+
+    def open(self, state):
+        """按已提交的状态打开存储，丢弃崩溃时未提交的尾部"""
+        self.count = state["count"]
+        self.blob_bytes = state["blob_bytes"]
+        self.next_doc_id = state["next_doc_id"]
+
+        expected = {
+            self.blob_file: self.blob_bytes,
+            self.offsets_file: self.count * 8,
+            self.meta_file: self.count * META_DTYPE.itemsize
+        }
+        for path, size in expected.items():
+            actual = os.path.getsize(path) if os.path.exists(path) else 0
+            if actual < size:
+                raise ValueError(f"片段存储文件不完整: {os.path.basename(path)} {actual} < {size} 字节")
+            if actual > size:
+                os.truncate(path, size)
+
+        # 来源表很小（每个来源一行），直接读入内存
+        self.sources = []
+        if os.path.exists(self.sources_file):
+            with open(self.sources_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if len(self.sources) >= state["sources"]:
+                        break
+                    self.sources.append(json.loads(line))
+        if len(self.sources) < state["sources"]:
+            raise ValueError("来源表不完整")
+        self._truncate_lines(self.sources_file, len(self.sources))
+        self._source_ids = {name: i for i, name in enumerate(self.sources)}
+        self._mapped_count = -1
+        self._open_docs()
+
+    def _open_docs(self):
+        """读取文档表，并从元数据列统计每个文档的片段ID范围和片段数
+
+        旧版本的存储没有文档表，按元数据列补上（导入时间未知，记为None）。
+        """
+        records = []
+        if os.path.exists(self.docs_file):
+            with open(self.docs_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if len(records) >= self.next_doc_id:
+                        break
+                    records.append(json.loads(line))
+        self._truncate_lines(self.docs_file, len(records))
+
+        self.docs = [{"source_id": None, "ingested_at": None, "first": 0, "end": 0, "count": 0}
+                     for _ in range(self.next_doc_id)]
+        for doc, record in zip(self.docs, records):
+            doc.update(source_id=record["source_id"], ingested_at=record["ingested_at"])
+        if self.count:
+            doc_column = self.column('doc_id')
+            doc_ids, first, counts = np.unique(doc_column, return_index=True, return_counts=True)
+            _, last = np.unique(doc_column[::-1], return_index=True)
+            source_ids = self.column('source_id')[first]
+            for doc_id, start, end, count, source_id in zip(doc_ids.tolist(), first.tolist(),
+                                                           (self.count - last).tolist(), counts.tolist(),
+                                                           source_ids.tolist()):
+                doc = self.docs[doc_id]
+                doc.update(first=start, end=end, count=count)
+                if doc["source_id"] is None:
+                    doc["source_id"] = source_id
+        if len(records) < self.next_doc_id:
+            # 补写旧版本存储缺少的文档表
+            with open(self.docs_file, 'a', encoding='utf-8') as f:
+                for doc in self.docs[len(records):]:
+                    f.write(json.dumps({"source_id": doc["source_id"], "ingested_at": None}) + "\n")
+                fsync_file(f)
+
+    @staticmethod
+    def _truncate_lines(path, lines):
+        """截断按行追加的表中未提交的行"""
+        with open(path, 'a+b') as f:
+            f.seek(0)
+            size = 0
+            for _ in range(lines):
+                size += len(f.readline())
+            f.truncate(size)
+
+    def clear(self):
+        """清空所有片段（调用方需先提交空状态）"""
+        for path in (self.blob_file, self.offsets_file, self.meta_file, self.sources_file, self.docs_file):
+            with open(path, 'wb'):
+                pass
+        self.open(self.empty_state())
+
+    def find_source(self, source_name):
+        """查找来源ID，来源不存在时返回None"""
+        return self._source_ids.get(source_name)
+
+    def source_id(self, source_name):
+        """获取来源ID，新来源追加到来源表"""
+        source_id = self._source_ids.get(source_name)
+        if source_id is None:
+            source_id = len(self.sources)
+            with open(self.sources_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(source_name, ensure_ascii=False) + "\n")
+                fsync_file(f)
+            self.sources.append(source_name)
+            self._source_ids[source_name] = source_id
+        return source_id
+
+    def new_doc_id(self, source_id):
+        """分配新的文档ID并记入文档表，每次导入一个文档分配一个"""
+        doc_id = self.next_doc_id
+        ingested_at = time.time()
+        with open(self.docs_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({"source_id": source_id, "ingested_at": ingested_at}) + "\n")
+            fsync_file(f)
+        self.docs.append({"source_id": source_id, "ingested_at": ingested_at,
+                          "first": self.count, "end": self.count, "count": 0})
+        self.next_doc_id += 1
+        return doc_id
+
+    def append(self, texts, source_id, doc_id, first_position):
+        """追加一批片段，返回第一个片段的ID（片段ID即行号，与向量行号一致）"""
+        encoded = [text.encode('utf-8') for text in texts]
+        lengths = np.fromiter((len(b) for b in encoded), dtype=np.int64, count=len(encoded))
+        ends = self.blob_bytes + np.cumsum(lengths)
+
+        meta = np.empty(len(texts), dtype=META_DTYPE)
+        meta['source_id'] = source_id
+        meta['doc_id'] = doc_id
+        meta['position'] = np.arange(first_position, first_position + len(texts), dtype=np.int32)
+
+        with open(self.blob_file, 'ab') as f:
+            f.write(b"".join(encoded))
+            fsync_file(f)
+        with open(self.offsets_file, 'ab') as f:
+            f.write(ends.astype('<i8').tobytes())
+            fsync_file(f)
+        with open(self.meta_file, 'ab') as f:
+            f.write(meta.tobytes())
+            fsync_file(f)
+
+        first_id = self.count
+        self.count += len(texts)
+        self.blob_bytes = int(ends[-1]) if len(ends) else self.blob_bytes
+
+        doc = self.docs[doc_id]
+        if doc["count"] == 0:
+            doc["first"] = first_id
+        doc["end"] = self.count
+        doc["count"] += len(texts)
+        return first_id
+
+    def __len__(self):
+        return self.count
+
+    def _ensure_mapped(self):
+        """按需（重新）映射文件；追加后只在读取时才重新映射"""
+        if self._mapped_count == self.count:
+            return
+        if self.count == 0:
+            self._blob, self._offsets, self._meta = b"", np.empty(0, dtype='<i8'), np.empty(0, dtype=META_DTYPE)
+        else:
+            with open(self.blob_file, 'rb') as f:
+                self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.blob_bytes else b""
+            self._offsets = np.memmap(self.offsets_file, dtype='<i8', mode='r', shape=(self.count,))
+            self._meta = np.memmap(self.meta_file, dtype=META_DTYPE, mode='r', shape=(self.count,))
+        self._mapped_count = self.count
+
+    def get_text(self, chunk_id):
+        """解码单个片段的文本"""
+        self._ensure_mapped()
+        start = int(self._offsets[chunk_id - 1]) if chunk_id > 0 else 0
+        end = int(self._offsets[chunk_id])
+        return self._blob[start:end].decode('utf-8')
+
+    def get(self, chunk_id):
+        """读取单个片段的文本和元数据"""
+        self._ensure_mapped()
+        meta = self._meta[chunk_id]
+        return {
+            "id": int(chunk_id),
+            "text": self.get_text(chunk_id),
+            "source": self.sources[int(meta['source_id'])],
+            "doc_id": int(meta['doc_id']),
+            "position": int(meta['position'])
+        }
+
+    def column(self, name):
+        """获取整列元数据（内存映射，只读）"""
+        self._ensure_mapped()
+        return self._meta[name]
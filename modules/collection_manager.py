@@ -0,0 +1,284 @@
+import os
+import re
+import time
+import shutil
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from config import (VECTOR_STORE_DIR, DEFAULT_COLLECTION, COLLECTION_SEARCH_WORKERS, COLLECTION_IDLE_UNLOAD,
+                    TOP_K_RETRIEVAL)
+from .vector_store import VectorStore
+from .atomic_io import atomic_write_json, read_json
+from .logger import get_logger
+from . import tracing
+
+logger = get_logger(__name__)
+
+# 集合名称：字母、数字、汉字、下划线和连字符
+_NAME_PATTERN = re.compile(r"[A-Za-z0-9_\-一-鿿]{1,64}")
+# 检索时表示"全部集合"
+ALL_COLLECTIONS = "*"
+
+
+class CollectionNotFoundError(ValueError):
+    """集合不存在"""
+
+
+def _merge_key(hit):
+    """跨集合合并时的排序键：各集合内融合后的RRF分数
+
+    不能按向量相似度合并：只由关键词命中的片段相似度往往低于阈值，按相似度会排到最后被截掉。
+    RRF分数只取决于集合内的排名，各集合之间可以直接比较，合并后每个集合内的顺序不变。
+    """
+    return hit["rank_score"]
+
+
+class CollectionManager:
+    """按名称管理多个知识库集合
+
+    每个集合是一个独立的VectorStore（各自的向量文件、索引、片段存储和关键词索引），存放在单独的目录中：
+    默认集合就是base_dir本身（旧版本的数据即默认集合），其他集合在base_dir/collections/<名称>下。
+    集合在首次使用时加载，超过idle_unload秒未使用、且没有后台任务和进行中的导入时卸载；默认集合始终加载。
+
+    跨多个集合的检索只编码一次查询，再在线程池中并行检索各集合（FAISS检索期间释放GIL），
+    按各集合内的RRF分数合并为一个top_k列表，每条结果带有collection字段。
+    """
+    def __init__(self, embedding_model=None, base_dir=None, max_workers=COLLECTION_SEARCH_WORKERS,
+                 idle_unload=COLLECTION_IDLE_UNLOAD):
+        if embedding_model is None:
+            from .store_registry import get_embedding_model
+            embedding_model = get_embedding_model()
+        self.embedding_model = embedding_model
+        self.base_dir = base_dir or VECTOR_STORE_DIR
+        self.collections_dir = os.path.join(self.base_dir, "collections")
+        self.idle_unload = idle_unload
+
+        self._lock = threading.Lock()
+        self._stores = {}  # 名称 -> 已加载的VectorStore
+        self._last_used = {}  # 名称 -> 最近一次使用的时间（time.monotonic）
+        self._leases = {}  # 名称 -> 进行中的长时间操作数（如导入），期间不卸载
+        self._loading = {}  # 名称 -> 加载锁，不同集合可以同时加载
+        self._revisions = {}  # 未加载集合的修订号（卸载期间不会变化）
+        # 已删除集合的修订号累计，保证总修订号只增不减
+        self._state_file = os.path.join(self.base_dir, "collections.json")
+        self._retired_revision = read_json(self._state_file, default={}).get("retired_revision", 0)
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="collection-search")
+
+    @staticmethod
+    def validate_name(name):
+        if name != DEFAULT_COLLECTION and not _NAME_PATTERN.fullmatch(name or ""):
+            raise ValueError(f"集合名称只能包含字母、数字、汉字、下划线和连字符（不超过64个字符）: {name!r}")
+
+    def path_of(self, name):
+        """集合的存储目录"""
+        self.validate_name(name)
+        return self.base_dir if name == DEFAULT_COLLECTION else os.path.join(self.collections_dir, name)
+
+    def exists(self, name):
+        """集合是否存在（名称不合法时视为不存在）"""
+        if name == DEFAULT_COLLECTION:
+            return True
+        if not _NAME_PATTERN.fullmatch(name or ""):
+            return False
+        return name in self._stores or os.path.isfile(os.path.join(self.path_of(name), "manifest.json"))
+
+    def names(self):
+        """全部集合的名称（默认集合在前）"""
+        names = [DEFAULT_COLLECTION]
+        if os.path.isdir(self.collections_dir):
+            names.extend(sorted(name for name in os.listdir(self.collections_dir)
+                                if name != DEFAULT_COLLECTION and _NAME_PATTERN.fullmatch(name)
+                                and self.exists(name)))
+        return names
+
+    def resolve(self, collections):
+        """把检索时指定的集合解析为名称列表：None为默认集合，包含"*"时为全部集合"""
+        if not collections:
+            return [DEFAULT_COLLECTION]
+        if isinstance(collections, str):
+            collections = [collections]
+        if ALL_COLLECTIONS in collections:
+            return self.names()
+        for name in collections:
+            if not self.exists(name):
+                raise CollectionNotFoundError(f"集合不存在: {name}")
+        return list(dict.fromkeys(collections))
+
+    def get(self, name=DEFAULT_COLLECTION, create=False):
+        """获取集合的VectorStore，未加载时加载；create为True时集合不存在则创建"""
+        return self._acquire(name, create, lease=False)
+
+    @contextlib.contextmanager
+    def lease(self, name=DEFAULT_COLLECTION, create=False):
+        """在with块内使用集合（导入等长时间操作），期间不会被卸载"""
+        store = self._acquire(name, create, lease=True)
+        try:
+            yield store
+        finally:
+            with self._lock:
+                self._leases[name] -= 1
+                self._last_used[name] = time.monotonic()
+
+    def _acquire(self, name, create, lease):
+        if create:
+            self.validate_name(name)
+        self._unload_idle()
+        with self._lock:
+            store = self._stores.get(name)
+            if store is None:
+                if not create and not self.exists(name):
+                    raise CollectionNotFoundError(f"集合不存在: {name}")
+                loading = self._loading.setdefault(name, threading.Lock())
+        if store is None:
+            # 加载在全局锁外进行，期间其他集合照常使用
+            with loading:
+                store = self._stores.get(name)
+                if store is None:
+                    start = time.perf_counter()
+                    store = VectorStore(embedding_model=self.embedding_model, store_dir=self.path_of(name))
+                    logger.info(f"加载集合 '{name}'：{len(store)} 个片段，耗时 {time.perf_counter() - start:.2f} 秒")
+                    with self._lock:
+                        self._stores[name] = store
+                        self._revisions.pop(name, None)
+        with self._lock:
+            self._last_used[name] = time.monotonic()
+            if lease:
+                self._leases[name] = self._leases.get(name, 0) + 1
+        return store
+
+    def unload(self, name):
+        """卸载集合，释放其索引占用的内存（默认集合、正在导入或有后台任务的集合不卸载）
+
+        Returns:
+            bool: 是否已卸载
+        """
+        with self._lock:
+            store = self._stores.get(name)
+            if (store is None or name == DEFAULT_COLLECTION or self._leases.get(name)
+                    or not store.is_idle()):
+                return False
+            del self._stores[name]
+            self._revisions[name] = store.revision
+        logger.info(f"卸载集合 '{name}'")
+        return True
+
+    def _unload_idle(self):
+        """卸载超过idle_unload秒未使用的集合"""
+        if not self.idle_unload:
+            return
+        deadline = time.monotonic() - self.idle_unload
+        with self._lock:
+            idle = [name for name in self._stores if self._last_used.get(name, 0) < deadline]
+        for name in idle:
+            self.unload(name)
+
+    def create(self, name):
+        """创建集合（已存在时直接返回）"""
+        return self.get(name, create=True)
+
+    def delete(self, name):
+        """删除集合及其全部数据（默认集合只能清空，不能删除）
+
+        Returns:
+            bool: 集合是否存在并已删除
+        """
+        if name == DEFAULT_COLLECTION:
+            raise ValueError("默认集合不能删除")
+        with self._lock:
+            if not self.exists(name):
+                return False
+            store = self._stores.get(name)
+            if self._leases.get(name) or (store is not None and not store.is_idle()):
+                raise RuntimeError(f"集合 '{name}' 正在导入或有后台任务，请稍后再删除")
+            revision = store.revision if store is not None else self._revision_of(name)
+            self._stores.pop(name, None)
+            self._revisions.pop(name, None)
+            self._last_used.pop(name, None)
+            self._retired_revision += revision + 1
+            atomic_write_json(self._state_file, {"retired_revision": self._retired_revision})
+        shutil.rmtree(self.path_of(name), ignore_errors=True)
+        logger.info(f"已删除集合 '{name}'")
+        return True
+
+    def _revision_of(self, name):
+        """集合的修订号（调用方需持有锁；未加载的集合读取manifest并缓存）"""
+        store = self._stores.get(name)
+        if store is not None:
+            return store.revision
+        if name not in self._revisions:
+            manifest = read_json(os.path.join(self.path_of(name), "manifest.json"), default={})
+            self._revisions[name] = manifest.get("revision", 0)
+        return self._revisions[name]
+
+    @property
+    def revision(self):
+        """全部集合内容的修订号，任何一个集合变化（导入、删除、清空）或删除集合时增大"""
+        names = self.names()
+        with self._lock:
+            return sum(self._revision_of(name) for name in names) + self._retired_revision
+
+    def list_collections(self):
+        """列出全部集合：名称、是否已加载、已提交的片段数（未加载的集合读取manifest，不加载）"""
+        result = []
+        for name in self.names():
+            with self._lock:
+                store = self._stores.get(name)
+            if store is not None:
+                chunks = len(store)
+            else:
+                chunks = read_json(os.path.join(self.path_of(name), "manifest.json"), default={}).get("ntotal", 0)
+            result.append({"name": name, "loaded": store is not None, "chunks": chunks})
+        return result
+
+    def encode_queries(self, queries):
+        """编码查询（使用默认集合的查询向量缓存，各集合共用同一个嵌入模型）"""
+        return self.get(DEFAULT_COLLECTION).encode_queries(queries)
+
+    def encode_query(self, query):
+        return self.encode_queries([query])
+
+    def lexical_fast_path(self, query):
+        """查询是否可能走关键词快速路径（不计算查询向量；与集合无关）"""
+        return self.get(DEFAULT_COLLECTION).lexical_fast_path(query)
+
+    def search(self, query, top_k=TOP_K_RETRIEVAL, threshold=0.75, collections=None):
+        """在所选集合中检索，结果与VectorStore.search相同，另带collection字段"""
+        return self.search_batch([query], top_k, threshold, collections)[0]
+
+    def search_batch(self, queries, top_k=TOP_K_RETRIEVAL, threshold=0.75, collections=None):
+        """在所选集合中检索多个查询：查询编码一次，各集合在线程池中并行检索，每个查询按RRF分数合并为top_k条"""
+        names = self.resolve(collections)
+        stores = [(name, self.get(name)) for name in names]
+        if len(stores) == 1:
+            name, store = stores[0]
+            return [self._tag(hits, name) for hits in store.search_batch(queries, top_k, threshold)]
+
+        # 像编号的查询可能走关键词快速路径，不预先编码；其余查询各集合共用同一个查询向量
+        dense = list(dict.fromkeys(query for query in queries if not self.lexical_fast_path(query)))
+        embeddings = {}
+        if dense:
+            with tracing.span("encode", queries=len(dense)):
+                encoded = self.encode_queries(dense).reshape(len(dense), -1)
+            embeddings = {query: encoded[row] for row, query in enumerate(dense)}
+
+        def search_one(store):
+            return store.search_batch(queries, top_k, threshold, embeddings)
+
+        with tracing.span("fan_out", collections=len(stores)):
+            futures = [self._pool.submit(tracing.bind(search_one), store) for _, store in stores]
+            per_collection = [future.result() for future in futures]
+
+        merged = []
+        for i in range(len(queries)):
+            hits = [hit for (name, _), results in zip(stores, per_collection) for hit in self._tag(results[i], name)]
+            merged.append(sorted(hits, key=_merge_key, reverse=True)[:top_k])
+        return merged
+
+    @staticmethod
+    def _tag(hits, name):
+        for hit in hits:
+            hit["collection"] = name
+        return hits
+
+    def close(self):
+        self._pool.shutdown(wait=False)
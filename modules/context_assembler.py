@@ -0,0 +1,145 @@
+import math
+from config import CONTEXT_TOKEN_BUDGET, CHUNK_OVERLAP, DEFAULT_COLLECTION
+
+# 相邻片段首尾重合少于这么多字时视为巧合，不去重
+_MIN_OVERLAP = 5
+# 同一来源中不相邻的两段之间的分隔
+_GAP = "\n……\n"
+# 每条消息在提示词中的固定开销（角色标记等）
+_MESSAGE_OVERHEAD = 4
+
+
+def _is_cjk(char):
+    return "　" <= char <= "鿿" or "豈" <= char <= "﫿" or "＀" <= char <= "￯"
+
+
+def estimate_tokens(text):
+    """估算文本的token数：中文（含全角标点）每字约一个token，其余字符约四个一个token
+
+    通义千问的分词器对中文平均每个token略多于一个字，这里的估算偏保守。
+    """
+    cjk = sum(1 for char in text if _is_cjk(char))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def estimate_message_tokens(messages):
+    """估算一组对话消息的提示词token数"""
+    return sum(estimate_tokens(message["content"]) + _MESSAGE_OVERHEAD for message in messages)
+
+
+def _overlap(left, right, max_length):
+    """left的结尾与right的开头重合的最长长度（不超过max_length，少于_MIN_OVERLAP时返回0）"""
+    for length in range(min(len(left), len(right), max_length), _MIN_OVERLAP - 1, -1):
+        if left.endswith(right[:length]):
+            return length
+    return 0
+
+
+def _truncate(text, budget):
+    """把文本截到budget个token以内（含结尾的省略号），尽量在句末截断"""
+    budget -= estimate_tokens("……")
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    cut = text[:low]
+    boundary = max(cut.rfind(mark) for mark in "。！？；\n.!?")
+    if boundary >= len(cut) // 2:
+        cut = cut[:boundary + 1]
+    return cut.rstrip() + "……"
+
+
+class ContextAssembler:
+    """把检索到的片段组装为提示词中的参考信息
+
+    - 同一文档中位置相邻的片段合并为一段，去掉分割时重复的重合部分（CHUNK_OVERLAP）
+    - 同一来源的片段放在同一个"来源:"标题下，按在文档中的位置排列
+    - 来源按其中最相关片段的排名排序，依次放入，直到用完token预算；放不下的一段在句末截断
+    """
+    def __init__(self, token_budget=CONTEXT_TOKEN_BUDGET, max_overlap=CHUNK_OVERLAP):
+        self.token_budget = token_budget
+        self.max_overlap = max_overlap
+
+    def _spans(self, hits):
+        """把同一文档中相邻的片段合并为连续的文本段，返回[(文本段, 片段ID列表)]（按文档中的位置排序）"""
+        spans = []
+        previous = None
+        for hit in sorted(hits, key=lambda hit: (hit["doc_id"], hit["position"])):
+            text = hit["text"]
+            if (previous is not None and previous["doc_id"] == hit["doc_id"]
+                    and hit["position"] == previous["position"] + 1):
+                span_text, span_ids = spans[-1]
+                overlap = _overlap(span_text, text, self.max_overlap)
+                spans[-1] = (span_text + (text[overlap:] if overlap else "\n" + text), span_ids + [hit["id"]])
+            else:
+                spans.append((text, [hit["id"]]))
+            previous = hit
+        return spans
+
+    def assemble(self, hits):
+        """组装参考信息
+
+        Args:
+            hits: VectorStore.search的结果（需包含source、doc_id、position、text），按相关性排序
+
+        Returns:
+            dict: contexts为每个来源一段的参考信息列表，tokens为估算的token数，
+                  chunk_ids为实际放入的片段ID，truncated表示是否因预算截断或丢弃了内容
+        """
+        groups = {}
+        seen_texts = set()
+        for hit in hits:
+            # 内容完全相同的片段（如同一文件的两个副本）只保留一份
+            if hit["text"] in seen_texts:
+                continue
+            seen_texts.add(hit["text"])
+            # 不同集合中的文档ID和片段ID各自独立，按(集合, 来源)分组
+            groups.setdefault((hit.get("collection"), hit["source"]), []).append(hit)
+
+        contexts, chunk_ids = [], []
+        remaining = self.token_budget
+        truncated = False
+        for (collection, source), source_hits in groups.items():
+            label = source if collection in (None, DEFAULT_COLLECTION) else f"{collection}/{source}"
+            header = f"来源: {label}\n\n"
+            header_tokens = estimate_tokens(header)
+            if remaining <= header_tokens:
+                truncated = True
+                break
+            body_parts, body_ids = [], []
+            budget = remaining - header_tokens
+            for span, span_ids in self._spans(source_hits):
+                separator_tokens = estimate_tokens(_GAP) if body_parts else 0
+                span_tokens = estimate_tokens(span)
+                if span_tokens + separator_tokens <= budget:
+                    body_parts.append(span)
+                    body_ids.extend(span_ids)
+                    budget -= span_tokens + separator_tokens
+                    continue
+                truncated = True
+                # 剩余预算太少时不再放入截断后只剩开头几个字的内容
+                if budget - separator_tokens >= min(span_tokens, 50):
+                    body_parts.append(_truncate(span, budget - separator_tokens))
+                    body_ids.extend(span_ids)
+                    budget = 0
+                break
+            if not body_parts:
+                break
+            context = header + _GAP.join(body_parts)
+            contexts.append(context)
+            # 其他集合的片段ID加上集合名，与默认集合的片段ID区分（回答缓存按片段ID识别检索结果）
+            if collection not in (None, DEFAULT_COLLECTION):
+                body_ids = [f"{collection}:{chunk_id}" for chunk_id in body_ids]
+            chunk_ids.extend(body_ids)
+            remaining -= estimate_tokens(context)
+            if truncated:
+                break
+        return {
+            "contexts": contexts,
+            "tokens": self.token_budget - remaining,
+            "chunk_ids": chunk_ids,
+            "truncated": truncated
+        }
@@ -1,16 +1,12 @@
 import os
-import pypdf
-import docx2txt
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from config import CHUNK_SIZE, CHUNK_OVERLAP
+from .text_chunker import iter_chunks
 
 class DocumentLoader:
-    def __init__(self):
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=CHUNK_SIZE,
-            chunk_overlap=CHUNK_OVERLAP,
-            length_function=len
-        )
+    def __init__(self, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+        # 文档解析依赖在用到时才导入，不拖慢程序启动；分割由text_chunker完成，没有额外依赖
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
     
     def load_document(self, file_path):
         """加载文档并返回文本内容"""
@@ -26,20 +22,24 @@ class DocumentLoader:
             raise ValueError(f"不支持的文件类型: {ext}")
     
     def _load_pdf(self, file_path):
-        text = ""
+        import pypdf
+        # 逐页收集后一次拼接，避免大PDF上字符串反复拼接的平方级开销
         with open(file_path, 'rb') as file:
             reader = pypdf.PdfReader(file)
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
-        return text
+            return "".join((page.extract_text() or "") + "\n" for page in reader.pages)
     
     def _load_text(self, file_path):
         with open(file_path, 'r', encoding='utf-8') as file:
             return file.read()
     
     def _load_word(self, file_path):
+        import docx2txt
         return docx2txt.process(file_path)
     
     def split_text(self, text):
-        """将文本分割成小块"""
-        return self.text_splitter.split_text(text)
\ No newline at end of file
+        """将文本分割成小块（在段落、换行和中英文句末标点处切分，见text_chunker.iter_chunks）"""
+        return [chunk.text for chunk in self.iter_chunks(text)]
+
+    def iter_chunks(self, text):
+        """逐个产出带字符偏移的片段（text_chunker.Chunk），text也可以是按顺序产出字符串的可迭代对象"""
+        return iter_chunks(text, self.chunk_size, self.chunk_overlap)
@@ -0,0 +1,230 @@
+import os
+import time
+import numpy as np
+from config import ONNX_NUM_THREADS
+from .atomic_io import atomic_write_json, read_json
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+# 支持的嵌入后端：torch为PyTorch的SentenceTransformer，onnx为导出的ONNX模型，onnx_int8为其int8动态量化版本
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx_int8")
+# 导出的ONNX模型存放在本地模型目录的这个子目录下
+ONNX_SUBDIR = "onnx"
+_ONNX_FILES = {"onnx": "model.onnx", "onnx_int8": "model_int8.onnx"}
+_POOLING_MODES = ("mean", "cls", "max")
+
+# 导出后与PyTorch模型对比用的文本：长短不一，包括超过最大长度、需要截断的文本
+VALIDATION_TEXTS = [
+    "苹果",
+    "今天天气怎么样？",
+    "错误码 ERR-1024 表示什么？",
+    "检索增强生成先从知识库中检索相关片段，再把它们作为参考信息交给大模型回答问题。",
+    "The quick brown fox jumps over the lazy dog.",
+    "向量数据库使用近似最近邻索引加速相似度检索，常见的索引有倒排聚类、乘积量化和分层可导航小世界图。" * 3,
+    "第一章 总则\n第一条 为了规范知识库的管理，制定本办法。\n第二条 本办法适用于全部文档。",
+    "混合检索把BM25关键词检索与向量检索的结果按倒数排名融合。" * 40,
+]
+
+
+def onnx_dir(model_path):
+    return os.path.join(model_path, ONNX_SUBDIR)
+
+
+def onnx_model_file(model_path, backend):
+    """某个ONNX后端的模型文件路径"""
+    return os.path.join(onnx_dir(model_path), _ONNX_FILES[backend])
+
+
+class OnnxEmbeddingModel:
+    """用ONNX Runtime在CPU上计算嵌入，不需要导入torch和transformers
+
+    嵌入模型没有公共基类：VectorStore只调用get_sentence_embedding_dimension()和
+    encode(texts, batch_size=..., convert_to_numpy=True, show_progress_bar=False)，
+    后者返回(len(texts), dim)的float32矩阵（传入单个字符串时返回一维向量）。
+    SentenceTransformer本身就满足这个约定（即torch后端），这里按同样的签名实现。
+
+    模型目录由export_onnx生成，包含ONNX模型、tokenizer.json和记录池化方式、最大长度的embedding_config.json。
+    分词用tokenizers库批量完成；每批文本按长度排序后再分批，减少补齐的token数。
+    """
+    def __init__(self, model_dir, quantized=False, num_threads=ONNX_NUM_THREADS):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        self.name = "onnx_int8" if quantized else "onnx"
+        self.config = read_json(os.path.join(model_dir, "embedding_config.json"), default=None)
+        if self.config is None:
+            raise FileNotFoundError(f"ONNX模型目录不完整（缺少embedding_config.json）: {model_dir}")
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        model_file = os.path.join(model_dir, _ONNX_FILES[self.name])
+        self.session = onnxruntime.InferenceSession(model_file, options, providers=["CPUExecutionProvider"])
+        self._input_names = {item.name for item in self.session.get_inputs()}
+        self._output_name = self.session.get_outputs()[0].name
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.config["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.config["pad_token_id"], pad_token=self.config["pad_token"])
+
+    def get_sentence_embedding_dimension(self):
+        return self.config["dimension"]
+
+    def _pool(self, hidden, mask):
+        mode = self.config["pooling"]
+        if mode == "cls":
+            return hidden[:, 0]
+        mask = mask[:, :, None].astype(np.float32)
+        if mode == "max":
+            return np.where(mask > 0, hidden, -1e9).max(axis=1)
+        return (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True, show_progress_bar=False,
+               normalize_embeddings=False, **kwargs):
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+        embeddings = np.empty((len(texts), self.get_sentence_embedding_dimension()), dtype=np.float32)
+        # 长度相近的文本放在同一批
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            encodings = self.tokenizer.encode_batch([texts[i] for i in rows])
+            mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+            feeds = {"input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+                     "attention_mask": mask}
+            if "token_type_ids" in self._input_names:
+                feeds["token_type_ids"] = np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)
+            hidden = self.session.run([self._output_name], feeds)[0]
+            embeddings[rows] = self._pool(hidden, mask)
+        if normalize_embeddings or self.config["normalize"]:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings[0] if single else embeddings
+
+
+def validate_backend(backend):
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"不支持的嵌入后端: {backend}（可选: {', '.join(EMBEDDING_BACKENDS)}）")
+
+
+def embedding_info(model):
+    """嵌入模型的来源（后端和模型名称），记录在向量存储的manifest中；不是由load_embedding_model加载的返回None"""
+    return getattr(model, "embedding_info", None)
+
+
+def load_embedding_model(backend, model_path, timings=None, model_name=None):
+    """按后端加载嵌入模型
+
+    Args:
+        backend: EMBEDDING_BACKENDS中的一种
+        model_path: 本地模型目录（torch后端也可以是Hugging Face上的模型名称）
+        timings: 可选的dict，记录导入依赖和加载模型的耗时（秒）
+        model_name: 记录在embedding_info中的模型名称，默认为model_path
+    """
+    validate_backend(backend)
+    timings = timings if timings is not None else {}
+    if backend == "torch":
+        start = time.perf_counter()
+        from sentence_transformers import SentenceTransformer
+        timings["import_sentence_transformers"] = time.perf_counter() - start
+        start = time.perf_counter()
+        model = SentenceTransformer(model_path)
+    else:
+        start = time.perf_counter()
+        import onnxruntime  # noqa: F401
+        timings["import_onnxruntime"] = time.perf_counter() - start
+        start = time.perf_counter()
+        model = OnnxEmbeddingModel(onnx_dir(model_path), quantized=backend == "onnx_int8")
+    timings["model_load"] = time.perf_counter() - start
+    # 不同后端的向量只是近似相同，向量存储据此检查已有向量是否由同一个模型生成
+    model.embedding_info = {"backend": backend, "model": model_name or model_path}
+    return model
+
+
+def _describe_sentence_transformer(st_model):
+    """从SentenceTransformer的模块中读出ONNX后端需要复现的部分：池化方式、是否归一化、最大长度"""
+    from sentence_transformers import models
+
+    pooling, normalize = None, False
+    for module in list(st_model)[1:]:
+        if isinstance(module, models.Pooling):
+            pooling = module.get_pooling_mode_str()
+        elif isinstance(module, models.Normalize):
+            normalize = True
+        else:
+            raise ValueError(f"ONNX导出不支持的SentenceTransformer模块: {type(module).__name__}")
+    if pooling not in _POOLING_MODES:
+        raise ValueError(f"ONNX导出不支持的池化方式: {pooling}")
+    return {"pooling": pooling, "normalize": normalize, "max_seq_length": st_model.max_seq_length,
+            "dimension": st_model.get_sentence_embedding_dimension()}
+
+
+def export_onnx(model_path, quantize=True, opset=14):
+    """把本地的SentenceTransformer模型导出为ONNX（可选再做int8动态量化），写入model_path/onnx/
+
+    Returns:
+        dict: 后端名称 -> 模型文件路径
+    """
+    import inspect
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    st_model = SentenceTransformer(model_path, device="cpu")
+    config = _describe_sentence_transformer(st_model)
+    transformer = st_model[0]
+    tokenizer = transformer.tokenizer
+    if not getattr(tokenizer, "is_fast", False):
+        raise ValueError("ONNX后端需要fast tokenizer（tokenizer.json）")
+
+    output_dir = onnx_dir(model_path)
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer.backend_tokenizer.save(os.path.join(output_dir, "tokenizer.json"))
+
+    sample = tokenizer(["导出示例文本", "第二条"], padding=True, return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    class _Encoder(torch.nn.Module):
+        """只输出最后一层隐状态，池化在ONNX Runtime之外用numpy完成"""
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+
+        def forward(self, *inputs):
+            return self.auto_model(**dict(zip(input_names, inputs)), return_dict=True).last_hidden_state
+
+    encoder = _Encoder(transformer.auto_model).eval()
+    kwargs = {}
+    # 新版torch默认使用dynamo导出，这里固定使用支持dynamic_axes的TorchScript导出
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        kwargs["dynamo"] = False
+    fp32_file = onnx_model_file(model_path, "onnx")
+    with torch.no_grad():
+        torch.onnx.export(encoder, tuple(sample[name] for name in input_names), fp32_file,
+                          input_names=input_names, output_names=["last_hidden_state"],
+                          dynamic_axes=dynamic_axes, opset_version=opset, do_constant_folding=True, **kwargs)
+    files = {"onnx": fp32_file}
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        int8_file = onnx_model_file(model_path, "onnx_int8")
+        quantize_dynamic(fp32_file, int8_file, weight_type=QuantType.QInt8, per_channel=True)
+        files["onnx_int8"] = int8_file
+
+    config.update({"pad_token_id": tokenizer.pad_token_id, "pad_token": tokenizer.pad_token,
+                   "source_model": os.path.abspath(model_path), "opset": opset})
+    atomic_write_json(os.path.join(output_dir, "embedding_config.json"), config)
+    logger.info(f"已导出ONNX模型: {', '.join(files.values())}")
+    return files
+
+
+def compare_embeddings(reference, candidate, texts, batch_size=32):
+    """比较两个后端对同一批文本的向量，返回逐条余弦相似度的最小值和平均值"""
+    a = np.asarray(reference.encode(texts, batch_size=batch_size, convert_to_numpy=True), dtype=np.float32)
+    b = np.asarray(candidate.encode(texts, batch_size=batch_size, convert_to_numpy=True), dtype=np.float32)
+    cosine = (a * b).sum(axis=1) / np.maximum(np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1), 1e-12)
+    return {"min_cosine": float(cosine.min()), "mean_cosine": float(cosine.mean())}
+
@@ -0,0 +1,173 @@
+import math
+import numpy as np
+import faiss
+from config import (IVF_NLIST, IVF_NPROBE, PQ_M, PQ_NBITS, HNSW_M, HNSW_EF_CONSTRUCTION,
+                    HNSW_EF_SEARCH, INDEX_TRAIN_SAMPLE)
+
+# 支持的索引类型
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+# 支持的向量压缩方式：none为float32原样存储，fp16/int8为标量量化（每维2/1字节），pq为乘积量化（每向量PQ_M字节）
+COMPRESSIONS = ("none", "fp16", "int8", "pq")
+_SQ_TYPES = {"fp16": faiss.ScalarQuantizer.QT_fp16, "int8": faiss.ScalarQuantizer.QT_8bit}
+
+
+def needs_training(index_type, compression="none"):
+    """IVF类索引需要先用样本向量训练聚类中心；int8需要统计每一维的取值范围，pq需要训练码本"""
+    return index_type in ("ivf_flat", "ivf_pq") or compression in ("int8", "pq")
+
+
+def _nlist_for(ntotal):
+    """聚类中心数取配置值和约4*sqrt(n)中的较小者，保证每个中心有足够的训练样本"""
+    return max(1, min(IVF_NLIST, int(4 * math.sqrt(max(ntotal, 1)))))
+
+
+def _pq_m_for(dimension):
+    """PQ子空间数必须能整除向量维度，取不超过配置值的最大约数"""
+    for m in range(min(PQ_M, dimension), 0, -1):
+        if dimension % m == 0:
+            return m
+    return 1
+
+
+def build_index(index_type, dimension, ntotal=0, compression="none"):
+    """按类型和压缩方式创建空索引（均使用内积度量）
+
+    Args:
+        index_type: INDEX_TYPES中的一种
+        dimension: 向量维度
+        ntotal: 预计的向量数量，用于确定IVF聚类中心数
+        compression: COMPRESSIONS中的一种，决定索引中向量的存储方式（ivf_pq本身就是乘积量化，忽略该参数）
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"不支持的压缩方式: {compression}")
+    metric = faiss.METRIC_INNER_PRODUCT
+    if index_type == "flat":
+        if compression in _SQ_TYPES:
+            return faiss.IndexScalarQuantizer(dimension, _SQ_TYPES[compression], metric)
+        if compression == "pq":
+            return faiss.IndexPQ(dimension, _pq_m_for(dimension), PQ_NBITS, metric)
+        return faiss.IndexFlatIP(dimension)
+    if index_type == "ivf_flat" and compression == "pq":
+        index_type = "ivf_pq"
+    if index_type == "ivf_flat":
+        quantizer = faiss.IndexFlatIP(dimension)
+        if compression in _SQ_TYPES:
+            return faiss.IndexIVFScalarQuantizer(quantizer, dimension, _nlist_for(ntotal),
+                                                 _SQ_TYPES[compression], metric)
+        return faiss.IndexIVFFlat(quantizer, dimension, _nlist_for(ntotal), metric)
+    if index_type == "ivf_pq":
+        quantizer = faiss.IndexFlatIP(dimension)
+        return faiss.IndexIVFPQ(quantizer, dimension, _nlist_for(ntotal), _pq_m_for(dimension),
+                                PQ_NBITS, metric)
+    if index_type == "hnsw":
+        if compression in _SQ_TYPES:
+            index = faiss.IndexHNSWSQ(dimension, _SQ_TYPES[compression], HNSW_M, metric)
+        elif compression == "pq":
+            index = faiss.IndexHNSWPQ(dimension, _pq_m_for(dimension), HNSW_M, PQ_NBITS, metric)
+        else:
+            index = faiss.IndexHNSWFlat(dimension, HNSW_M, metric)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        return index
+    raise ValueError(f"不支持的索引类型: {index_type}")
+
+
+def with_ids(index):
+    """flat类索引（含标量量化和PQ）包装为IndexIDMap2，向量ID固定为片段ID，可以按ID删除；
+    IVF自带ID，HNSW不支持删除，原样返回"""
+    if isinstance(faiss.downcast_index(index), faiss.IndexFlatCodes):
+        return faiss.IndexIDMap2(index)
+    return index
+
+
+def supports_removal(index):
+    """索引能否按ID物理删除向量"""
+    return isinstance(faiss.downcast_index(index), (faiss.IndexIDMap, faiss.IndexIDMap2, faiss.IndexIVF))
+
+
+def add_rows(index, vectors, first_id):
+    """以行号（片段ID）为向量ID加入一批向量
+
+    不支持自定义ID的索引（HNSW）按顺序加入；这类索引不会删除向量，顺序编号与行号一致。
+    """
+    if supports_removal(index):
+        index.add_with_ids(vectors, np.arange(first_id, first_id + len(vectors), dtype=np.int64))
+    else:
+        index.add(vectors)
+
+
+def index_type_of(index):
+    """识别已有索引的类型"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+
+def compression_of(index):
+    """识别已有索引中向量的压缩方式"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    if isinstance(index, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return "pq"
+    if isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        qtype = index.sq.qtype
+        return next((name for name, value in _SQ_TYPES.items() if value == qtype), "int8")
+    return "none"
+
+
+def exact_rerank(vectors, query, candidate_ids, top_k):
+    """用全精度向量重新计算候选的内积并排序，返回[(相似度, 片段ID)]中的前top_k个
+
+    Args:
+        vectors: 全部全精度向量（可以是内存映射数组，只读取候选所在的行）
+        query: 查询向量，形状(dim,)或(1, dim)
+        candidate_ids: 候选片段ID
+    """
+    if not len(candidate_ids):
+        return []
+    ids = np.sort(np.asarray(candidate_ids, dtype=np.int64))
+    scores = np.asarray(vectors[ids], dtype=np.float32) @ np.asarray(query, dtype=np.float32).reshape(-1)
+    order = np.argsort(-scores, kind="stable")[:top_k]
+    return [(float(scores[i]), int(ids[i])) for i in order]
+
+
+def configure_search(index, nprobe=IVF_NPROBE, ef_search=HNSW_EF_SEARCH):
+    """设置检索时的精度/速度参数（IVF的nprobe、HNSW的efSearch）"""
+    index_type = index_type_of(index)
+    if index_type in ("ivf_flat", "ivf_pq"):
+        faiss.extract_index_ivf(index).nprobe = nprobe
+    elif index_type == "hnsw":
+        faiss.downcast_index(index).hnsw.efSearch = ef_search
+    return index
+
+
+def train_index(index, vectors, sample_size=INDEX_TRAIN_SAMPLE, seed=0):
+    """用向量样本训练索引；vectors可以是内存映射数组，只读取抽中的行"""
+    if index.is_trained:
+        return index
+    ntotal = len(vectors)
+    if ntotal > sample_size:
+        rows = np.sort(np.random.default_rng(seed).choice(ntotal, sample_size, replace=False))
+        sample = np.ascontiguousarray(vectors[rows], dtype=np.float32)
+    else:
+        sample = np.ascontiguousarray(vectors[:ntotal], dtype=np.float32)
+    index.train(sample)
+    return index
+
+
+def add_in_blocks(index, vectors, start=0, end=None, block_size=65536):
+    """分块把vectors[start:end]加入索引（以行号为ID），避免一次性把内存映射的向量全部读入内存"""
+    end = len(vectors) if end is None else end
+    for block_start in range(start, end, block_size):
+        block_end = min(block_start + block_size, end)
+        add_rows(index, np.ascontiguousarray(vectors[block_start:block_end], dtype=np.float32), block_start)
+    return index
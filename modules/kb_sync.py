@@ -0,0 +1,327 @@
+import os
+import hashlib
+import threading
+from config import KNOWLEDGE_BASE_DIR, VECTOR_STORE_DIR, KB_SYNC_WATCH_INTERVAL
+from .atomic_io import atomic_write_json, read_json
+from .bulk_ingest import BulkIngestor
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+# 知识库目录中会被导入的文件类型（与DocumentLoader支持的类型一致）
+SUPPORTED_EXTENSIONS = ('.pdf', '.txt', '.docx', '.doc')
+
+# 同步过程中每处理这么多个文件保存一次同步状态
+_SAVE_EVERY = 50
+
+
+def file_sha256(file_path, block_size=1 << 20):
+    """分块计算文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class KnowledgeBaseSync:
+    """知识库目录增量同步
+
+    为每个文件记录大小、修改时间和内容哈希。同步时只对大小或修改时间变化的文件计算哈希，
+    只导入新增或内容变化的文件，并删除已删除或被替换文件的旧向量。内容完全相同的文件只导入一次。
+    知识库目录中的文件（无论是同步发现的还是通过界面添加的）以相对路径作为来源名称；
+    目录外的文件以文件名作为来源名称，与其他文件的来源重名时加序号（如"readme (2).md"），不会互相替换。
+    没有可导入文本的文件也记录下来（chunks为0），内容不变时不再重复解析。
+    """
+    def __init__(self, vector_store, ingestor=None, kb_dir=KNOWLEDGE_BASE_DIR, state_file=None):
+        self.vector_store = vector_store
+        # 文件的解析和分割由进程池并行完成，写入向量存储的只有当前线程
+        self.ingestor = ingestor or BulkIngestor(vector_store)
+        self.kb_dir = kb_dir
+        self.state_file = state_file or os.path.join(VECTOR_STORE_DIR, "kb_sync.json")
+        self._lock = threading.Lock()
+        self._watch_stop = None
+
+        state = read_json(self.state_file, default={})
+        # 来源名称 -> {path, size, mtime, sha256, managed, indexed, chunks}
+        self.files = state.get("files", {})
+        # 向量存储中已不存在的来源（如知识库被清空）不再视为已导入，下次同步时重新导入；
+        # 没有可导入文本的文件本来就不在向量存储中
+        self.files = {name: entry for name, entry in self.files.items()
+                      if not entry.get("indexed") or entry.get("chunks") == 0 or vector_store.has_source(name)}
+
+    def _save(self):
+        atomic_write_json(self.state_file, {"files": self.files})
+
+    def _relative_name(self, path):
+        """知识库目录中（会被同步的）文件的来源名称，与scan一致；其他文件返回None"""
+        if not path.lower().endswith(SUPPORTED_EXTENSIONS):
+            return None
+        root = os.path.abspath(self.kb_dir)
+        try:
+            if os.path.commonpath([root, path]) != root:
+                return None
+        except ValueError:
+            # Windows上不同盘符的路径
+            return None
+        return os.path.relpath(path, root).replace(os.sep, "/")
+
+    def _name_taken(self, name, path, assigned):
+        """来源名称是否已被另一个文件（或不是来自文件的来源）占用"""
+        if name in assigned:
+            return assigned[name] != path
+        entry = self.files.get(name)
+        if entry is not None:
+            return os.path.normcase(entry["path"]) != os.path.normcase(path)
+        return self.vector_store.has_source(name)
+
+    def _source_name(self, file_path, assigned):
+        """界面添加的文件的来源名称，返回(来源名称, 是否在知识库目录中)
+
+        同一个文件再次添加时沿用原来的名称（替换旧内容）；目录外的文件与其他来源重名时加序号。
+        """
+        path = os.path.abspath(file_path)
+        relative = self._relative_name(path)
+        if relative is not None:
+            return relative, True
+        name = os.path.basename(path)
+        stem, extension = os.path.splitext(name)
+        number = 1
+        while self._name_taken(name, path, assigned):
+            number += 1
+            name = f"{stem} ({number}){extension}"
+        return name, False
+
+    def _indexed_hashes(self):
+        return {entry["sha256"]: name for name, entry in self.files.items() if entry.get("indexed")}
+
+    def _file_entry(self, path, managed):
+        stat = os.stat(path)
+        return {"path": os.path.abspath(path), "size": stat.st_size, "mtime": stat.st_mtime,
+                "sha256": file_sha256(path), "managed": managed, "indexed": False}
+
+    def add_files(self, file_paths, on_file_done=None, progress_callback=None):
+        """导入界面选择的文件（来源名称见_source_name），内容已存在的文件跳过
+
+        Args:
+            file_paths: 文件路径列表
+            on_file_done: 每个文件完成后调用，接收参数(result)，result见返回值
+            progress_callback: 片段编码进度回调，接收参数(done, total)
+
+        Returns:
+            list: 每个文件一个dict: {"status": "added" | "replaced" | "empty" | "duplicate" | "failed",
+                  "source": 来源名称, "chunks": 片段数, "duplicate_of": 重复时已有的来源, "error": 错误信息}
+        """
+        with self._lock:
+            results = {}
+            pending = {}
+            indexed_hashes = self._indexed_hashes()
+            assigned = {}
+            for file_path in file_paths:
+                source_name, managed = self._source_name(file_path, assigned)
+                assigned[source_name] = os.path.abspath(file_path)
+                try:
+                    entry = self._file_entry(file_path, managed=managed)
+                except OSError as e:
+                    results[file_path] = {"status": "failed", "source": source_name, "chunks": 0, "error": str(e)}
+                    continue
+                existing = indexed_hashes.get(entry["sha256"])
+                if existing is not None:
+                    results[file_path] = {"status": "duplicate", "source": source_name, "chunks": 0,
+                                          "duplicate_of": existing}
+                else:
+                    status = "replaced" if self.vector_store.has_source(source_name) else "added"
+                    pending[file_path] = (source_name, entry, status)
+                    indexed_hashes[entry["sha256"]] = source_name
+                if file_path in results and on_file_done:
+                    on_file_done(results[file_path])
+
+            def record(file_path, source_name, chunk_count, error):
+                _, entry, status = pending[file_path]
+                if error is None:
+                    entry.update(indexed=True, chunks=chunk_count)
+                    self.files[source_name] = entry
+                    results[file_path] = {"status": status if chunk_count else "empty", "source": source_name,
+                                          "chunks": chunk_count}
+                else:
+                    results[file_path] = {"status": "failed", "source": source_name, "chunks": 0, "error": str(error)}
+                if on_file_done:
+                    on_file_done(results[file_path])
+
+            if pending:
+                self.ingestor.ingest([(path, item[0]) for path, item in pending.items()],
+                                     on_file_done=record, progress_callback=progress_callback)
+                self._save()
+            return [results[file_path] for file_path in file_paths]
+
+    def add_file(self, file_path, progress_callback=None):
+        """导入单个文件，返回值见add_files"""
+        return self.add_files([file_path], progress_callback=progress_callback)[0]
+
+    def remove_source(self, source_name):
+        """删除一个来源的文档，返回被删除的片段数
+
+        知识库目录中的文件保留记录（标记为未导入），内容不变时同步不会再导入；文件修改后会重新导入。
+        """
+        with self._lock:
+            removed = self.vector_store.delete_source(source_name)
+            entry = self.files.get(source_name)
+            if entry is not None:
+                if entry.get("managed"):
+                    entry["indexed"] = False
+                else:
+                    del self.files[source_name]
+                self._save()
+            return removed
+
+    def reset(self):
+        """知识库被清空后调用，丢弃全部同步记录"""
+        with self._lock:
+            self.files = {}
+            self._save()
+
+    def scan(self):
+        """扫描知识库目录，返回(新增, 修改, 删除, 来源名称到路径的映射)，前三项为来源名称列表
+
+        大小和修改时间都没变的文件不读取内容；变了的再比较哈希，内容相同只更新记录。
+        """
+        seen = {}
+        for root, _, names in os.walk(self.kb_dir):
+            for name in names:
+                if not name.lower().endswith(SUPPORTED_EXTENSIONS):
+                    continue
+                path = os.path.join(root, name)
+                source_name = os.path.relpath(path, self.kb_dir).replace(os.sep, "/")
+                seen[source_name] = path
+
+        added, changed = [], []
+        for source_name, path in seen.items():
+            stat = os.stat(path)
+            entry = self.files.get(source_name)
+            if entry is None or not entry.get("managed"):
+                added.append(source_name)
+            elif entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime:
+                sha256 = file_sha256(path)
+                if sha256 == entry["sha256"]:
+                    entry.update(size=stat.st_size, mtime=stat.st_mtime)
+                else:
+                    changed.append(source_name)
+
+        deleted = [name for name, entry in self.files.items() if entry.get("managed") and name not in seen]
+        return added, changed, deleted, seen
+
+    def sync(self, progress_callback=None):
+        """同步知识库目录，工作量与变化的文件数成正比
+
+        Args:
+            progress_callback: 每处理完一个文件调用一次，接收参数(source_name, status)
+
+        Returns:
+            dict: 各类变化的数量和失败的文件
+        """
+        with self._lock:
+            added, changed, deleted, paths = self.scan()
+            summary = {"added": 0, "changed": 0, "deleted": 0, "duplicate": 0, "empty": 0, "unchanged": 0,
+                       "failed": {}}
+            if not (added or changed or deleted):
+                summary["unchanged"] = len(paths)
+                return summary
+            logger.info(f"同步知识库目录: 新增 {len(added)}，修改 {len(changed)}，删除 {len(deleted)}")
+
+            # 先删除：已删除文件的向量下线；若还有内容相同的文件，改为导入那个文件
+            for source_name in deleted:
+                entry = self.files.pop(source_name)
+                if entry.get("indexed"):
+                    self.vector_store.delete_source(source_name)
+                    successor = next((name for name, other in self.files.items()
+                                      if other["sha256"] == entry["sha256"] and not other.get("indexed")), None)
+                    if successor is not None and successor not in changed:
+                        changed.append(successor)
+                summary["deleted"] += 1
+                if progress_callback:
+                    progress_callback(source_name, "deleted")
+
+            # 逐个比对内容哈希：与已导入文件内容相同的只记录不导入，其余交给批量导入
+            indexed_hashes = self._indexed_hashes()
+            to_ingest = {}
+            for source_name in added + changed:
+                path = paths.get(source_name)
+                if path is None:
+                    continue
+                status = "changed" if source_name in changed else "added"
+                other = self.files.get(source_name)
+                if other is not None and not other.get("managed"):
+                    # 界面添加的目录外文件已占用这个名称，不替换它
+                    summary["failed"][source_name] = f"来源名称已被界面添加的文件占用: {other['path']}"
+                    continue
+                try:
+                    entry = self._file_entry(path, managed=True)
+                except OSError as e:
+                    summary["failed"][source_name] = str(e)
+                    continue
+                duplicate_of = indexed_hashes.get(entry["sha256"])
+                if duplicate_of is not None and duplicate_of != source_name:
+                    # 若本来源之前导入过则下线旧向量
+                    if self.vector_store.has_source(source_name):
+                        self.vector_store.delete_source(source_name)
+                    self.files[source_name] = entry
+                    summary["duplicate"] += 1
+                    if progress_callback:
+                        progress_callback(source_name, "duplicate")
+                else:
+                    to_ingest[path] = (source_name, entry, status)
+                    indexed_hashes[entry["sha256"]] = source_name
+
+            processed = [0]
+
+            def record(path, source_name, chunk_count, error):
+                _, entry, status = to_ingest[path]
+                if error is None:
+                    entry.update(indexed=True, chunks=chunk_count)
+                    self.files[source_name] = entry
+                    if not chunk_count:
+                        status = "empty"
+                    summary[status] += 1
+                else:
+                    summary["failed"][source_name] = str(error)
+                    status = "failed"
+                if progress_callback:
+                    progress_callback(source_name, status)
+                processed[0] += 1
+                if processed[0] % _SAVE_EVERY == 0:
+                    self._save()
+
+            if to_ingest:
+                self.ingestor.ingest([(path, item[0]) for path, item in to_ingest.items()], on_file_done=record)
+
+            self._save()
+            summary["unchanged"] = (len(paths) - summary["added"] - summary["changed"] - summary["duplicate"]
+                                    - summary["empty"] - len(summary["failed"]))
+            return summary
+
+    def start_watching(self, interval=KB_SYNC_WATCH_INTERVAL, on_change=None):
+        """启动后台轮询，每隔interval秒同步一次知识库目录
+
+        Args:
+            interval: 轮询间隔（秒）
+            on_change: 有变化时的回调函数，接收sync()的返回值
+        """
+        if self._watch_stop is not None or not interval:
+            return
+        self._watch_stop = threading.Event()
+
+        def watch_loop(stop):
+            while not stop.wait(interval):
+                try:
+                    summary = self.sync()
+                    if on_change and (summary["added"] or summary["changed"] or summary["deleted"]):
+                        on_change(summary)
+                except Exception as e:
+                    logger.exception(f"同步知识库目录时出错: {e}")
+
+        threading.Thread(target=watch_loop, args=(self._watch_stop,), daemon=True).start()
+
+    def stop_watching(self):
+        if self._watch_stop is not None:
+            self._watch_stop.set()
+            self._watch_stop = None
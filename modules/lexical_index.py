@@ -0,0 +1,178 @@
+import re
+import math
+import unicodedata
+from array import array
+import numpy as np
+from config import LEXICAL_NGRAM, BM25_K1, BM25_B
+
+# 中日韩统一表意文字按字符n-gram切分；字母数字（含_-.连接的标识符）整体作为一个词
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[_\-.][a-z0-9]+)*|[㐀-鿿豈-﫿]+")
+_IDENTIFIER_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9_\-./:#]{1,63}")
+_TF_MAX = 65535
+
+
+def tokenize(text, ngram=LEXICAL_NGRAM):
+    """把文本切分为检索词：汉字连续段取字符n-gram（不足n个字时取整段），字母数字词整体保留
+
+    全角字符先转为半角、字母转为小写；带连接符的标识符（如ERR-1024）同时保留各个部分。
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    terms = []
+    for match in _TOKEN_PATTERN.finditer(text):
+        token = match.group()
+        if token[0] >= "㐀":
+            if len(token) <= ngram:
+                terms.append(token)
+            else:
+                terms.extend(token[i:i + ngram] for i in range(len(token) - ngram + 1))
+        else:
+            terms.append(token)
+            if len(token) > 1 and any(c in "_-." for c in token):
+                terms.extend(part for part in re.split(r"[_\-.]", token) if part)
+    return terms
+
+
+def looks_like_identifier(query):
+    """查询是否像编号、错误码、函数名之类的标识符（单个词，含数字或连接符），这类查询只做关键词检索"""
+    query = unicodedata.normalize("NFKC", query).strip()
+    return bool(_IDENTIFIER_PATTERN.fullmatch(query)) and any(c.isdigit() or c in "_-./:#" for c in query)
+
+
+class LexicalIndex:
+    """基于字符n-gram的BM25倒排索引
+
+    - 倒排表：检索词 -> (片段ID数组, 词频数组)，片段ID与向量行号一致，只追加
+    - 片段长度：每个片段的检索词数，用于BM25的长度归一化
+
+    片段按ID顺序连续加入（见add），重启时从快照加载，快照之后的片段由调用方从片段存储补上。
+    已删除的片段仍留在倒排表中，由调用方在检索后过滤。
+    """
+    def __init__(self, ngram=LEXICAL_NGRAM, k1=BM25_K1, b=BM25_B):
+        self.ngram = ngram
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.doc_lengths = array('i')
+        self.total_length = 0
+
+    @property
+    def ntotal(self):
+        """已建立索引的片段数（即下一个片段的ID）"""
+        return len(self.doc_lengths)
+
+    def analyze(self, texts):
+        """把一批文本切分并统计词频，返回add()的输入（不修改索引，可在锁外执行）"""
+        analyzed = []
+        for text in texts:
+            counts = {}
+            for term in tokenize(text, self.ngram):
+                counts[term] = counts.get(term, 0) + 1
+            analyzed.append(counts)
+        return analyzed
+
+    def add(self, first_id, analyzed):
+        """加入一批已切分的片段，first_id必须等于当前的ntotal"""
+        if first_id != self.ntotal:
+            raise ValueError(f"片段ID不连续: {first_id} != {self.ntotal}")
+        postings = self.postings
+        for chunk_id, counts in enumerate(analyzed, first_id):
+            length = 0
+            for term, tf in counts.items():
+                entry = postings.get(term)
+                if entry is None:
+                    entry = postings[term] = (array('i'), array('H'))
+                entry[0].append(chunk_id)
+                entry[1].append(min(tf, _TF_MAX))
+                length += tf
+            self.doc_lengths.append(length)
+            self.total_length += length
+
+    def add_texts(self, first_id, texts):
+        self.add(first_id, self.analyze(texts))
+
+    def search(self, query, limit, min_coverage=0.0):
+        """BM25检索
+
+        Args:
+            query: 查询文本
+            limit: 最多返回的候选数
+            min_coverage: 片段命中的查询词IDF权重占查询总权重的最低比例，过滤只碰巧共享常见字的片段
+
+        Returns:
+            list: [(片段ID, BM25分数, 覆盖率)]，按分数降序
+        """
+        n = self.ntotal
+        query_terms = list(dict.fromkeys(tokenize(query, self.ngram)))
+        terms = [term for term in query_terms if term in self.postings]
+        if n == 0 or not terms:
+            return []
+        # 知识库中不存在的字母数字词也计入总权重（编号不同就不算命中）；
+        # 不存在的汉字n-gram多是跨词的组合（如"布什"来自"发布什么"），不计入
+        total_weight = sum(self._idf(len(self.postings[term][0]), n) for term in terms)
+        total_weight += sum(self._idf(0, n) for term in query_terms
+                            if term not in self.postings and term[0] < "㐀")
+
+        doc_lengths = np.frombuffer(self.doc_lengths, dtype=np.int32)
+        avg_length = self.total_length / n if self.total_length else 1.0
+        scores = np.zeros(n, dtype=np.float32)
+        matched = np.zeros(n, dtype=np.float32)
+        for term in terms:
+            ids_array, tf_array = self.postings[term]
+            ids = np.frombuffer(ids_array, dtype=np.int32)
+            tf = np.frombuffer(tf_array, dtype=np.uint16).astype(np.float32)
+            idf = self._idf(len(ids), n)
+            norm = self.k1 * (1 - self.b + self.b * doc_lengths[ids] / avg_length)
+            # 同一个检索词在倒排表中每个片段只出现一次，可以直接按下标累加
+            scores[ids] += idf * tf * (self.k1 + 1) / (tf + norm)
+            matched[ids] += idf
+
+        if min_coverage > 0:
+            candidates = np.flatnonzero(matched >= min_coverage * total_weight)
+        else:
+            candidates = np.flatnonzero(scores)
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(int(i), float(scores[i]), float(matched[i] / total_weight)) for i in candidates]
+
+    @staticmethod
+    def _idf(df, n):
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def serialize(self):
+        """把索引拼接为几个连续数组（持有锁时调用，只做内存拷贝）"""
+        terms = list(self.postings)
+        counts = np.fromiter((len(self.postings[term][0]) for term in terms), dtype=np.int64, count=len(terms))
+        return {
+            "terms": np.array(terms, dtype=str) if terms else np.empty(0, dtype='<U1'),
+            "offsets": np.cumsum(counts),
+            "ids": np.frombuffer(b"".join(self.postings[term][0].tobytes() for term in terms), dtype=np.int32),
+            "tfs": np.frombuffer(b"".join(self.postings[term][1].tobytes() for term in terms), dtype=np.uint16),
+            "doc_lengths": np.array(self.doc_lengths, dtype=np.int32),
+            "params": np.array([self.ngram], dtype=np.int64)
+        }
+
+    @staticmethod
+    def write(f, data):
+        """把serialize()的结果写入文件对象"""
+        np.savez(f, **data)
+
+    @classmethod
+    def load(cls, path):
+        """从快照文件加载；快照的n-gram长度与当前配置不同时返回None（需要重建）"""
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["params"][0]) != LEXICAL_NGRAM:
+                return None
+            index = cls()
+            terms, offsets = data["terms"], data["offsets"]
+            ids, tfs = data["ids"], data["tfs"]
+            start = 0
+            for term, end in zip(terms.tolist(), offsets.tolist()):
+                id_array, tf_array = array('i'), array('H')
+                id_array.frombytes(ids[start:end].tobytes())
+                tf_array.frombytes(tfs[start:end].tobytes())
+                index.postings[term] = (id_array, tf_array)
+                start = end
+            index.doc_lengths.frombytes(data["doc_lengths"].astype(np.int32).tobytes())
+        index.total_length = int(np.frombuffer(index.doc_lengths, dtype=np.int32).sum(dtype=np.int64))
+        return index
@@ -1,36 +1,278 @@
 import os
-from openai import OpenAI
-from config import API_KEY, BASE_URL, MODEL_NAME
+import time
+import random
+import asyncio
+import threading
+import concurrent.futures
+from collections import deque
+from email.utils import parsedate_to_datetime
+from config import (API_KEY, BASE_URL, MODEL_NAME, LLM_MAX_CONCURRENT_REQUESTS, LLM_MAX_CONNECTIONS,
+                    LLM_MAX_KEEPALIVE_CONNECTIONS, LLM_CONNECT_TIMEOUT, LLM_FIRST_TOKEN_TIMEOUT,
+                    LLM_TOTAL_TIMEOUT, LLM_MAX_RETRIES, LLM_RETRY_BASE_DELAY, LLM_RETRY_MAX_DELAY,
+                    LLM_HEDGE_ENABLED, LLM_HEDGE_DELAY, LLM_HEDGE_DEFAULT_DELAY, LLM_HEDGE_MIN_SAMPLES)
+from . import async_runtime
+from .logger import get_logger
 
-class LLMService:
+logger = get_logger(__name__)
+
+# 所有LLMService实例共享一个HTTP连接池（在后台事件循环中使用）
+_http_client_lock = threading.Lock()
+_http_client = None
+
+# 可以重试的HTTP状态码
+_RETRYABLE_STATUS = (408, 409, 429)
+
+
+def _shared_http_client():
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            import httpx
+            _http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS
+                ),
+                timeout=httpx.Timeout(LLM_TOTAL_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+            )
+        return _http_client
+
+
+class LLMTimeoutError(Exception):
+    """首token或整个回答超时"""
+
+
+def _is_retryable(error):
+    """429、5xx、连接错误和首token超时可以重试，其余错误（如鉴权失败、参数错误）直接返回"""
+    if isinstance(error, LLMTimeoutError):
+        return True
+    import openai
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    status = getattr(error, "status_code", None)
+    return status is not None and (status in _RETRYABLE_STATUS or status >= 500)
+
+
+def _retry_after(error):
+    """解析服务端要求的等待时间（Retry-After / retry-after-ms），没有时返回None"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _delta_of(chunk):
+    if chunk.choices and chunk.choices[0].delta.content:
+        return chunk.choices[0].delta.content
+    return ""
+
+
+class CancelToken:
+    """用于停止正在进行的流式回答，可在任意线程调用cancel()"""
     def __init__(self):
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._future = None
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+            future = self._future
+        if future is not None:
+            future.cancel()
+
+    def _attach(self, future):
+        with self._lock:
+            self._future = future
+            cancelled = self._cancelled
+        if cancelled:
+            future.cancel()
+
+
+class LLMService:
+    """大模型服务
+
+    请求在后台事件循环中通过AsyncOpenAI发出，共享HTTP连接池，同时进行的请求数不超过
+    max_concurrent。协程接口为acomplete/astream，同步接口get_completion/get_streaming_completion
+    保持原有行为，阻塞调用线程直到请求完成。
+
+    连接、首token和总时长分别有超时；429、5xx、连接错误和首token超时按带随机抖动的指数退避重试，
+    服务端给出Retry-After时按其等待。开启对冲后，若首token在p95延迟内未到达，再发一个相同请求，
+    取先输出的一个并关闭另一个。
+    """
+    def __init__(self, max_concurrent=LLM_MAX_CONCURRENT_REQUESTS, first_token_timeout=LLM_FIRST_TOKEN_TIMEOUT,
+                 total_timeout=LLM_TOTAL_TIMEOUT, max_retries=LLM_MAX_RETRIES, hedge=LLM_HEDGE_ENABLED,
+                 hedge_delay=LLM_HEDGE_DELAY):
         self.api_key = API_KEY
         self.base_url = BASE_URL
         self.model = MODEL_NAME
         self.client = None
-        
+        self.first_token_timeout = first_token_timeout
+        self.total_timeout = total_timeout
+        self.max_retries = max_retries
+        self.hedge = hedge
+        self.hedge_delay = hedge_delay
+        self.max_concurrent = max_concurrent
+        # 在事件循环中首次使用时创建（Python 3.9的Semaphore在创建时绑定事件循环）
+        self._semaphore = None
+        # 最近的首token延迟（秒），用于计算对冲等待时间
+        self._first_token_latencies = deque(maxlen=200)
+        self.stats = {"requests": 0, "retries": 0, "hedged": 0, "hedge_wins": 0, "timeouts": 0}
+
         # 如果API Key已配置，则初始化客户端
         if self.api_key:
             self._init_client()
-    
+
     def _init_client(self):
         """初始化OpenAI客户端"""
         try:
-            self.client = OpenAI(
+            # openai在首次配置API Key时才导入，不拖慢程序启动
+            from openai import AsyncOpenAI
+            self.client = AsyncOpenAI(
                 api_key=self.api_key,
-                base_url=self.base_url
+                base_url=self.base_url,
+                http_client=_shared_http_client(),
+                # 重试由本类负责（需要区分首token前后、支持对冲）
+                max_retries=0
             )
         except Exception as e:
-            print(f"初始化客户端失败: {e}")
+            logger.error(f"初始化客户端失败: {e}")
             self.client = None
-    
+
     def update_api_key(self, new_api_key):
         """更新API Key并重新初始化客户端"""
         self.api_key = new_api_key
         self._init_client()
-    
-    def get_completion(self, messages):
-        """调用大模型获取回复"""
+
+    def _limiter(self):
+        """限制同时进行的请求数的信号量"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        return self._semaphore
+
+    def _hedge_after(self):
+        """发出对冲请求前的等待时间"""
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        if len(self._first_token_latencies) < LLM_HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_DEFAULT_DELAY
+        latencies = sorted(self._first_token_latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    def _retry_delay(self, attempt, error):
+        """第attempt次重试前的等待时间：优先Retry-After，否则为带完全抖动的指数退避"""
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+
+    async def _with_retries(self, attempt_fn, deadline):
+        """按重试策略执行attempt_fn(timeout)，直到成功、不可重试的错误、次数用尽或超过总时限"""
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            remaining = deadline - loop.time()
+            try:
+                if remaining <= 0:
+                    raise LLMTimeoutError(f"请求超过总时限 {self.total_timeout} 秒")
+                return await attempt_fn(remaining)
+            except Exception as e:
+                if isinstance(e, LLMTimeoutError):
+                    self.stats["timeouts"] += 1
+                if attempt >= self.max_retries or not _is_retryable(e):
+                    raise
+                delay = self._retry_delay(attempt, e)
+                if loop.time() + delay >= deadline:
+                    raise
+                attempt += 1
+                self.stats["retries"] += 1
+                logger.warning(f"大模型请求失败（{e}），{delay:.1f}秒后第{attempt}次重试")
+                await asyncio.sleep(delay)
+
+    async def _open_stream(self, messages):
+        """发起流式请求并等到第一段内容，返回(stream, 迭代器, 第一段内容)"""
+        stream = await self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            stream=True
+        )
+        try:
+            iterator = stream.__aiter__()
+            while True:
+                try:
+                    chunk = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return stream, iterator, ""
+                first = _delta_of(chunk)
+                if first:
+                    return stream, iterator, first
+        except BaseException:
+            await stream.close()
+            raise
+
+    async def _open_stream_hedged(self, messages):
+        """首token在对冲等待时间内未到达时再发一个相同请求，返回先到的一个，关闭另一个"""
+        primary = asyncio.ensure_future(self._open_stream(messages))
+        tasks = {primary}
+        errors = []
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self._hedge_after())
+            if not done:
+                self.stats["hedged"] += 1
+                tasks.add(asyncio.ensure_future(self._open_stream(messages)))
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.stats["hedge_wins"] += 1
+                        winner = task.result()
+                        # 同时完成的另一个请求直接关闭
+                        for other in done - {task}:
+                            if other.exception() is None:
+                                await other.result()[0].close()
+                        return winner
+                    errors.append(task.exception())
+            raise errors[0]
+        finally:
+            for task in tasks:
+                task.cancel()
+            for task in tasks:
+                try:
+                    stream = (await task)[0]
+                    await stream.close()
+                except BaseException:
+                    pass
+
+    async def _open_stream_once(self, messages, timeout):
+        """一次尝试：在首token超时内拿到第一段内容"""
+        start = time.perf_counter()
+        opener = self._open_stream_hedged(messages) if self.hedge else self._open_stream(messages)
+        try:
+            result = await asyncio.wait_for(opener, min(timeout, self.first_token_timeout))
+        except asyncio.TimeoutError:
+            raise LLMTimeoutError(f"{min(timeout, self.first_token_timeout):g} 秒内未收到首个token")
+        self._first_token_latencies.append(time.perf_counter() - start)
+        return result
+
+    async def acomplete(self, messages):
+        """调用大模型获取回复（协程）"""
         try:
             # 检查客户端是否已初始化
             if not self.client:
@@ -38,13 +280,20 @@ class LLMService:
                     "success": False,
                     "error": "API Key未配置，请先设置API Key"
                 }
-                
-            completion = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages
-            )
+
+            async def attempt(timeout):
+                try:
+                    return await asyncio.wait_for(
+                        self.client.chat.completions.create(model=self.model, messages=messages), timeout)
+                except asyncio.TimeoutError:
+                    raise LLMTimeoutError(f"请求超过总时限 {self.total_timeout} 秒")
+
+            async with self._limiter():
+                self.stats["requests"] += 1
+                deadline = asyncio.get_running_loop().time() + self.total_timeout
+                completion = await self._with_retries(attempt, deadline)
             return {
-                "success": True, 
+                "success": True,
                 "content": completion.choices[0].message.content
             }
         except Exception as e:
@@ -52,35 +301,83 @@ class LLMService:
                 "success": False,
                 "error": str(e)
             }
-    
-    def get_streaming_completion(self, messages, callback):
-        """流式调用大模型获取回复
-        
+
+    async def astream(self, messages, callback):
+        """流式调用大模型获取回复（协程）
+
+        开始输出之前的失败会按策略重试；开始输出后出错或超时则结束回答。
+        协程被取消时关闭HTTP流，服务端随即停止生成，不再为剩余的token计费。
+
         Args:
             messages: 对话消息列表
-            callback: 每次收到流式内容时的回调函数，接收参数(content_delta, is_done)
+            callback: 每次收到流式内容时的回调函数，接收参数(content_delta, is_done)，在事件循环线程中调用
+
+        Returns:
+            bool: 是否成功完成
         """
         try:
             # 检查客户端是否已初始化
             if not self.client:
                 callback("API Key未配置，请先设置API Key", True)
                 return False
-                
-            stream = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                stream=True
-            )
-            
-            # 处理流式响应
-            for chunk in stream:
-                if chunk.choices and chunk.choices[0].delta.content:
-                    content_delta = chunk.choices[0].delta.content
-                    callback(content_delta, False)
-            
+
+            async with self._limiter():
+                self.stats["requests"] += 1
+                loop = asyncio.get_running_loop()
+                deadline = loop.time() + self.total_timeout
+                stream, iterator, first = await self._with_retries(
+                    lambda timeout: self._open_stream_once(messages, timeout), deadline)
+                try:
+                    if first:
+                        callback(first, False)
+                    # 处理流式响应，整个回答不超过总时限
+                    while True:
+                        remaining = deadline - loop.time()
+                        if remaining <= 0:
+                            raise LLMTimeoutError(f"回答超过总时限 {self.total_timeout} 秒")
+                        try:
+                            chunk = await asyncio.wait_for(iterator.__anext__(), remaining)
+                        except StopAsyncIteration:
+                            break
+                        except asyncio.TimeoutError:
+                            raise LLMTimeoutError(f"回答超过总时限 {self.total_timeout} 秒")
+                        content_delta = _delta_of(chunk)
+                        if content_delta:
+                            callback(content_delta, False)
+                finally:
+                    # 正常结束、出错或被取消时都关闭连接
+                    await stream.close()
+
             # 流式输出完成
             callback("", True)
             return True
-            
+
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            callback(f"错误: {str(e)}", True)
\ No newline at end of file
+            callback(f"错误: {str(e)}", True)
+            return False
+
+    def get_completion(self, messages):
+        """调用大模型获取回复（阻塞）"""
+        return async_runtime.run(self.acomplete(messages))
+
+    def get_streaming_completion(self, messages, callback, cancel_token=None):
+        """流式调用大模型获取回复（阻塞到回答结束或被停止）
+
+        Args:
+            messages: 对话消息列表
+            callback: 每次收到流式内容时的回调函数，接收参数(content_delta, is_done)
+            cancel_token: 可选的CancelToken，调用其cancel()停止回答
+
+        Returns:
+            成功完成返回True，出错返回False，被停止返回None
+        """
+        future = async_runtime.submit(self.astream(messages, callback))
+        if cancel_token is not None:
+            cancel_token._attach(future)
+        try:
+            return future.result()
+        except concurrent.futures.CancelledError:
+            callback("", True)
+            return None
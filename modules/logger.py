@@ -0,0 +1,53 @@
+import sys
+import json
+import time
+import logging
+import threading
+from config import LOG_LEVEL, LOG_FORMAT
+
+# 所有模块的日志都挂在这个根记录器下，级别和输出格式统一配置
+ROOT_LOGGER = "rag"
+_setup_lock = threading.Lock()
+_handler = None
+
+
+def get_logger(name):
+    """获取模块的日志记录器，name通常传__name__（如modules.vector_store记为rag.vector_store）"""
+    return logging.getLogger(f"{ROOT_LOGGER}.{name.rsplit('.', 1)[-1]}")
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行JSON：时间、级别、模块、消息，以及通过extra={"fields": {...}}附带的字段"""
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT):
+    """配置日志级别和输出格式（text或json），输出到标准输出；重复调用时更新配置
+
+    未调用时（如在脚本中直接使用VectorStore），只有WARNING及以上的日志由logging默认输出到标准错误。
+    """
+    global _handler
+    with _setup_lock:
+        logger = logging.getLogger(ROOT_LOGGER)
+        if _handler is None:
+            _handler = logging.StreamHandler(sys.stdout)
+            logger.addHandler(_handler)
+            # 不交给根记录器，避免第三方库配置的处理器重复输出
+            logger.propagate = False
+        if fmt == "json":
+            _handler.setFormatter(JsonFormatter())
+        else:
+            _handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+        logger.setLevel(level.upper() if isinstance(level, str) else level)
@@ -0,0 +1,97 @@
+import time
+import queue
+import asyncio
+import threading
+from concurrent.futures import Future
+from config import TOP_K_RETRIEVAL, QUERY_BATCH_MAX_SIZE, QUERY_BATCH_WAIT_MS
+from . import tracing
+
+
+class QueryBatcher:
+    """检索请求的微批调度
+
+    并发到达的查询先进入队列，后台线程收集max_wait_ms毫秒内（最多max_batch_size个）的查询，
+    合并为一次嵌入编码和一次index.search（见VectorStore.search_batch），再把结果分别交给各个调用方。
+    并发越高，每个查询分摊的编码和检索开销越小；只有一个查询时最多多等待max_wait_ms毫秒。
+    vector_store也可以是CollectionManager，此时查询可以指定要检索的集合。
+    """
+    def __init__(self, vector_store, max_batch_size=QUERY_BATCH_MAX_SIZE, max_wait_ms=QUERY_BATCH_WAIT_MS):
+        self.vector_store = vector_store
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._closed = False
+        self.stats = {"queries": 0, "batches": 0}
+        self._thread = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, query, top_k=TOP_K_RETRIEVAL, threshold=0.75, collections=None):
+        """提交一个查询，返回Future，结果与VectorStore.search相同（collections需要vector_store是CollectionManager）"""
+        if self._closed:
+            raise RuntimeError("QueryBatcher已关闭")
+        future = Future()
+        # 批次在后台线程中执行，记下提交时所属的问答，编码和检索的耗时同时计入合并在一起的每个问答
+        collections = tuple(collections) if collections else None
+        self._queue.put((query, top_k, threshold, collections, future, tracing.current_trace()))
+        return future
+
+    def search(self, query, top_k=TOP_K_RETRIEVAL, threshold=0.75, collections=None):
+        """提交查询并阻塞等待结果"""
+        return self.submit(query, top_k, threshold, collections).result()
+
+    async def asearch(self, query, top_k=TOP_K_RETRIEVAL, threshold=0.75, collections=None):
+        """search的协程版本，等待期间不占用事件循环"""
+        return await asyncio.wrap_future(self.submit(query, top_k, threshold, collections))
+
+    def close(self):
+        """停止后台线程，已提交的查询仍会完成"""
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self):
+        """阻塞等待第一个查询，再收集等待窗口内到达的查询；收到关闭信号时返回None"""
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # 处理完这一批后再退出
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            self.stats["batches"] += 1
+            self.stats["queries"] += len(batch)
+
+            # top_k、阈值和检索的集合都相同的查询才能合并
+            groups = {}
+            for query, top_k, threshold, collections, future, trace in batch:
+                if future.set_running_or_notify_cancel():
+                    groups.setdefault((top_k, threshold, collections), []).append((query, future, trace))
+            for (top_k, threshold, collections), items in groups.items():
+                # 只有指定了集合时才传collections，vector_store是VectorStore时接口不变
+                kwargs = {"collections": list(collections)} if collections else {}
+                try:
+                    with tracing.attach([trace for _, _, trace in items]):
+                        results = self.vector_store.search_batch([query for query, _, _ in items], top_k, threshold,
+                                                                 **kwargs)
+                except Exception as e:
+                    for _, future, _ in items:
+                        future.set_exception(e)
+                    continue
+                for (_, future, _), hits in zip(items, results):
+                    future.set_result(hits)
@@ -1,97 +1,347 @@
+import time
+import asyncio
+import threading
 from .llm_service import LLMService
-from .vector_store import VectorStore
+from .store_registry import get_collection_manager
+from .answer_cache import AnswerCache
+from .context_assembler import ContextAssembler, estimate_tokens, estimate_message_tokens
+from .query_batcher import QueryBatcher
+from .logger import get_logger
+from . import tracing
+from config import ANSWER_CACHE_ENABLED, DEFAULT_COLLECTION
+
+logger = get_logger(__name__)
+
+# 不同回答方式使用的系统提示词：(没有参考信息时, 有参考信息时)
+_SYSTEM_PROMPTS = {
+    "query": (
+        "你是尊敬的马斯陶哥哥为乐乐独家打造的大模型 lele1.0，作为一个RAG教学项目，用于乐乐学习之用。",
+        "你是尊敬的马斯陶哥哥为乐乐独家打造的大模型 lele1.0，作为一个RAG教学项目，用于乐乐学习之用。你将根据提供的参考信息回答问题。"
+    ),
+    "stream": (
+        "你是尊敬的马斯陶哥哥为乐乐独家打造的大模型 lele1.0，作为一个RAG教学项目，用于乐乐学习之用。你需要用温柔活泼的语气回答用户的问题。",
+        "你是尊敬的马斯陶哥哥为乐乐独家打造的大模型 lele1.0，作为一个RAG教学项目，用于乐乐学习之用。你需要用温柔活泼的语气回答用户的问题。你将根据提供的参考信息回答问题。"
+    )
+}
+
+
+def _record_llm(start, first_token_at, answer):
+    """记录大模型的首token时间（流式回答才有）、总耗时和输出速率（未开启追踪时不做任何事）"""
+    if not tracing.is_enabled():
+        return
+    end = time.perf_counter()
+    tracing.record_span("llm_total", start, end)
+    if first_token_at is not None:
+        tracing.record_span("llm_first_token", start, first_token_at)
+        if answer and end > first_token_at:
+            tracing.observe("llm_tokens_per_second", estimate_tokens(answer) / (end - first_token_at))
+
 
 class RAGEngine:
-    def __init__(self):
+    """检索增强问答
+
+    同步接口query/stream_query供界面线程使用；协程接口aquery/astream_query供HTTP服务使用，
+    检索（嵌入编码和FAISS检索）在传入的线程池中执行，大模型请求在事件循环中异步等待。
+    开启追踪时（见tracing），每次问答记录检索、组装提示词、首token时间、输出速率和总耗时。
+    各接口的collections参数指定检索的集合（见CollectionManager.resolve），默认只检索默认集合。
+    """
+    def __init__(self, vector_store=None, answer_cache=None, query_batching=False, context_assembler=None,
+                 collection_manager=None):
+        """
+        Args:
+            vector_store: 向量存储，默认使用进程内共享的实例；指定时只检索这一个向量存储，不支持按集合检索
+            collection_manager: 集合管理器，默认使用进程内共享的实例
+            answer_cache: 回答缓存，默认按配置创建
+            query_batching: 是否把并发的检索合并为微批（并发请求多的HTTP服务使用）
+            context_assembler: 把检索结果组装为参考信息，默认按配置的token预算创建
+        """
         self.llm_service = LLMService()
-        self.vector_store = VectorStore()
-        
-    def query(self, query_text):
-        """使用RAG回答问题，返回检索到的上下文和回答"""
-        # 从向量存储中检索相关上下文
-        contexts = self.vector_store.similarity_search(query_text)
-        
+        # 默认使用进程内共享的向量存储，界面导入的文档可以立即被检索到；
+        # 共享实例在首次检索时才获取，后台预热未完成时查询会等待而不是失败
+        self._vector_store = vector_store
+        self._collection_manager = collection_manager
+        # 相同问题、相同检索结果的回答直接从缓存返回，不再请求大模型
+        if answer_cache is None and ANSWER_CACHE_ENABLED:
+            answer_cache = AnswerCache()
+        self.answer_cache = answer_cache
+        # 合并相邻片段、去掉重合部分、每个来源一个标题，并控制在token预算内
+        self.context_assembler = context_assembler or ContextAssembler()
+        self.query_batching = query_batching
+        self._query_batcher = None
+        self._batcher_lock = threading.Lock()
+
+    @property
+    def vector_store(self):
+        if self._vector_store is None:
+            return self.collection_manager.get(DEFAULT_COLLECTION)
+        return self._vector_store
+
+    @property
+    def collection_manager(self):
+        if self._collection_manager is None:
+            self._collection_manager = get_collection_manager()
+        return self._collection_manager
+
+    @property
+    def retriever(self):
+        """检索使用的对象：单独指定了vector_store时就是它，否则是集合管理器（两者的检索接口相同）
+
+        回答缓存的知识库修订号也取自这里，同一个引擎始终使用同一个修订号来源。
+        """
+        if self._vector_store is not None and self._collection_manager is None:
+            return self._vector_store
+        return self.collection_manager
+
+    @property
+    def query_batcher(self):
+        with self._batcher_lock:
+            if self._query_batcher is None:
+                self._query_batcher = QueryBatcher(self.retriever)
+            return self._query_batcher
+
+    def _retrieve(self, query_text, collections=None):
+        """检索相关片段，返回VectorStore.search的结果（指定了collections时另带collection字段）"""
+        retriever = self.retriever
+        kwargs = {}
+        if collections:
+            if retriever is self._vector_store:
+                raise ValueError("该RAGEngine只使用指定的向量存储，不支持按集合检索")
+            kwargs["collections"] = collections
+        with tracing.span("retrieve"):
+            if self.query_batching:
+                return self.query_batcher.search(query_text, **kwargs)
+            return retriever.search(query_text, **kwargs)
+
+    def _cache_lookup(self, query_text, variant, chunk_ids):
+        """查找缓存的回答，返回(回答或None, 缓存键参数)"""
+        if self.answer_cache is None:
+            return None, None
+        retriever = self.retriever
+        with tracing.span("answer_cache"):
+            # 只有开启了近似重复匹配且检索到片段时才需要查询向量（查询和写入共用）；
+            # 走关键词快速路径的查询不计算查询向量，只做精确匹配
+            match_similar = (self.answer_cache.similarity is not None and chunk_ids
+                             and not retriever.lexical_fast_path(query_text))
+            cache_args = {
+                "query": query_text,
+                "variant": variant,
+                "chunk_ids": chunk_ids,
+                "kb_revision": retriever.revision,
+                "embedding": retriever.encode_query(query_text) if match_similar else None
+            }
+            answer = self.answer_cache.get(**cache_args)
+        if answer is not None:
+            logger.info("命中回答缓存，查询: '%s'", query_text)
+        return answer, cache_args
+
+    def _build_messages(self, query_text, contexts, variant):
+        """根据检索到的上下文构造发给大模型的消息"""
+        plain_prompt, context_prompt = _SYSTEM_PROMPTS[variant]
         if not contexts:
             # 如果没有相关上下文，直接使用LLM回答
-            messages = [
-                {"role": "system", "content": "你是尊敬的马斯陶哥哥为乐乐独家打造的大模型 lele1.0，作为一个RAG教学项目，用于乐乐学习之用。"},
+            return [
+                {"role": "system", "content": plain_prompt},
                 {"role": "user", "content": query_text}
             ]
-            response = self.llm_service.get_completion(messages)
-            
-            return {
-                "contexts": [],
-                "has_context": False,
-                "response": response
-            }
-        else:
-            # 将检索到的上下文整合到提示中
-            context_text = "\n\n".join(contexts)
-            prompt = f"""请基于以下参考信息回答用户的问题。如果参考信息中没有相关内容，请基于你自己的知识回答，并注明这部分是你的知识而非参考信息。
+
+        # 将检索到的上下文整合到提示中
+        context_text = "\n\n".join(contexts)
+        prompt = f"""请基于以下参考信息回答用户的问题。如果参考信息中没有相关内容，请基于你自己的知识回答，并注明这部分是你的知识而非参考信息。
 
 参考信息:
 {context_text}
 
 用户问题: {query_text}"""
-            
-            messages = [
-                {"role": "system", "content": "你是尊敬的马斯陶哥哥为乐乐独家打造的大模型 lele1.0，作为一个RAG教学项目，用于乐乐学习之用。你将根据提供的参考信息回答问题。"},
-                {"role": "user", "content": prompt}
-            ]
-            
+
+        return [
+            {"role": "system", "content": context_prompt},
+            {"role": "user", "content": prompt}
+        ]
+
+    def _prepare(self, query_text, variant, collections=None):
+        """检索、组装参考信息、查缓存并构造消息（阻塞，在调用线程或线程池中执行）"""
+        hits = self._retrieve(query_text, collections)
+        with tracing.span("context_assembly", hits=len(hits)):
+            assembled = self.context_assembler.assemble(hits)
+        contexts = assembled["contexts"]
+        cached_answer, cache_args = self._cache_lookup(query_text, variant, assembled["chunk_ids"])
+        messages, prompt_tokens = None, 0
+        if cached_answer is None:
+            with tracing.span("prompt_build"):
+                messages = self._build_messages(query_text, contexts, variant)
+                prompt_tokens = estimate_message_tokens(messages)
+            truncated = "，已按预算截断" if assembled["truncated"] else ""
+            logger.info(f"提示词约 {prompt_tokens} tokens（参考信息 {assembled['tokens']} tokens，"
+                        f"{len(contexts)} 个来源{truncated}）")
+        return {
+            "contexts": contexts,
+            "cached_answer": cached_answer,
+            "cache_args": cache_args,
+            "messages": messages,
+            "prompt_tokens": prompt_tokens
+        }
+
+    def _store_answer(self, cache_args, answer):
+        if cache_args is not None:
+            self.answer_cache.put(answer=answer, **cache_args)
+
+    def query(self, query_text, collections=None):
+        """使用RAG回答问题，返回检索到的上下文和回答"""
+        with tracing.trace("query") as trace:
+            prepared = self._prepare(query_text, "query", collections)
+            contexts = prepared["contexts"]
+            trace.set(contexts=len(contexts), cached=prepared["cached_answer"] is not None)
+            if prepared["cached_answer"] is not None:
+                return {
+                    "contexts": contexts,
+                    "has_context": bool(contexts),
+                    "response": {"success": True, "content": prepared["cached_answer"]},
+                    "cached": True
+                }
+
             # 调用LLM获取回答
-            response = self.llm_service.get_completion(messages)
-            
+            start = time.perf_counter()
+            response = self.llm_service.get_completion(prepared["messages"])
+            _record_llm(start, None, response.get("content"))
+            trace.set(prompt_tokens=prepared["prompt_tokens"], success=response["success"])
+            if response["success"]:
+                self._store_answer(prepared["cache_args"], response["content"])
+
             return {
                 "contexts": contexts,
-                "has_context": True,
-                "response": response
+                "has_context": bool(contexts),
+                "response": response,
+                "prompt_tokens": prepared["prompt_tokens"]
             }
-            
-    def stream_query(self, query_text, callback):
+
+    def stream_query(self, query_text, callback, cancel_token=None, collections=None):
         """使用RAG流式回答问题
-        
+
         Args:
             query_text: 用户查询文本
             callback: 每次收到流式内容时的回调函数，接收参数(content_delta, is_done)
-        
+            cancel_token: 可选的CancelToken，用于中途停止回答
+            collections: 检索的集合名称列表，["*"]表示全部集合，默认只检索默认集合
+
         Returns:
             dict: 包含上下文信息的字典
         """
-        # 从向量存储中检索相关上下文
-        contexts = self.vector_store.similarity_search(query_text)
-        
-        if not contexts:
-            # 如果没有相关上下文，直接使用LLM回答
-            messages = [
-                {"role": "system", "content": "你是尊敬的马斯陶哥哥为乐乐独家打造的大模型 lele1.0，作为一个RAG教学项目，用于乐乐学习之用。你需要用温柔活泼的语气回答用户的问题。"},
-                {"role": "user", "content": query_text}
-            ]
-            self.llm_service.get_streaming_completion(messages, callback)
-            
+        with tracing.trace("stream_query") as trace:
+            prepared = self._prepare(query_text, "stream", collections)
+            contexts = prepared["contexts"]
+            trace.set(contexts=len(contexts), cached=prepared["cached_answer"] is not None)
+            if prepared["cached_answer"] is not None:
+                # 缓存的回答同样通过流式回调输出，界面处理流程不变
+                callback(prepared["cached_answer"], False)
+                callback("", True)
+                return {
+                    "contexts": contexts,
+                    "has_context": bool(contexts),
+                    "cached": True
+                }
+
+            # 调用LLM获取流式回答，同时记录完整回答用于缓存
+            answer_parts = []
+            first_token_at = []
+
+            def recording_callback(content_delta, is_done):
+                if not is_done:
+                    if not answer_parts:
+                        first_token_at.append(time.perf_counter())
+                    answer_parts.append(content_delta)
+                callback(content_delta, is_done)
+
+            start = time.perf_counter()
+            success = self.llm_service.get_streaming_completion(prepared["messages"], recording_callback, cancel_token)
+            answer = "".join(answer_parts)
+            _record_llm(start, first_token_at[0] if first_token_at else None, answer)
+            trace.set(prompt_tokens=prepared["prompt_tokens"], success=success is not False, cancelled=success is None)
+            # 被停止的回答不完整，不缓存
+            if success is True:
+                self._store_answer(prepared["cache_args"], answer)
+
             return {
-                "contexts": [],
-                "has_context": False
+                "contexts": contexts,
+                "has_context": bool(contexts),
+                "cancelled": success is None,
+                "prompt_tokens": prepared["prompt_tokens"]
             }
-        else:
-            # 将检索到的上下文整合到提示中
-            context_text = "\n\n".join(contexts)
-            prompt = f"""请基于以下参考信息回答用户的问题。如果参考信息中没有相关内容，请基于你自己的知识回答，并注明这部分是你的知识而非参考信息。
 
-参考信息:
-{context_text}
+    async def aquery(self, query_text, executor=None, collections=None):
+        """query的协程版本，检索在executor（默认线程池）中执行"""
+        loop = asyncio.get_running_loop()
+        with tracing.trace("query") as trace:
+            prepared = await loop.run_in_executor(executor, tracing.bind(self._prepare), query_text, "query",
+                                                  collections)
+            contexts = prepared["contexts"]
+            trace.set(contexts=len(contexts), cached=prepared["cached_answer"] is not None)
+            if prepared["cached_answer"] is not None:
+                return {
+                    "contexts": contexts,
+                    "has_context": bool(contexts),
+                    "response": {"success": True, "content": prepared["cached_answer"]},
+                    "cached": True
+                }
 
-用户问题: {query_text}"""
-            
-            messages = [
-                {"role": "system", "content": "你是尊敬的马斯陶哥哥为乐乐独家打造的大模型 lele1.0，作为一个RAG教学项目，用于乐乐学习之用。你需要用温柔活泼的语气回答用户的问题。你将根据提供的参考信息回答问题。"},
-                {"role": "user", "content": prompt}
-            ]
-            
-            # 调用LLM获取流式回答
-            self.llm_service.get_streaming_completion(messages, callback)
-            
+            start = time.perf_counter()
+            response = await self.llm_service.acomplete(prepared["messages"])
+            _record_llm(start, None, response.get("content"))
+            trace.set(prompt_tokens=prepared["prompt_tokens"], success=response["success"])
+            if response["success"]:
+                await loop.run_in_executor(executor, self._store_answer, prepared["cache_args"], response["content"])
+            return {
+                "contexts": contexts,
+                "has_context": bool(contexts),
+                "response": response,
+                "prompt_tokens": prepared["prompt_tokens"]
+            }
+
+    async def astream_query(self, query_text, callback, executor=None, on_contexts=None, collections=None):
+        """stream_query的协程版本，取消协程即停止回答
+
+        Args:
+            query_text: 用户查询文本
+            callback: 每次收到流式内容时的回调函数，接收参数(content_delta, is_done)，在事件循环中调用
+            executor: 执行检索的线程池，默认使用事件循环的默认线程池
+            on_contexts: 检索完成、开始回答之前调用，接收参数(contexts)
+            collections: 检索的集合名称列表，["*"]表示全部集合，默认只检索默认集合
+        """
+        loop = asyncio.get_running_loop()
+        with tracing.trace("stream_query") as trace:
+            prepared = await loop.run_in_executor(executor, tracing.bind(self._prepare), query_text, "stream",
+                                                  collections)
+            contexts = prepared["contexts"]
+            trace.set(contexts=len(contexts), cached=prepared["cached_answer"] is not None)
+            if on_contexts:
+                on_contexts(contexts)
+            if prepared["cached_answer"] is not None:
+                callback(prepared["cached_answer"], False)
+                callback("", True)
+                return {
+                    "contexts": contexts,
+                    "has_context": bool(contexts),
+                    "cached": True
+                }
+
+            answer_parts = []
+            first_token_at = []
+
+            def recording_callback(content_delta, is_done):
+                if not is_done:
+                    if not answer_parts:
+                        first_token_at.append(time.perf_counter())
+                    answer_parts.append(content_delta)
+                callback(content_delta, is_done)
+
+            start = time.perf_counter()
+            success = await self.llm_service.astream(prepared["messages"], recording_callback)
+            answer = "".join(answer_parts)
+            _record_llm(start, first_token_at[0] if first_token_at else None, answer)
+            trace.set(prompt_tokens=prepared["prompt_tokens"], success=success)
+            if success is True:
+                await loop.run_in_executor(executor, self._store_answer, prepared["cache_args"], answer)
             return {
                 "contexts": contexts,
-                "has_context": True
-            }
\ No newline at end of file
+                "has_context": bool(contexts),
+                "prompt_tokens": prepared["prompt_tokens"]
+            }
@@ -0,0 +1,157 @@
+import os
+import time
+import threading
+from config import EMBEDDING_MODEL, EMBEDDING_BACKEND, MODEL_DIR, DEFAULT_COLLECTION
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+# 进程级共享的嵌入模型和向量存储，所有组件都从这里获取，避免重复加载
+_lock = threading.RLock()
+_embedding_model = None
+_collection_manager = None
+_vector_store = None
+
+# 后台预热状态
+_ready = threading.Event()
+_warm_up_thread = None
+_warm_up_error = None
+_ready_callbacks = []
+
+# 冷启动各阶段耗时（秒）
+startup_timings = {}
+
+
+def _load_embedding_model():
+    """按EMBEDDING_BACKEND加载嵌入模型（优先使用本地目录）"""
+    from .embedding_backends import load_embedding_model, onnx_model_file, validate_backend
+
+    # 设置环境变量，指定模型加载位置
+    os.environ['TRANSFORMERS_CACHE'] = MODEL_DIR
+    os.environ['HF_HOME'] = MODEL_DIR
+    os.environ['SENTENCE_TRANSFORMERS_HOME'] = MODEL_DIR
+
+    # 尝试从本地目录加载模型
+    model_path = os.path.join(MODEL_DIR, EMBEDDING_MODEL.replace('/', '_'))
+    backend = EMBEDDING_BACKEND
+    validate_backend(backend)
+    if backend != "torch" and not os.path.exists(onnx_model_file(model_path, backend)):
+        logger.warning("未找到导出的ONNX模型（请先运行 python download_models.py），嵌入后端改用torch")
+        backend = "torch"
+    if os.path.exists(model_path):
+        logger.info(f"从本地路径加载模型: {model_path}（后端: {backend}）")
+    else:
+        logger.info(f"从Hugging Face加载模型: {EMBEDDING_MODEL}")
+        model_path = EMBEDDING_MODEL
+    return load_embedding_model(backend, model_path, timings=startup_timings, model_name=EMBEDDING_MODEL)
+
+
+def get_embedding_model():
+    """获取进程内唯一的嵌入模型实例，首次调用时加载"""
+    global _embedding_model
+    with _lock:
+        if _embedding_model is None:
+            _embedding_model = _load_embedding_model()
+        return _embedding_model
+
+
+def get_collection_manager():
+    """获取进程内唯一的集合管理器，首次调用时加载默认集合的索引"""
+    global _collection_manager, _vector_store
+    with _lock:
+        if _collection_manager is None:
+            embedding_model = get_embedding_model()
+
+            start = time.perf_counter()
+            from .collection_manager import CollectionManager
+            startup_timings["import_faiss"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            manager = CollectionManager(embedding_model=embedding_model)
+            # 默认集合始终加载，不会被卸载
+            _vector_store = manager.get(DEFAULT_COLLECTION, create=True)
+            startup_timings["index_load"] = time.perf_counter() - start
+            _collection_manager = manager
+        return _collection_manager
+
+
+def get_vector_store():
+    """获取进程内唯一的向量存储实例（默认集合），首次调用时加载索引
+
+    预热尚未完成时会阻塞到加载完成，因此预热期间发出的查询会排队等待而不是失败。
+    """
+    with _lock:
+        if _vector_store is None:
+            get_collection_manager()
+        return _vector_store
+
+
+def is_ready():
+    """嵌入模型和索引是否已加载完成"""
+    return _ready.is_set()
+
+
+def wait_until_ready(timeout=None):
+    """等待预热完成，返回是否已就绪"""
+    return _ready.wait(timeout)
+
+
+def warm_up_error():
+    """预热失败时的异常，成功或未完成时为None"""
+    return _warm_up_error
+
+
+def on_ready(callback):
+    """注册预热完成后的回调函数（在预热线程中调用，接收参数error）；已完成时立即调用"""
+    with _lock:
+        if not _ready.is_set():
+            _ready_callbacks.append(callback)
+            return
+    callback(_warm_up_error)
+
+
+def start_warm_up():
+    """在后台线程中加载嵌入模型和索引，界面可以在此期间正常响应（重复调用无副作用）"""
+    global _warm_up_thread
+    with _lock:
+        if _warm_up_thread is not None or _ready.is_set():
+            return
+        _warm_up_thread = threading.Thread(target=_warm_up, name="warm-up", daemon=True)
+        _warm_up_thread.start()
+
+
+def _warm_up():
+    global _warm_up_error
+    start = time.perf_counter()
+    try:
+        get_vector_store()
+    except Exception as e:
+        logger.exception(f"加载嵌入模型或索引失败: {e}")
+        _warm_up_error = e
+    startup_timings["warm_up_total"] = time.perf_counter() - start
+
+    with _lock:
+        _ready.set()
+        callbacks = list(_ready_callbacks)
+        _ready_callbacks.clear()
+    for callback in callbacks:
+        try:
+            callback(_warm_up_error)
+        except Exception as e:
+            logger.exception(f"预热完成回调出错: {e}")
+
+
+def format_startup_report():
+    """把冷启动各阶段耗时整理为一行文本"""
+    labels = [
+        ("import_app", "导入界面"),
+        ("ui_ready", "窗口可用"),
+        ("import_sentence_transformers", "导入sentence_transformers"),
+        ("import_onnxruntime", "导入onnxruntime"),
+        ("model_load", "模型加载"),
+        ("import_faiss", "导入faiss"),
+        ("index_load", "索引加载"),
+        ("warm_up_total", "后台预热合计"),
+    ]
+    parts = [f"{label} {startup_timings[key]:.2f}s" for key, label in labels if key in startup_timings]
+    return "启动耗时: " + "，".join(parts)
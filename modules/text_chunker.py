@@ -0,0 +1,135 @@
+from collections import namedtuple
+from config import CHUNK_SIZE, CHUNK_OVERLAP
+
+# 一个文本片段：text == 原文[start:end]，start/end为字符偏移
+Chunk = namedtuple("Chunk", ["text", "start", "end"])
+
+# 切分点，按优先级从高到低：段落、换行、句末标点、分句标点、空白。(分隔符, 切分点在分隔符开头之后的字符数)
+_BOUNDARIES = (
+    (("\n\n", 2),),
+    (("\n", 1),),
+    (("。", 1), ("！", 1), ("？", 1), ("；", 1), ("…", 1), ("!", 1), ("?", 1), (";", 1), (". ", 1)),
+    (("，", 1), ("、", 1), ("：", 1), (", ", 1), (": ", 1)),
+    ((" ", 1), ("\t", 1)),
+)
+# 句末标点之后紧跟的右引号、右括号归入前一句
+_CLOSERS = "”’\"'」』）)》】"
+# 输入为多段文本时，缓冲区中已处理的部分超过这个长度才丢弃，避免频繁复制
+_COMPACT_SIZE = 1 << 20
+
+
+def _find_break(text, start, limit, min_end):
+    """在(min_end, limit]中找优先级最高的切分点，同一优先级取最靠后的；找不到返回None"""
+    for level, boundaries in enumerate(_BOUNDARIES):
+        best = -1
+        for separator, offset in boundaries:
+            # 切分点index+offset不能超过limit
+            index = text.rfind(separator, start, limit - offset + len(separator))
+            if index >= 0 and index + offset > min_end:
+                best = max(best, index + offset)
+        if best >= 0:
+            # 句末和分句标点之后的右引号、右括号不与前一句分开
+            if level in (2, 3):
+                while best < limit and text[best] in _CLOSERS:
+                    best += 1
+            return best
+    return None
+
+
+def _overlap_start(text, end, chunk_overlap, floor):
+    """下一个片段的起点：在end之前chunk_overlap个字符内，尽量从一句（或一个分句、一个词）的开头开始"""
+    low = max(end - chunk_overlap, floor)
+    if low >= end:
+        return end
+    for level, boundaries in enumerate(_BOUNDARIES):
+        best = end
+        for separator, offset in boundaries:
+            index = text.find(separator, low, end)
+            if index >= 0 and index + offset < best:
+                best = index + offset
+        if level in (2, 3):
+            while best < end and text[best] in _CLOSERS:
+                best += 1
+        if best < end:
+            return best
+    return low
+
+
+def _skip_space(text, position, end):
+    while position < end and text[position].isspace():
+        position += 1
+    return position
+
+
+def _trim_end(text, start, end):
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return end
+
+
+def iter_chunks(source, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """把文本切分为不超过chunk_size个字符的片段，逐个产出Chunk
+
+    只顺序扫描一遍：每个片段在chunk_size范围内选优先级最高、最靠后的切分点（段落 > 换行 > 句末标点 > 分句标点 > 空白，
+    中文的。！？；与英文的.!?;都视为句末），没有切分点时按字符数截断；相邻片段重合不超过chunk_overlap个字符，
+    重合部分尽量从一句的开头开始，前一片段的结尾与后一片段的开头完全相同。片段首尾的空白不计入片段。
+
+    Args:
+        source: 字符串，或按顺序产出字符串的可迭代对象（如逐页的PDF文本、分块读取的大文件），不需要整体读入内存
+        chunk_size: 片段的最大字符数
+        chunk_overlap: 相邻片段的最大重合字符数，必须小于chunk_size
+    """
+    if chunk_size <= 0 or not 0 <= chunk_overlap < chunk_size:
+        raise ValueError(f"chunk_overlap必须小于chunk_size: {chunk_overlap} >= {chunk_size}")
+    if isinstance(source, str):
+        pieces, text, exhausted = iter(()), source, True
+    else:
+        pieces, text, exhausted = iter(source), "", False
+    base = 0  # text[0]在全文中的偏移
+    position = 0  # 下一个片段在text中的起点
+    min_length = max(chunk_size // 2, chunk_overlap + 1)
+
+    while True:
+        # 至少要看到chunk_size + 1个字符（或全文结尾）才能决定切分点
+        while not exhausted and len(text) - position <= chunk_size:
+            piece = next(pieces, None)
+            if piece is None:
+                exhausted = True
+            elif piece:
+                if position >= _COMPACT_SIZE:
+                    base += position
+                    text, position = text[position:], 0
+                text += piece
+        position = _skip_space(text, position, len(text))
+        if not exhausted and len(text) - position <= chunk_size:
+            # 跳过空白后剩余的字符不够，继续读入
+            continue
+        if position >= len(text):
+            return
+
+        limit = position + chunk_size
+        if limit >= len(text):
+            # 剩余部分放得下，作为最后一个片段
+            end = _trim_end(text, position, len(text))
+            yield Chunk(text[position:end], base + position, base + end)
+            return
+
+        # 优先在片段的后半部分切分，避免产生很短的片段；后半部分没有切分点时再看整个范围
+        cut = _find_break(text, position, limit, position + min_length - 1)
+        if cut is None:
+            cut = _find_break(text, position, limit, position)
+        if cut is None:
+            cut = limit
+        end = _trim_end(text, position, cut)
+        yield Chunk(text[position:end], base + position, base + end)
+
+        # 在前半部分切分的短片段不再与下一片段重合，否则下一片段几乎重复它的内容
+        if chunk_overlap and end - position >= min_length:
+            position = _overlap_start(text, end, chunk_overlap, position + 1)
+        else:
+            position = cut
+
+
+def split_text(source, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """切分文本，返回片段文本的列表（见iter_chunks）"""
+    return [chunk.text for chunk in iter_chunks(source, chunk_size, chunk_overlap)]
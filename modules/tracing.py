@@ -0,0 +1,301 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from config import TRACING_ENABLED, TRACE_FILE, TRACE_LATENCY_BUCKETS
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+# 一次问答用trace()包围，其中的各阶段用span()包围：
+#     with tracing.trace("query") as trace:
+#         with tracing.span("encode"):
+#             ...
+#         trace.set(prompt_tokens=1200)
+# 阶段耗时计入直方图rag_stage_seconds{stage=...}，并挂到当前线程（或协程）正在进行的问答上，问答结束时写一行JSONL；
+# 交给线程池执行的函数用bind()包装后才能看到调用方的问答。关闭追踪时span()和trace()返回同一个空对象，不读时钟、不加锁。
+
+# 输出速率直方图的分桶（token/秒）
+_RATE_BUCKETS = (5, 10, 20, 50, 100, 200, 500, 1000)
+
+_enabled = TRACING_ENABLED
+_trace_file = TRACE_FILE
+_current = contextvars.ContextVar("rag_trace", default=None)
+
+_metrics_lock = threading.Lock()
+_histograms = {}  # (指标名, 标签) -> [各分桶计数, 总和, 次数]
+_bucket_bounds = {}  # 指标名 -> 分桶上界
+_counters = {}  # (指标名, 标签) -> 计数
+_file_lock = threading.Lock()
+_file = None
+
+
+def is_enabled():
+    return _enabled
+
+
+def configure(enabled=None, trace_file=None):
+    """运行时开启或关闭追踪、更换JSONL文件（trace_file为""时不写文件）"""
+    global _enabled, _trace_file, _file
+    with _file_lock:
+        if trace_file is not None and trace_file != _trace_file:
+            if _file is not None:
+                _file.close()
+                _file = None
+            _trace_file = trace_file or None
+        if enabled is not None:
+            _enabled = enabled
+
+
+class _NoopSpan:
+    """关闭追踪时span()和trace()返回的空对象"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class Span:
+    """一个阶段：进入时记下开始时间，退出时计入直方图并挂到所属的问答上"""
+    __slots__ = ("name", "attrs", "trace", "start")
+
+    def __init__(self, name, attrs, trace):
+        self.name = name
+        self.attrs = attrs
+        self.trace = trace
+        self.start = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        _finish_span(self.name, self.start, time.perf_counter(), self.attrs, self.trace)
+        return False
+
+
+class Trace:
+    """一次问答：收集各阶段的耗时，结束时写一行JSONL，并计入rag_request_seconds和rag_requests_total"""
+    def __init__(self, name, attrs):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.spans = []
+        self.start = None
+        self._wall_start = None
+        self._token = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, name, start, end, attrs):
+        """加入一个已结束的阶段（可能来自其他线程，list.append是原子的）"""
+        self.spans.append({"name": name, "offset_ms": round((start - self.start) * 1000, 3),
+                           "duration_ms": round((end - start) * 1000, 3), **attrs})
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self._wall_start = time.time()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        status = "error" if "error" in self.attrs or self.attrs.get("success") is False else "ok"
+        observe("request_seconds", duration, TRACE_LATENCY_BUCKETS, operation=self.name)
+        _increment("rag_requests_total", operation=self.name, status=status)
+        record = {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "start": round(self._wall_start, 3),
+            "duration_ms": round(duration * 1000, 3),
+            "status": status,
+            **self.attrs,
+            "spans": sorted(self.spans, key=lambda span: span["offset_ms"])
+        }
+        logger.debug(f"{self.name} 耗时 {record['duration_ms']:.1f} ms: " + "，".join(
+            f"{span['name']} {span['duration_ms']:.1f} ms" for span in record["spans"]),
+            extra={"fields": {"trace_id": self.trace_id}})
+        _write_record(record)
+        return False
+
+
+class _TraceGroup:
+    """多个问答共享的一次操作（如合并为微批的检索），其中的阶段同时挂到每个问答上"""
+    __slots__ = ("traces",)
+
+    def __init__(self, traces):
+        self.traces = traces
+
+    def add(self, name, start, end, attrs):
+        for trace in self.traces:
+            trace.add(name, start, end, dict(attrs, shared=len(self.traces)))
+
+
+class _Attach:
+    __slots__ = ("target", "token")
+
+    def __init__(self, target):
+        self.target = target
+        self.token = None
+
+    def __enter__(self):
+        self.token = _current.set(self.target)
+        return self.target
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self.token)
+        return False
+
+
+def trace(name, **attrs):
+    """开始一次问答的追踪，返回上下文管理器"""
+    if not _enabled:
+        return _NOOP
+    return Trace(name, attrs)
+
+
+def span(name, **attrs):
+    """追踪一个阶段，返回上下文管理器（可调用set()补充属性）"""
+    if not _enabled:
+        return _NOOP
+    return Span(name, attrs, _current.get())
+
+
+def record_span(name, start, end, **attrs):
+    """记录一个在别处计时的阶段（start、end为time.perf_counter()的值），如首token时间"""
+    if _enabled:
+        _finish_span(name, start, end, attrs, _current.get())
+
+
+def current_trace():
+    """当前正在进行的问答，没有或未开启追踪时为None（把问答交给其他线程时使用）"""
+    return _current.get() if _enabled else None
+
+
+def attach(traces):
+    """在其他线程中执行属于这些问答的操作，期间的阶段挂到每个问答上"""
+    traces = [trace for trace in traces if trace is not None]
+    if not traces:
+        return _NOOP
+    return _Attach(traces[0] if len(traces) == 1 else _TraceGroup(traces))
+
+
+def bind(fn):
+    """包装要交给线程池执行的函数，使其在调用方的追踪上下文中运行（未开启追踪时原样返回）"""
+    if not _enabled:
+        return fn
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+def observe(name, value, buckets=_RATE_BUCKETS, **labels):
+    """把一个数值计入直方图rag_{name}，同时记为当前问答的属性"""
+    if not _enabled:
+        return
+    metric = f"rag_{name}"
+    key = (metric, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        bounds = _bucket_bounds.setdefault(metric, tuple(buckets))
+        entry = _histograms.get(key)
+        if entry is None:
+            entry = _histograms[key] = [[0] * len(bounds), 0.0, 0]
+        for i, bound in enumerate(bounds):
+            if value <= bound:
+                entry[0][i] += 1
+                break
+        entry[1] += value
+        entry[2] += 1
+    trace = _current.get()
+    if isinstance(trace, Trace) and not labels:
+        trace.attrs[name] = round(value, 3)
+
+
+def _increment(metric, **labels):
+    key = (metric, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        _counters[key] = _counters.get(key, 0) + 1
+
+
+def _finish_span(name, start, end, attrs, trace):
+    observe("stage_seconds", end - start, TRACE_LATENCY_BUCKETS, stage=name)
+    if trace is not None:
+        trace.add(name, start, end, attrs)
+
+
+def _write_record(record):
+    """把一次问答的追踪记录追加到JSONL文件"""
+    global _file
+    if not _trace_file:
+        return
+    line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+    with _file_lock:
+        try:
+            if _file is None:
+                os.makedirs(os.path.dirname(os.path.abspath(_trace_file)), exist_ok=True)
+                _file = open(_trace_file, 'a', encoding='utf-8')
+            _file.write(line)
+            _file.flush()
+        except OSError as e:
+            logger.warning(f"写入追踪记录失败: {e}")
+
+
+def _labels_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def render_prometheus():
+    """把累计的指标输出为Prometheus文本格式"""
+    with _metrics_lock:
+        histograms = {key: (list(entry[0]), entry[1], entry[2]) for key, entry in _histograms.items()}
+        counters = dict(_counters)
+        bounds = dict(_bucket_bounds)
+    lines = []
+    for metric in sorted({metric for metric, _ in histograms}):
+        lines.append(f"# TYPE {metric} histogram")
+        for (name, labels), (counts, total, count) in sorted(histograms.items()):
+            if name != metric:
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip(bounds[metric], counts):
+                cumulative += bucket_count
+                lines.append(f"{metric}_bucket{_labels_text(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{metric}_bucket{_labels_text(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{metric}_sum{_labels_text(labels)} {total:.6f}")
+            lines.append(f"{metric}_count{_labels_text(labels)} {count}")
+    for metric in sorted({metric for metric, _ in counters}):
+        lines.append(f"# TYPE {metric} counter")
+        for (name, labels), value in sorted(counters.items()):
+            if name == metric:
+                lines.append(f"{metric}{_labels_text(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def reset_metrics():
+    """清空累计的指标"""
+    with _metrics_lock:
+        _histograms.clear()
+        _counters.clear()
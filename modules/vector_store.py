@@ -1,157 +1,982 @@
 import os
+import time
+import logging
 import pickle
+import threading
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import faiss
-from config import EMBEDDING_MODEL, VECTOR_STORE_DIR, TOP_K_RETRIEVAL, MODEL_DIR, IN_PACKAGED_ENV
+from config import (VECTOR_STORE_DIR, TOP_K_RETRIEVAL, EMBEDDING_BATCH_SIZE,
+                    COMPACT_MIN_PENDING, COMPACT_RATIO, INDEX_TYPE, AUTO_INDEX_TYPE,
+                    INDEX_PROMOTION_THRESHOLD, QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_TTL,
+                    SEARCH_RESULT_CACHE_SIZE, SEARCH_RESULT_CACHE_TTL, HYBRID_SEARCH_ENABLED,
+                    LEXICAL_CANDIDATES, LEXICAL_MIN_COVERAGE, RRF_K, LEXICAL_FAST_PATH,
+                    VECTOR_COMPRESSION, VECTOR_RERANK, RERANK_FACTOR)
+from .index_factory import (build_index, needs_training, index_type_of, configure_search,
+                            train_index, add_in_blocks, add_rows, with_ids, supports_removal,
+                            compression_of, exact_rerank)
+from .chunk_store import ChunkStore, format_chunk
+from .lexical_index import LexicalIndex, looks_like_identifier
+from .lru_cache import LRUCache
+from .embedding_backends import embedding_info
+from .logger import get_logger
+from . import tracing
+from .atomic_io import atomic_write, atomic_write_bytes, atomic_write_json, read_json, fsync_file, remove_quietly
+
+logger = get_logger(__name__)
+
+# 磁盘格式版本：1为整体重写的faiss_index.bin + texts.pkl，2为文本日志，3为列式片段存储
+STORE_FORMAT = 3
+# 后台补建关键词索引时每次读取的片段数
+LEXICAL_CATCH_UP_BLOCK = 10000
+
 
 class VectorStore:
-    def __init__(self):
-        # 设置环境变量，指定模型加载位置
-        os.environ['TRANSFORMERS_CACHE'] = MODEL_DIR
-        os.environ['HF_HOME'] = MODEL_DIR
-        os.environ['SENTENCE_TRANSFORMERS_HOME'] = MODEL_DIR
-        
-        # 尝试从本地目录加载模型
-        model_path = os.path.join(MODEL_DIR, EMBEDDING_MODEL.replace('/', '_'))
-        if os.path.exists(model_path):
-            print(f"从本地路径加载模型: {model_path}")
-            self.embedding_model = SentenceTransformer(model_path)
-        else:
-            print(f"从Hugging Face加载模型: {EMBEDDING_MODEL}")
-            self.embedding_model = SentenceTransformer(EMBEDDING_MODEL)
-        
-        self.index_file = os.path.join(VECTOR_STORE_DIR, "faiss_index.bin")
-        self.texts_file = os.path.join(VECTOR_STORE_DIR, "texts.pkl")
+    """FAISS向量存储
+
+    磁盘格式为追加写：
+    - vectors.f32: 全部向量（float32，按行追加，永不重写），行号即片段ID
+    - chunks.*: 列式片段存储（见ChunkStore），文本和元数据分列存放、内存映射读取
+    - faiss_index.{gen}.bin: 后台压缩生成的索引快照
+    - lexical_index.{gen}.npz: 同时生成的关键词倒排索引快照（见LexicalIndex）
+    - manifest.json: 已提交的数据量和当前快照文件，原子替换，是唯一的提交点
+
+    每次导入只追加新的向量和片段，然后原子更新manifest；崩溃后按manifest截断未提交的尾部。
+    索引中的向量ID即片段ID；删除文档时支持按ID删除的索引（flat、IVF）直接删除其向量，
+    HNSW不支持删除，已删除文档的向量在检索时按墓碑过滤。
+    """
+    def __init__(self, embedding_model=None, store_dir=None):
+        # 嵌入模型由进程级注册表统一提供，避免每个实例各自加载一份
+        if embedding_model is None:
+            from .store_registry import get_embedding_model
+            embedding_model = get_embedding_model()
+        self.embedding_model = embedding_model
+
+        # 同一个实例会被界面线程、导入线程和查询线程共享
+        self._lock = threading.RLock()
+
+        self.store_dir = store_dir or VECTOR_STORE_DIR
+        os.makedirs(self.store_dir, exist_ok=True)
+        self.manifest_file = os.path.join(self.store_dir, "manifest.json")
+        self.vectors_file = os.path.join(self.store_dir, "vectors.f32")
+        # 旧版本的整体存储文件，加载时自动迁移
+        self.legacy_index_file = os.path.join(self.store_dir, "faiss_index.bin")
+        self.legacy_texts_file = os.path.join(self.store_dir, "texts.pkl")
+
         self.index = None
-        self.texts = []
+        self.chunks = ChunkStore(self.store_dir)
+        # 关键词倒排索引，与向量检索的结果融合
+        self.lexical = LexicalIndex()
+        self._lexical_catching_up = False
+        self.manifest = None
+        self._compacting = False
+        self._promoting = False
+        self._index_replaced = False  # 索引被整体替换后，需要尽快写入新快照
+        self._clear_epoch = 0
+
+        # 索引版本号：每次导入、清空或替换索引都会递增，检索结果缓存以它为失效依据
+        self.version = 0
+
+        # 已删除的文档ID和已删除的来源ID（墓碑，持久化在manifest中）
+        self._deleted_docs = set()
+        self._retired_sources = set()
+        self._query_cache = LRUCache(QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_TTL)
+        self._result_cache = LRUCache(SEARCH_RESULT_CACHE_SIZE, SEARCH_RESULT_CACHE_TTL)
+
         self._load_or_create_index()
-    
+
+    def _path(self, name):
+        return os.path.join(self.store_dir, name) if name else None
+
+    def _dimension(self):
+        return self.embedding_model.get_sentence_embedding_dimension()
+
+    def _target_index_type(self):
+        """配置要求的索引类型（auto模式下为升级目标）"""
+        return AUTO_INDEX_TYPE if INDEX_TYPE == "auto" else INDEX_TYPE
+
+    @staticmethod
+    def _describe(index_type, compression):
+        return index_type if compression == "none" else f"{index_type}+{compression}"
+
+    def _new_index(self, dimension):
+        """创建空索引：不需要训练的类型直接创建，需要训练的类型先用flat，数据足够后再升级
+
+        fp16压缩不需要训练，起步的flat索引就使用；int8和pq要等数据足够训练后随升级一起生效。
+        """
+        index_type = self._target_index_type()
+        compression = VECTOR_COMPRESSION
+        if INDEX_TYPE == "auto" or needs_training(index_type, compression):
+            index_type = "flat"
+            compression = "fp16" if compression == "fp16" else "none"
+        return configure_search(with_ids(build_index(index_type, dimension, compression=compression)))
+
+    def _vectors(self, ntotal):
+        """以内存映射方式读取已提交的全部向量"""
+        return np.memmap(self.vectors_file, dtype=np.float32, mode='r', shape=(ntotal, self.manifest["dim"]))
+
+    def _new_manifest(self, dimension, generation=0):
+        return {
+            "format": STORE_FORMAT,
+            "dim": dimension,
+            "embedding": embedding_info(self.embedding_model),  # 生成向量的嵌入后端和模型
+            "generation": generation,
+            "revision": 0,          # 知识库内容的修订号，每次导入或清空递增（持久化）
+            "ntotal": 0,            # 已提交的向量数（vectors.f32中的行数）
+            "index_file": None,     # 索引快照文件
+            "index_ntotal": 0,      # 索引快照覆盖的向量行数（其中已删除的向量可能已从快照中删除）
+            "index_vectors": 0,     # 索引快照中实际的向量数
+            "lexical_file": None,   # 关键词索引快照文件
+            "lexical_ntotal": 0,    # 关键词索引快照包含的片段数
+            "chunks": ChunkStore.empty_state(),  # 片段存储已提交的数据量
+            "deleted_docs": [],     # 已删除的文档ID
+            "retired_sources": []   # 已删除的来源ID（重新导入时恢复）
+        }
+
     def _load_or_create_index(self):
         """加载或创建FAISS索引"""
         try:
-            if os.path.exists(self.index_file) and os.path.exists(self.texts_file):
-                self.index = faiss.read_index(self.index_file)
-                with open(self.texts_file, 'rb') as f:
-                    self.texts = pickle.load(f)
+            manifest = read_json(self.manifest_file)
+            if manifest is not None and manifest["format"] == STORE_FORMAT:
+                self._load_from_manifest(manifest)
+            elif manifest is not None:
+                self._migrate_text_log(manifest)
+            elif os.path.exists(self.legacy_index_file) and os.path.exists(self.legacy_texts_file):
+                self._migrate_legacy_store()
             else:
-                # 创建一个空的索引，使用内积计算相似度（适用于余弦相似度）
-                dimension = self.embedding_model.get_sentence_embedding_dimension()
-                self.index = faiss.IndexFlatIP(dimension)  # 使用内积而不是L2距离
-                self.texts = []
-                
-                # 如果是打包环境，立即保存空索引，确保文件存在
-                if IN_PACKAGED_ENV:
-                    self._save_index()  # 修正：使用_save_index而不是save
+                self._create_empty_store()
+        except Exception as e:
+            logger.error(f"加载索引时出错: {e}")
+            self._create_empty_store()
+        self._start_lexical_catch_up()
+
+    def _create_empty_store(self, generation=0, revision=0):
+        """创建空索引并立即提交manifest，确保磁盘上的存储完整可用"""
+        # 创建一个空的索引，使用内积计算相似度（适用于余弦相似度）
+        dimension = self._dimension()
+        self.index = self._new_index(dimension)
+        self.manifest = self._new_manifest(dimension, generation)
+        self.manifest["revision"] = revision
+        self.lexical = LexicalIndex()
+        self._deleted_docs = set()
+        self._retired_sources = set()
+
+        # 先提交空的manifest，再截断旧数据，崩溃时加载结果也是空存储
+        atomic_write_json(self.manifest_file, self.manifest)
+        with open(self.vectors_file, 'wb'):
+            pass
+        self.chunks.clear()
+
+    def _load_from_manifest(self, manifest):
+        """按manifest加载：索引快照 + 之后追加的向量；片段存储只做内存映射，不读入内存"""
+        dimension = manifest["dim"]
+        ntotal = manifest["ntotal"]
+        row_bytes = dimension * 4
+
+        # 丢弃崩溃时写了一半、未提交的向量
+        vectors_bytes = os.path.getsize(self.vectors_file) if os.path.exists(self.vectors_file) else 0
+        if vectors_bytes < ntotal * row_bytes:
+            raise ValueError(f"向量文件不完整: {vectors_bytes} < {ntotal * row_bytes} 字节")
+        if vectors_bytes > ntotal * row_bytes:
+            logger.warning(f"丢弃未提交的向量数据: {vectors_bytes - ntotal * row_bytes} 字节")
+            os.truncate(self.vectors_file, ntotal * row_bytes)
+
+        self._check_embedding(manifest)
+        self.chunks.open(manifest["chunks"])
+        self._deleted_docs = set(manifest.get("deleted_docs", []))
+        self._retired_sources = set(manifest.get("retired_sources", []))
+        if len(self.chunks) != ntotal:
+            raise ValueError(f"片段数量({len(self.chunks)})与向量数量({ntotal})不一致")
+
+        # 索引：读取快照，补上快照之后追加的向量
+        index_ntotal = manifest["index_ntotal"]
+        index_path = self._path(manifest["index_file"])
+        self.manifest = manifest
+        if index_path and os.path.exists(index_path):
+            index = faiss.read_index(index_path)
+        else:
+            index = self._new_index(dimension)
+            index_ntotal = 0
+        if index.ntotal != manifest.get("index_vectors", index_ntotal):
+            logger.warning(f"索引快照与manifest不一致，从向量文件重建索引")
+            index = self._new_index(dimension)
+            index_ntotal = 0
+        elif index_type_of(index) == "flat" and not supports_removal(index):
+            # 旧版本的flat快照没有ID映射，重建一次（只复制向量，不需要重新编码）
+            index = self._new_index(dimension)
+            index_ntotal = 0
+        if ntotal > index_ntotal:
+            add_in_blocks(index, self._vectors(ntotal), index_ntotal, ntotal)
+        # 快照之后删除的文档，向量可能还在快照中
+        self._remove_deleted_vectors(index)
+
+        self.index = configure_search(index)
+        logger.info(f"索引类型: {self._describe(index_type_of(index), compression_of(index))}，共 {index.ntotal} 个向量")
+        # 关键词索引：读取快照，快照之后的片段在后台补上（见_catch_up_lexical）
+        self.lexical = self._load_lexical(manifest)
+        self._maybe_promote()
+
+    def _check_embedding(self, manifest):
+        """检查已有向量与当前嵌入模型是否来自同一个后端和模型
+
+        不同后端（如torch与onnx_int8）的向量只是近似相同，混在一起会降低检索质量；
+        不一致时只警告（拒绝加载会丢失数据），由用户决定是否清空知识库后重新导入。
+        """
+        current = embedding_info(self.embedding_model)
+        stored = manifest.get("embedding")
+        if current is None:
+            return
+        if stored is None:
+            # 旧版本的存储没有记录，按当前模型补上（下次提交时写入）
+            manifest["embedding"] = current
+        elif stored != current:
+            logger.warning(f"向量存储 {self.store_dir} 中的向量由 {stored['model']}（{stored['backend']}后端）生成，"
+                           f"当前嵌入模型为 {current['model']}（{current['backend']}后端）；新旧向量混用会降低检索质量，"
+                           f"建议清空知识库后重新导入，或改回原来的EMBEDDING_BACKEND/EMBEDDING_MODEL")
+
+    def _load_lexical(self, manifest):
+        """加载关键词索引快照，没有可用的快照时返回空索引"""
+        path = self._path(manifest.get("lexical_file"))
+        if HYBRID_SEARCH_ENABLED and path and os.path.exists(path):
+            try:
+                lexical = LexicalIndex.load(path)
+                if lexical is not None and lexical.ntotal == manifest["lexical_ntotal"] <= len(self.chunks):
+                    return lexical
+            except Exception as e:
+                logger.warning(f"加载关键词索引快照时出错: {e}")
+            logger.info("关键词索引快照不可用，将在后台重建")
+        return LexicalIndex()
+
+    def _start_lexical_catch_up(self):
+        """关键词索引落后于片段存储时（快照之后的片段或旧版本存储），在后台补建"""
+        with self._lock:
+            if (not HYBRID_SEARCH_ENABLED or self._lexical_catching_up
+                    or self.lexical.ntotal >= len(self.chunks)):
+                return
+            self._lexical_catching_up = True
+        threading.Thread(target=self._catch_up_lexical, daemon=True).start()
+
+    def _catch_up_lexical(self):
+        """从片段存储逐块读取文本加入关键词索引，期间关键词检索只覆盖已加入的片段"""
+        try:
+            start_time = time.perf_counter()
+            with self._lock:
+                lexical = self.lexical
+                first = lexical.ntotal
+            logger.info(f"后台建立关键词索引，从第 {first} 个片段开始，共 {len(self.chunks)} 个片段")
+            while True:
+                # 读取文本和加入索引在锁内进行，耗时的切分在锁外进行
+                with self._lock:
+                    if self.lexical is not lexical:
+                        # 期间存储被清空
+                        return
+                    start = lexical.ntotal
+                    end = min(len(self.chunks), start + LEXICAL_CATCH_UP_BLOCK)
+                    if start >= end:
+                        self._bump_version()
+                        break
+                    texts = [self.chunks.get_text(i) for i in range(start, end)]
+                analyzed = lexical.analyze(texts)
+                with self._lock:
+                    # 导入只在关键词索引追平时才直接加入，所以这里的起点不会被占用
+                    if self.lexical is lexical:
+                        lexical.add(start, analyzed)
+            logger.info(f"关键词索引建立完成，加入 {lexical.ntotal - first} 个片段，"
+                        f"耗时 {time.perf_counter() - start_time:.1f} 秒")
         except Exception as e:
-            print(f"加载索引时出错: {e}")
-            # 创建一个空的索引
-            dimension = self.embedding_model.get_sentence_embedding_dimension()
-            self.index = faiss.IndexFlatIP(dimension)
-            self.texts = []
-            
-            # 保存空索引
-            self._save_index()  # 修正：使用_save_index而不是save
-    
-    def add_texts(self, texts, source_name):
-        """添加文本到向量存储"""
+            logger.exception(f"建立关键词索引时出错: {e}")
+        finally:
+            with self._lock:
+                self._lexical_catching_up = False
+        self._maybe_compact()
+
+    def _import_texts(self, texts, manifest):
+        """把带"来源:"标题的旧格式文本写入片段存储（仅迁移时解析一次标题）"""
+        self.chunks.clear()
+        run_source, run = None, []
+
+        def flush_run():
+            # 连续同来源的片段视为同一个文档，整段一次写入
+            if run:
+                source_id = self.chunks.source_id(run_source)
+                self.chunks.append(run, source_id, self.chunks.new_doc_id(source_id), 0)
+
+        for text in texts:
+            source, body = "未知", text
+            if text.startswith("来源: ") and "\n\n" in text:
+                header, body = text.split("\n\n", 1)
+                source = header[len("来源: "):]
+            if source != run_source:
+                flush_run()
+                run_source, run = source, []
+            run.append(body)
+        flush_run()
+
+        manifest["chunks"] = self.chunks.state()
+        manifest["format"] = STORE_FORMAT
+        atomic_write_json(self.manifest_file, manifest)
+
+    def _migrate_text_log(self, manifest):
+        """把第2版格式（文本快照 + 文本日志）迁移为列式片段存储"""
+        logger.info("检测到旧版本文本日志，正在迁移为列式片段存储...")
+        texts = []
+        texts_path = self._path(manifest.get("texts_file"))
+        if texts_path and os.path.exists(texts_path):
+            with open(texts_path, 'rb') as f:
+                texts = pickle.load(f)[:manifest["texts_snapshot"]]
+        log_path = self._path(manifest["log_file"])
+        if os.path.exists(log_path):
+            with open(log_path, 'rb') as f:
+                while f.tell() < manifest["log_bytes"]:
+                    texts.extend(pickle.load(f))
+
+        new_manifest = self._new_manifest(manifest["dim"], manifest["generation"])
+        new_manifest.update({
+            "ntotal": manifest["ntotal"],
+            "index_file": manifest["index_file"],
+            "index_ntotal": manifest["index_ntotal"]
+        })
+        self._import_texts(texts[:manifest["ntotal"]], new_manifest)
+        for name in (manifest.get("texts_file"), manifest["log_file"]):
+            if name:
+                remove_quietly(self._path(name))
+        self._load_from_manifest(new_manifest)
+        logger.info(f"迁移完成，共 {len(self.chunks)} 个片段")
+
+    def _migrate_legacy_store(self):
+        """把旧版本的faiss_index.bin + texts.pkl迁移为追加写格式"""
+        logger.info("检测到旧版本向量存储，正在迁移为追加写格式...")
+        index = faiss.read_index(self.legacy_index_file)
+        with open(self.legacy_texts_file, 'rb') as f:
+            texts = pickle.load(f)
+
+        vectors = np.ascontiguousarray(index.reconstruct_n(0, index.ntotal), dtype=np.float32)
+        atomic_write_bytes(self.vectors_file, vectors.tobytes())
+
+        manifest = self._new_manifest(index.d)
+        manifest.update({
+            "ntotal": index.ntotal,
+            "index_file": os.path.basename(self.legacy_index_file),
+            "index_ntotal": index.ntotal
+        })
+        self._import_texts(texts[:index.ntotal], manifest)
+        remove_quietly(self.legacy_texts_file)
+
+        # 旧版本的索引没有ID映射，按向量重建
+        self.index = add_in_blocks(self._new_index(index.d), vectors)
+        self.manifest = manifest
+        logger.info(f"迁移完成，共 {index.ntotal} 个向量")
+
+    def add_texts(self, texts, source_name, batch_size=EMBEDDING_BATCH_SIZE, progress_callback=None):
+        """分批添加文本到向量存储
+
+        每批文本编码后立即写入索引并追加到磁盘，峰值内存只取决于批大小而不是文档大小。
+
+        Args:
+            texts: 文本片段列表
+            source_name: 文档来源名称
+            batch_size: 每批编码的文本片段数
+            progress_callback: 每批完成后的回调函数，接收参数(done, total)
+        """
         if not texts:
-            print("警告: 没有文本内容可添加")
+            logger.warning("没有文本内容可添加")
             return
-            
-        print(f"正在添加 {len(texts)} 个文本片段到向量存储...")
-        
-        # 为每个文本片段添加来源信息
-        texts_with_source = [f"来源: {source_name}\n\n{text}" for text in texts]
-        
-        # 获取嵌入
-        print("生成文本嵌入向量...")
-        embeddings = self.embedding_model.encode(texts_with_source)
-        print(f"成功生成 {len(embeddings)} 个嵌入向量")
-        
-        # 添加到FAISS索引
-        self.index.add(np.array(embeddings).astype('float32'))
-        print(f"向量已添加到索引，当前索引包含 {self.index.ntotal} 个向量")
-        
-        # 保存文本
-        self.texts.extend(texts_with_source)
-        
-        # 保存索引和文本
-        self._save_index()
-        print("索引和文本已保存到磁盘")
-        
+
+        total = len(texts)
+        batch_size = max(1, int(batch_size))
+        start_time = time.perf_counter()
+        logger.debug(f"正在分批添加 {total} 个文本片段到向量存储，批大小 {batch_size}...")
+
+        with self._lock:
+            source_id = self.chunks.source_id(source_name)
+            doc_id = self.chunks.new_doc_id(source_id)
+            if source_id in self._retired_sources:
+                # 已删除的来源重新导入
+                self._retired_sources.discard(source_id)
+                self.manifest["retired_sources"] = sorted(self._retired_sources)
+
+        try:
+            self._add_batches(texts, source_name, source_id, doc_id, batch_size, progress_callback)
+        except Exception:
+            self._discard_doc(source_id, doc_id)
+            raise
+
+        elapsed = time.perf_counter() - start_time
+        logger.info(f"已添加 {total} 个片段（{total / max(elapsed, 1e-9):.0f} 个/秒），"
+                    f"当前索引包含 {self.index.ntotal} 个向量",
+                    extra={"fields": {"source": source_name, "chunks": total, "seconds": round(elapsed, 3)}})
+        if not self._maybe_promote():
+            self._maybe_compact()
+
         return True
-    
-    def similarity_search(self, query, top_k=TOP_K_RETRIEVAL, threshold=0.75):
-        """搜索最相似的文档"""
-        if not self.texts or self.index.ntotal == 0:
-            print("警告: 向量存储为空，无法执行搜索")
-            return []
-            
-        print(f"执行相似度搜索，查询: '{query}'")
+
+    def _add_batches(self, texts, source_name, source_id, doc_id, batch_size, progress_callback):
+        """逐批编码并追加一个文档的片段，每批单独提交"""
+        total = len(texts)
+        for start in range(0, total, batch_size):
+            batch = texts[start:start + batch_size]
+
+            # 编码时带上来源标题；直接编码为连续的float32数组，避免额外复制
+            with tracing.span("ingest_encode", chunks=len(batch)):
+                embeddings = self._encode([format_chunk(source_name, text) for text in batch], batch_size)
+                analyzed = self.lexical.analyze(batch) if HYBRID_SEARCH_ENABLED else None
+
+            # 写入索引、追加到磁盘（加锁，保证向量行号与片段ID一一对应）
+            with self._lock, tracing.span("ingest_append", chunks=len(batch)):
+                first_id = len(self.chunks)
+                add_rows(self.index, embeddings, first_id)
+                self._append_segment(embeddings, batch, source_id, doc_id, start)
+                # 关键词索引正在后台补建时由补建线程一并加入
+                if analyzed is not None and self.lexical.ntotal == first_id:
+                    self.lexical.add(first_id, analyzed)
+
+            done = start + len(batch)
+            if progress_callback:
+                progress_callback(done, total)
+
+    def _discard_doc(self, source_id, doc_id):
+        """导入中途失败时删除已提交的部分片段；该来源没有其他文档时恢复为已删除"""
+        with self._lock:
+            removed = self.chunks.docs[doc_id]["count"]
+            if not self._live_docs(source_id) - {doc_id}:
+                self._retired_sources.add(source_id)
+            self._delete_docs({doc_id})
+        logger.warning(f"导入失败，已删除写入了一部分的 {removed} 个片段")
+
+    def replace_source(self, texts, source_name, batch_size=EMBEDDING_BATCH_SIZE, progress_callback=None):
+        """用新内容替换某个来源的文档：先写入新片段，全部成功后再删除旧文档
+
+        写入失败时已写入的新片段被删除、旧文档保持可检索，知识库不会丢失原有内容；
+        替换期间检索可能同时看到新旧两份内容。
+
+        Returns:
+            int: 被替换的旧片段数
+        """
+        with self._lock:
+            source_id = self.chunks.find_source(source_name)
+            retired = source_id is None or source_id in self._retired_sources
+            old_docs = set() if retired else self._live_docs(source_id)
+        self.add_texts(texts, source_name, batch_size, progress_callback)
+        if not old_docs:
+            return 0
+        with self._lock:
+            removed = sum(self.chunks.docs[doc_id]["count"] for doc_id in old_docs)
+            self._delete_docs(old_docs)
+        logger.info(f"已替换来源 '{source_name}' 的 {removed} 个旧片段")
+        return removed
+
+    def _encode(self, texts, batch_size=EMBEDDING_BATCH_SIZE):
+        """将文本编码为FAISS可直接使用的连续float32矩阵"""
+        embeddings = self.embedding_model.encode(
+            texts,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        )
+        # 已经是连续float32时不会产生复制
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+    def search(self, query, top_k=TOP_K_RETRIEVAL, threshold=0.75):
+        """搜索最相似的片段，返回结构化结果
         
-        # 编码查询
-        query_embedding = self.embedding_model.encode([query])
+        开启混合检索时，向量检索（相似度不低于threshold）与BM25关键词检索的结果按倒数排名融合，
+        只有精确术语、编号匹配而向量相似度不够的片段也能被检索到。
         
-        # 搜索
-        distances, indices = self.index.search(np.array(query_embedding).astype('float32'), k=top_k)
+        Returns:
+            list: 每项包含id、score、lexical_score、rank_score、text、source、doc_id、position，按融合后的排名排序；
+                  score为向量相似度（走关键词快速路径时为None），lexical_score为BM25分数（没有关键词命中时为None），
+                  rank_score为排序所依据的RRF分数
+        """
+        return self.search_batch([query], top_k, threshold)[0]
+
+    def search_batch(self, queries, top_k=TOP_K_RETRIEVAL, threshold=0.75, query_embeddings=None):
+        """一次检索多个查询：未缓存的查询合并为一次编码和一次index.search
+
+        Args:
+            query_embeddings: 可选，查询 -> 已编码的查询向量（1 x dim），在多个集合中检索同一查询时只编码一次
+
+        Returns:
+            list: 与queries一一对应，每项是search()的返回值
+        """
+        if self.index.ntotal == 0:
+            logger.warning("向量存储为空，无法执行搜索")
+            return [[] for _ in queries]
+
+        # 同一索引版本下相同的检索直接返回缓存结果
+        version = self.version
+        results = [None] * len(queries)
+        pending = {}
+        for i, query in enumerate(queries):
+            cached = self._result_cache.get((query, top_k, threshold, version))
+            if cached is not None:
+                logger.debug("命中检索缓存，查询: '%s'", query)
+                results[i] = [dict(hit) for hit in cached]
+            else:
+                # 同一批中重复的查询只检索一次
+                pending.setdefault(query, []).append(i)
+        if not pending:
+            return results
+
+        unique_queries = list(pending)
+        # 逐条命中详情只在DEBUG级别输出，其他级别下不格式化
+        verbose = logger.isEnabledFor(logging.DEBUG)
+        if verbose:
+            for query in unique_queries:
+                logger.debug("执行相似度搜索，查询: '%s'", query)
+
+        # 关键词检索不需要查询向量；像编号、错误码的查询有关键词命中时直接返回，不再编码
+        lexical_hits = {}
+        if HYBRID_SEARCH_ENABLED:
+            with self._lock, tracing.span("lexical_search", queries=len(unique_queries)):
+                lexical_hits = {query: self._search_lexical(query, LEXICAL_CANDIDATES) for query in unique_queries}
+        dense_queries = [query for query in unique_queries if not self._use_fast_path(query, lexical_hits)]
+
+        # 编码查询（未缓存的查询一次前向计算）
+        known = dict(query_embeddings or {})
+        query_embeddings = None
+        if dense_queries:
+            missing = [query for query in dense_queries if query not in known]
+            if missing:
+                with tracing.span("encode", queries=len(missing)):
+                    encoded = self.encode_queries(missing).reshape(len(missing), -1)
+                known.update((query, encoded[row]) for row, query in enumerate(missing))
+            query_embeddings = np.ascontiguousarray(
+                np.vstack([np.reshape(known[query], (1, -1)) for query in dense_queries]), dtype=np.float32)
+
+        # 搜索并解码命中的片段（加锁，避免与正在进行的导入或清空交错）
+        with self._lock, tracing.span("index_search", queries=len(unique_queries)):
+            if HYBRID_SEARCH_ENABLED and self.version != version:
+                # 编码期间知识库有变化，重新做关键词检索
+                lexical_hits = {query: self._search_lexical(query, LEXICAL_CANDIDATES) for query in unique_queries}
+            live_results = self._search_live_batch(query_embeddings, top_k) if dense_queries else []
+            dense_results = {query: (row, live) for row, (query, live) in enumerate(zip(dense_queries, live_results))}
+            for query in unique_queries:
+                lexical = lexical_hits.get(query, [])
+                if query in dense_results:
+                    row, live = dense_results[query]
+                    ranked = self._fuse(live, lexical, query_embeddings[row], top_k, threshold)
+                else:
+                    logger.debug("  关键词快速路径，跳过向量检索")
+                    ranked = [(idx, None, score, 1.0 / (RRF_K + rank + 1))
+                              for rank, (idx, score) in enumerate(lexical[:top_k])]
+
+                hits = []
+                for i, (idx, similarity_score, lexical_score, rank_score) in enumerate(ranked):
+                    # 只有最终入选的片段才解码文本
+                    hit = self.chunks.get(idx)
+                    hit["score"] = similarity_score
+                    hit["lexical_score"] = lexical_score
+                    hit["rank_score"] = rank_score
+                    hits.append(hit)
+                    if verbose:
+                        similarity_text = "-" if similarity_score is None else f"{similarity_score:.4f}"
+                        lexical_text = "-" if lexical_score is None else f"{lexical_score:.2f}"
+                        logger.debug(f"  结果 {i+1}: 相似度={similarity_text}, BM25={lexical_text}, 来源: {hit['source']}")
+
+                # 检索期间索引没有变化时才写入缓存
+                if self.version == version:
+                    self._result_cache.put((query, top_k, threshold, version), [dict(hit) for hit in hits])
+                logger.debug("搜索完成，找到 %d 个相关文档", len(hits))
+                for position in pending[query]:
+                    results[position] = [dict(hit) for hit in hits]
+
+        return results
+
+    def _use_fast_path(self, query, lexical_hits):
+        """像标识符的查询有关键词命中时只用关键词检索的结果"""
+        return LEXICAL_FAST_PATH and bool(lexical_hits.get(query)) and looks_like_identifier(query)
+
+    def _fuse(self, live, lexical, query_embedding, top_k, threshold):
+        """把向量检索和关键词检索的结果按倒数排名融合（RRF），返回[(片段ID, 向量相似度, BM25分数, RRF分数)]（调用方需持有锁）
+
+        向量检索的结果先按threshold过滤；只由关键词命中的片段补算向量相似度，便于调用方查看。
+        """
+        fused = {}
+        for i, (dist, idx) in enumerate(live):
+            # 对于内积距离，值越大表示越相似
+            similarity_score = float(dist)  # 对于IndexFlatIP，直接使用距离作为相似度
+            if similarity_score < threshold:
+                logger.debug("  向量结果 %d: 相似度=%.4f < %s，被过滤", i + 1, similarity_score, threshold)
+                continue
+            fused[int(idx)] = [1.0 / (RRF_K + len(fused) + 1), similarity_score, None]
+        for rank, (idx, lexical_score) in enumerate(lexical):
+            entry = fused.setdefault(idx, [0.0, None, None])
+            entry[0] += 1.0 / (RRF_K + rank + 1)
+            entry[2] = lexical_score
+
+        ranked = sorted(fused.items(), key=lambda item: item[1][0], reverse=True)[:top_k]
+        missing = [idx for idx, (_, similarity_score, _) in ranked if similarity_score is None]
+        if missing:
+            vectors = self._vectors(self.manifest["ntotal"])
+            similarities = dict(zip(missing, (vectors[missing] @ query_embedding.reshape(-1)).tolist()))
+        return [(idx, similarity_score if similarity_score is not None else similarities[idx],
+                 lexical_score, rank_score)
+                for idx, (rank_score, similarity_score, lexical_score) in ranked]
+
+    def _search_lexical(self, query, limit):
+        """BM25关键词检索，过滤已删除的片段，返回[(片段ID, BM25分数)]（调用方需持有锁）"""
+        deleted = self._deleted_docs
+        doc_ids = self.chunks.column('doc_id') if deleted else None
+        results = []
+        candidates = self.lexical.search(query, limit * 2 if deleted else limit, LEXICAL_MIN_COVERAGE)
+        for idx, score, _ in candidates:
+            if idx >= len(self.chunks) or (deleted and int(doc_ids[idx]) in deleted):
+                continue
+            results.append((idx, score))
+            if len(results) == limit:
+                break
+        return results
+
+    def lexical_fast_path(self, query):
+        """查询是否可能走关键词快速路径（不计算查询向量）"""
+        return HYBRID_SEARCH_ENABLED and LEXICAL_FAST_PATH and looks_like_identifier(query)
+
+    def _search_live(self, query_embedding, top_k):
+        """检索top_k个未删除的片段，返回[(相似度, 片段ID)]（调用方需持有锁）
         
-        # 获取结果并根据相似度阈值筛选
+        不支持删除的索引（HNSW）中仍有已删除文档的向量，命中后在这里过滤；有删除时按需扩大检索范围。
+        """
+        deleted = self._tombstones_in_index()
+        fetch_k = top_k * 2 if deleted else top_k
+        while True:
+            results, complete = self._filter_live(
+                *self.index.search(query_embedding, k=min(fetch_k, self.index.ntotal)), top_k)[0]
+            if complete or fetch_k >= self.index.ntotal:
+                return results
+            fetch_k *= 4
+
+    def _search_live_batch(self, query_embeddings, top_k):
+        """_search_live的批量版本：所有查询一次index.search，过滤后不足top_k的查询再单独扩大范围
+
+        索引中的向量经过压缩（或为ivf_pq）且开启重排时，先取RERANK_FACTOR倍的候选，
+        再用磁盘上的全精度向量重新计算相似度，返回精确排序的前top_k个。
+        """
+        rerank = VECTOR_RERANK and compression_of(self.index) != "none"
+        candidates_k = top_k * RERANK_FACTOR if rerank else top_k
+        fetch_k = candidates_k * 2 if self._tombstones_in_index() else candidates_k
+        batch = self._filter_live(*self.index.search(query_embeddings, k=min(fetch_k, self.index.ntotal)),
+                                  candidates_k)
+        vectors = self._vectors(self.manifest["ntotal"]) if rerank else None
         results = []
-        for i, (dist, idx) in enumerate(zip(distances[0], indices[0])):
-            if idx < len(self.texts):
-                # 对于内积距离，值越大表示越相似
-                similarity_score = dist  # 对于IndexFlatIP，直接使用距离作为相似度
-                
-                # 提取来源信息，避免在f-string中使用反斜杠
-                source_text = self.texts[idx]
-                source = source_text.split("\n\n")[0] if "\n\n" in source_text else "未知"
-                
-                if similarity_score >= threshold:
-                    results.append(self.texts[idx])
-                    print(f"  结果 {i+1}: 相似度={similarity_score:.4f}, {source}")
-                else:
-                    print(f"  结果 {i+1}: 相似度={similarity_score:.4f} < {threshold}，被过滤, {source}")
+        for row, (live, complete) in enumerate(batch):
+            if not complete and fetch_k < self.index.ntotal:
+                live = self._search_live(query_embeddings[row:row + 1], candidates_k)
+            if rerank:
+                live = exact_rerank(vectors, query_embeddings[row], [idx for _, idx in live], top_k)
+            results.append(live)
+        return results
+
+    def _filter_live(self, distances, indices, top_k):
+        """过滤掉已删除和无效的结果，返回每个查询的([(相似度, 片段ID)], 是否已凑够top_k)"""
+        deleted = self._tombstones_in_index()
+        doc_ids = self.chunks.column('doc_id') if deleted else None
+        batch = []
+        for row_distances, row_indices in zip(distances, indices):
+            results = []
+            for dist, idx in zip(row_distances, row_indices):
+                if not 0 <= idx < len(self.chunks):
+                    continue
+                if deleted and int(doc_ids[idx]) in deleted:
+                    continue
+                results.append((dist, idx))
+                if len(results) == top_k:
+                    break
+            batch.append((results, len(results) == top_k))
+        return batch
+
+    def _tombstones_in_index(self):
+        """索引中仍包含向量的已删除文档；支持按ID删除的索引删除文档时已直接删除向量，返回空集"""
+        return set() if supports_removal(self.index) else self._deleted_docs
+
+    def _chunk_ids_of(self, doc_ids):
+        """按文档表的片段ID范围列出这些文档的全部片段ID（文档的片段通常连续，只在交错导入时才读元数据列）"""
+        doc_column = None
+        chunk_ids = []
+        for doc_id in doc_ids:
+            doc = self.chunks.docs[doc_id]
+            ids = np.arange(doc["first"], doc["end"], dtype=np.int64)
+            if doc["count"] != len(ids):
+                if doc_column is None:
+                    doc_column = self.chunks.column('doc_id')
+                ids = ids[doc_column[doc["first"]:doc["end"]] == doc_id]
+            chunk_ids.append(ids)
+        return np.concatenate(chunk_ids) if chunk_ids else np.empty(0, dtype=np.int64)
+
+    def _remove_deleted_vectors(self, index):
+        """从索引中删除已删除文档的向量（不支持删除的索引跳过，检索时按墓碑过滤）（调用方需持有锁）"""
+        if not self._deleted_docs or not supports_removal(index):
+            return
+        chunk_ids = self._chunk_ids_of(sorted(self._deleted_docs))
+        if index.ntotal > len(self.chunks) - len(chunk_ids):
+            removed = index.remove_ids(chunk_ids)
+            logger.info(f"从索引中删除已删除文档的 {removed} 个向量")
+
+    def encode_query(self, query):
+        """编码查询，重复或近期问过的查询直接使用缓存的向量"""
+        return self.encode_queries([query])
+
+    def encode_queries(self, queries):
+        """编码多个查询，返回(len(queries), dim)矩阵；未缓存的查询合并为一次前向计算"""
+        embeddings = [self._query_cache.get(query) for query in queries]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            encoded = self._encode([queries[i] for i in missing])
+            for row, i in enumerate(missing):
+                embedding = encoded[row:row + 1].copy()
+                embedding.setflags(write=False)
+                self._query_cache.put(queries[i], embedding)
+                embeddings[i] = embedding
+        if len(embeddings) == 1:
+            return embeddings[0]
+        return np.ascontiguousarray(np.vstack(embeddings), dtype=np.float32)
+
+    def is_idle(self):
+        """没有正在进行的后台压缩、索引升级或关键词索引补建（此时可以安全地卸载）"""
+        with self._lock:
+            return not (self._compacting or self._promoting or self._lexical_catching_up)
+
+    def _bump_version(self):
+        """索引内容变化后递增版本号并丢弃旧的检索结果缓存（调用方需持有锁）"""
+        self.version += 1
+        self._result_cache.clear()
+
+    def cache_stats(self):
+        """查询向量缓存和检索结果缓存的命中统计"""
+        return {
+            "query_embedding": self._query_cache.stats(),
+            "search_result": self._result_cache.stats()
+        }
+
+    def similarity_search(self, query, top_k=TOP_K_RETRIEVAL, threshold=0.75):
+        """搜索最相似的文档，返回带来源标题的文本列表"""
+        return [format_chunk(hit["source"], hit["text"]) for hit in self.search(query, top_k, threshold)]
+
+    def similarity_search_batch(self, queries, top_k=TOP_K_RETRIEVAL, threshold=0.75):
+        """similarity_search的批量版本，返回与queries一一对应的文本列表"""
+        return [[format_chunk(hit["source"], hit["text"]) for hit in hits]
+                for hits in self.search_batch(queries, top_k, threshold)]
+
+    def list_documents(self):
+        """列出未删除的文档：来源、文档ID、片段ID范围、片段数和导入时间（读取文档表，不遍历片段）
+
+        Returns:
+            list: 每项为dict: source, doc_id, first_id, end_id（不含）, chunks, ingested_at（时间戳，旧数据为None）
+        """
+        with self._lock:
+            deleted = self._deleted_docs
+            sources = self.chunks.sources
+            return [{"source": sources[doc["source_id"]], "doc_id": doc_id, "first_id": doc["first"],
+                     "end_id": doc["end"], "chunks": doc["count"], "ingested_at": doc["ingested_at"]}
+                    for doc_id, doc in enumerate(self.chunks.docs) if doc["count"] and doc_id not in deleted]
+
+    def list_sources(self):
+        """列出知识库中的文档来源（读取来源表，不遍历片段）"""
+        with self._lock:
+            retired = self._retired_sources
+            return [name for i, name in enumerate(self.chunks.sources) if i not in retired]
+
+    def has_source(self, source_name):
+        """知识库中是否存在该来源的（未删除）文档"""
+        with self._lock:
+            source_id = self.chunks.find_source(source_name)
+            return source_id is not None and source_id not in self._retired_sources
+
+    def delete_source(self, source_name):
+        """删除某个来源的全部片段，其余文档不受影响、无需重新编码
         
-        print(f"搜索完成，找到 {len(results)} 个相关文档")
+        被删除的文档记为墓碑（写入manifest）；支持按ID删除的索引同时删除其向量，否则检索时过滤。
+        按文档表查找该来源的文档，工作量与文档数和被删除的片段数成正比。
         
-        return results
-    
-    def _save_index(self):
-        """保存索引和文本到磁盘"""
+        Returns:
+            int: 被删除的片段数
+        """
+        with self._lock:
+            source_id = self.chunks.find_source(source_name)
+            if source_id is None or source_id in self._retired_sources:
+                return 0
+            doc_ids = self._live_docs(source_id)
+            removed = sum(self.chunks.docs[doc_id]["count"] for doc_id in doc_ids)
+            self._retired_sources.add(source_id)
+            self._delete_docs(doc_ids)
+        logger.info(f"已删除来源 '{source_name}' 的 {removed} 个片段")
+        return removed
+
+    def _live_docs(self, source_id):
+        """某个来源未删除的文档ID（调用方需持有锁）"""
+        return {doc_id for doc_id, doc in enumerate(self.chunks.docs)
+                if doc["source_id"] == source_id and doc_id not in self._deleted_docs}
+
+    def _delete_docs(self, doc_ids):
+        """把文档记为墓碑并提交manifest；支持按ID删除的索引同时删除其向量（调用方需持有锁）"""
+        if doc_ids and supports_removal(self.index):
+            self.index.remove_ids(self._chunk_ids_of(sorted(doc_ids)))
+        self._deleted_docs |= doc_ids
+        # 一并提交文档表和来源表（导入失败时被删除的文档可能还没有提交过）
+        self.manifest["chunks"] = self.chunks.state()
+        self.manifest["deleted_docs"] = sorted(self._deleted_docs)
+        self.manifest["retired_sources"] = sorted(self._retired_sources)
+        self.manifest["revision"] = self.revision + 1
+        atomic_write_json(self.manifest_file, self.manifest)
+        self._bump_version()
+
+    @property
+    def revision(self):
+        """知识库内容的持久化修订号，内容变化（导入、清空）时递增，重启后保持"""
+        return self.manifest.get("revision", 0)
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def _append_segment(self, embeddings, texts, source_id, doc_id, first_position):
+        """追加一批向量和片段到磁盘并提交（调用方需持有锁）
+
+        只写入新数据，写入量与已有数据规模无关。数据先落盘，最后原子替换manifest作为提交点。
+        """
+        with open(self.vectors_file, 'ab') as f:
+            f.truncate(self.manifest["ntotal"] * self.manifest["dim"] * 4)
+            f.write(embeddings.tobytes())
+            fsync_file(f)
+
+        self.chunks.append(texts, source_id, doc_id, first_position)
+
+        self.manifest["ntotal"] += len(embeddings)
+        self.manifest["revision"] = self.revision + 1
+        self.manifest["chunks"] = self.chunks.state()
+        atomic_write_json(self.manifest_file, self.manifest)
+        self._bump_version()
+
+    def _maybe_promote(self):
+        """向量数超过阈值后，在后台训练配置的近似索引并替换当前的flat索引
+
+        Returns:
+            bool: 是否启动了升级
+        """
+        with self._lock:
+            target = (self._target_index_type(), VECTOR_COMPRESSION)
+            current = (index_type_of(self.index), compression_of(self.index))
+            if (self._promoting or current == target or current[0] != "flat"
+                    or self.index.ntotal < INDEX_PROMOTION_THRESHOLD):
+                return False
+            self._promoting = True
+        threading.Thread(target=self._promote, args=target, daemon=True).start()
+        return True
+
+    def _promote(self, target, compression):
+        """训练新索引并加入已有向量，最后在锁内补上期间新增的向量后切换"""
         try:
-            # 确保目录存在
-            os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
-            
-            # 打印调试信息
-            print(f"正在保存索引到: {self.index_file}")
-            print(f"正在保存文本到: {self.texts_file}")
-            
-            # 保存索引
-            faiss.write_index(self.index, self.index_file)
-            
-            # 保存文本
-            with open(self.texts_file, 'wb') as f:
-                pickle.dump(self.texts, f)
-            
-            # 验证文件是否已创建
-            if os.path.exists(self.index_file) and os.path.exists(self.texts_file):
-                print(f"索引和文本文件已成功保存")
-                print(f"索引文件大小: {os.path.getsize(self.index_file)} 字节")
-                print(f"文本文件大小: {os.path.getsize(self.texts_file)} 字节")
-            else:
-                print(f"警告: 文件保存后无法验证其存在")
-                
-            return True
+            with self._lock:
+                epoch = self._clear_epoch
+                count = len(self.chunks)
+                dimension = self.manifest["dim"]
+                current = self._describe(index_type_of(self.index), compression_of(self.index))
+
+            # 训练和建索引在锁外进行，期间检索和导入照常使用旧索引
+            logger.info(f"后台升级索引: {current} -> {self._describe(target, compression)}，共 {count} 个向量")
+            vectors = self._vectors(count)
+            index = train_index(with_ids(build_index(target, dimension, count, compression)), vectors)
+            add_in_blocks(index, vectors)
+            configure_search(index)
+            del vectors
+
+            with self._lock:
+                if self._clear_epoch != epoch:
+                    # 升级期间存储被清空，本次结果作废
+                    return
+                if len(self.chunks) > count:
+                    add_in_blocks(index, self._vectors(len(self.chunks)), count)
+                self._remove_deleted_vectors(index)
+                self.index = index
+                self._index_replaced = True
+                self._bump_version()
+            logger.info(f"索引升级完成: {self._describe(target, compression)}，共 {index.ntotal} 个向量")
+
+            # 立即写快照，重启后直接加载升级后的索引
+            self._maybe_compact()
+        except Exception as e:
+            logger.exception(f"升级索引时出错: {e}")
+        finally:
+            with self._lock:
+                self._promoting = False
+
+    def _maybe_compact(self):
+        """快照之后追加的向量足够多（或索引被整体替换）时，在后台压缩
+
+        触发阈值随已有数据规模按比例增长，压缩的均摊成本是常数。
+        """
+        with self._lock:
+            pending = max(self.manifest["ntotal"] - self.manifest["index_ntotal"],
+                          self.lexical.ntotal - self.manifest.get("lexical_ntotal", 0))
+            threshold = max(COMPACT_MIN_PENDING, int(self.manifest["index_ntotal"] * COMPACT_RATIO))
+            if self._compacting or (pending < threshold and not self._index_replaced):
+                return
+            self._compacting = True
+        threading.Thread(target=self._compact, daemon=True).start()
+
+    def _compact(self):
+        """把当前索引写成新一代快照，加载时不必再逐条补加向量"""
+        try:
+            # 在锁内只做内存拷贝，耗时的写盘在锁外进行，不阻塞检索和导入
+            with self._lock:
+                epoch = self._clear_epoch
+                generation = self.manifest["generation"] + 1
+                index_data = faiss.serialize_index(self.index)
+                count = len(self.chunks)
+                vector_count = self.index.ntotal
+                lexical_data = self.lexical.serialize() if HYBRID_SEARCH_ENABLED else None
+                lexical_count = self.lexical.ntotal
+                self._index_replaced = False
+
+            index_name = f"faiss_index.{generation}.bin"
+            lexical_name = f"lexical_index.{generation}.npz" if lexical_data is not None else None
+            logger.info(f"后台压缩向量存储，第 {generation} 代快照，共 {vector_count} 个向量")
+            atomic_write(self._path(index_name), lambda f: f.write(index_data))
+            del index_data
+            if lexical_name:
+                atomic_write(self._path(lexical_name), lambda f: LexicalIndex.write(f, lexical_data))
+            del lexical_data
+
+            with self._lock:
+                if self._clear_epoch != epoch:
+                    # 压缩期间存储被清空，本次快照作废
+                    remove_quietly(self._path(index_name))
+                    if lexical_name:
+                        remove_quietly(self._path(lexical_name))
+                    return
+
+                old_files = (self.manifest["index_file"], self.manifest.get("lexical_file"))
+                new_manifest = dict(self.manifest)
+                new_manifest.update({
+                    "generation": generation,
+                    "index_file": index_name,
+                    "index_ntotal": count,
+                    "index_vectors": vector_count,
+                    "lexical_file": lexical_name,
+                    "lexical_ntotal": lexical_count if lexical_name else 0
+                })
+                atomic_write_json(self.manifest_file, new_manifest)
+                self.manifest = new_manifest
+
+                # 提交后再删除旧快照
+                for old_file in old_files:
+                    if old_file and old_file not in (index_name, lexical_name):
+                        remove_quietly(self._path(old_file))
+            logger.info(f"向量存储压缩完成，第 {generation} 代")
         except Exception as e:
-            print(f"保存索引时出错: {e}")
-            import traceback
-            traceback.print_exc()
-            return False
-    
+            logger.exception(f"压缩向量存储时出错: {e}")
+        finally:
+            with self._lock:
+                self._compacting = False
+            # 压缩期间索引又被替换（如升级完成），再写一次快照
+            if self._index_replaced:
+                self._maybe_compact()
+
     def clear(self):
         """清空向量存储"""
-        dimension = self.embedding_model.get_sentence_embedding_dimension()
-        self.index = faiss.IndexFlatIP(dimension)  # 使用内积而不是L2距离
-        self.texts = []
-        self._save_index()
\ No newline at end of file
+        with self._lock:
+            old_manifest = self.manifest
+            self._clear_epoch += 1
+            self._bump_version()
+            self._create_empty_store(generation=old_manifest["generation"] + 1,
+                                     revision=old_manifest.get("revision", 0) + 1)
+            for old_file in (old_manifest["index_file"], old_manifest.get("lexical_file")):
+                if old_file:
+                    remove_quietly(self._path(old_file))
@@ -0,0 +1,354 @@
+"""无界面的HTTP问答服务
+
+所有请求共享同一个RAGEngine和CollectionManager。检索（嵌入编码和FAISS检索）在线程池中执行，
+大模型请求和流式输出在事件循环中异步进行，因此可以同时服务多个用户；导入在单独的线程中串行执行。
+
+接口:
+    GET  /healthz        进程存活
+    GET  /readyz         嵌入模型和索引是否已加载（未就绪时返回503）
+    POST /query          {"query": "...", "collections": [...]} -> {"answer", "contexts", "cached", "prompt_tokens"}
+                         collections可省略（只检索默认集合），["*"]表示全部集合
+    POST /query/stream   同上 -> SSE: contexts事件、若干delta事件、done或error事件
+    POST /ingest         {"paths": [...]} 导入服务器上知识库目录（config.KNOWLEDGE_BASE_DIR）内的文件（相对路径相对于该目录），
+                         或 {"source": "...", "text": "..."} 导入一段文本；可加 "collection": "..." 导入到指定集合（不存在时创建）
+    GET  /documents      已导入的文档（来源、片段数、导入时间），?collection=... 指定集合
+    DELETE /documents?source=...  删除一个来源的文档，只删除它的向量（可加&collection=...）
+    GET  /collections    全部集合（名称、是否已加载、片段数）
+    DELETE /collections/{name}         删除一个集合及其全部数据
+    POST /collections/{name}/unload    卸载一个集合，释放内存（下次使用时重新加载）
+    GET  /metrics        Prometheus文本格式的指标（各阶段耗时直方图、请求数；需开启追踪）
+
+导入、删除文档、删除和卸载集合会修改知识库，需要在请求头中带上管理令牌（Authorization: Bearer <令牌>）；
+没有配置令牌（--admin-token、环境变量SERVER_ADMIN_TOKEN或config.SERVER_ADMIN_TOKEN）时这些接口返回403。
+
+用法:
+    python server.py --host 0.0.0.0 --port 8000 --api-key sk-... --admin-token <令牌>
+    python server.py --trace --log-level DEBUG   # 记录每次问答各阶段的耗时（写入config.TRACE_FILE）
+"""
+import os
+import sys
+import hmac
+import json
+import asyncio
+import argparse
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from fastapi import FastAPI, Header
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from pydantic import BaseModel
+import config
+from config import (ensure_directories, SERVER_HOST, SERVER_PORT, SERVER_RETRIEVAL_WORKERS, QUERY_BATCH_ENABLED,
+                    DEFAULT_COLLECTION, SERVER_ADMIN_TOKEN, KNOWLEDGE_BASE_DIR)
+from modules import async_runtime, tracing
+from modules.logger import get_logger, setup_logging
+from modules.store_registry import (start_warm_up, is_ready, warm_up_error, get_vector_store, get_collection_manager,
+                                    startup_timings, format_startup_report, on_ready)
+from modules.collection_manager import CollectionNotFoundError
+from modules.rag_engine import RAGEngine
+
+logger = get_logger(__name__)
+
+
+class QueryRequest(BaseModel):
+    query: str
+    collections: Optional[List[str]] = None
+
+
+class IngestRequest(BaseModel):
+    paths: Optional[List[str]] = None
+    source: Optional[str] = None
+    text: Optional[str] = None
+    collection: Optional[str] = None
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def resolve_ingest_paths(paths, ingest_dir):
+    """把/ingest请求中的路径解析为ingest_dir内的绝对路径（相对路径相对于ingest_dir，符号链接按实际位置判断）
+
+    Returns:
+        (解析后的路径列表, 错误信息)：有路径不在ingest_dir内或文件不存在时路径列表为None
+    """
+    root = os.path.realpath(ingest_dir)
+    resolved, outside, missing = [], [], []
+    for path in paths:
+        real = os.path.realpath(os.path.join(root, path))
+        try:
+            inside = os.path.commonpath([root, real]) == root
+        except ValueError:
+            # Windows上不同盘符的路径没有公共前缀
+            inside = False
+        if not inside:
+            outside.append(path)
+        elif not os.path.isfile(real):
+            missing.append(path)
+        else:
+            resolved.append(real)
+    if outside:
+        return None, f"只能导入知识库目录内的文件: {', '.join(outside)}"
+    if missing:
+        return None, f"文件不存在: {', '.join(missing)}"
+    return resolved, None
+
+
+def create_app(rag_engine=None, retrieval_workers=SERVER_RETRIEVAL_WORKERS, admin_token=SERVER_ADMIN_TOKEN,
+               ingest_dir=KNOWLEDGE_BASE_DIR):
+    """创建FastAPI应用
+
+    Args:
+        rag_engine: 共享的RAGEngine，默认新建（使用进程内共享的向量存储）
+        retrieval_workers: 执行检索的线程数
+        admin_token: 导入、删除、卸载接口需要的令牌，为空时这些接口不可用
+        ingest_dir: /ingest只导入这个目录内的文件
+    """
+    app = FastAPI(title="RAG问答服务")
+    # 并发请求的检索合并为微批，一次编码、一次index.search
+    engine = rag_engine or RAGEngine(query_batching=QUERY_BATCH_ENABLED)
+    retrieval_pool = ThreadPoolExecutor(max_workers=retrieval_workers, thread_name_prefix="retrieval")
+    # 写入向量存储的导入任务串行执行，避免与检索争抢线程池
+    ingest_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest")
+    kb_sync_holder = []
+
+    def check_admin(authorization):
+        """校验修改知识库的请求带有管理令牌，不通过时返回错误响应"""
+        if not admin_token:
+            return JSONResponse({"error": "服务未配置管理令牌（--admin-token），导入、删除和卸载接口不可用"},
+                                status_code=403)
+        scheme, _, token = (authorization or "").partition(" ")
+        if scheme.lower() != "bearer" or not hmac.compare_digest(token.strip().encode(), admin_token.encode()):
+            return JSONResponse({"error": "管理令牌无效"}, status_code=401, headers={"WWW-Authenticate": "Bearer"})
+        return None
+
+    def kb_sync():
+        if not kb_sync_holder:
+            from modules.kb_sync import KnowledgeBaseSync
+            kb_sync_holder.append(KnowledgeBaseSync(get_vector_store()))
+        return kb_sync_holder[0]
+
+    def run_on_collection(collection, action, create=False):
+        """在导入线程中对集合执行action(kb_sync)；其他集合可能被卸载，每次新建KnowledgeBaseSync，操作期间不卸载"""
+        if not collection or collection == DEFAULT_COLLECTION:
+            return action(kb_sync())
+        from modules.kb_sync import KnowledgeBaseSync
+        with get_collection_manager().lease(collection, create=create) as store:
+            return action(KnowledgeBaseSync(store, state_file=os.path.join(store.store_dir, "kb_sync.json")))
+
+    def ingest_text(source_name, text, collection=None):
+        from modules.document_loader import DocumentLoader
+        chunks = DocumentLoader().split_text(text)
+
+        def add(sync):
+            vector_store = sync.vector_store
+            if chunks:
+                # 新内容写入成功后才删除同名来源的旧内容
+                vector_store.replace_source(chunks, source_name)
+            elif vector_store.has_source(source_name):
+                vector_store.delete_source(source_name)
+            return {"status": "added" if chunks else "empty", "source": source_name, "chunks": len(chunks)}
+
+        return run_on_collection(collection, add, create=True)
+
+    @app.on_event("shutdown")
+    def shutdown():
+        retrieval_pool.shutdown(wait=False)
+        ingest_pool.shutdown(wait=False)
+
+    @app.exception_handler(CollectionNotFoundError)
+    async def collection_not_found(request, exc):
+        return JSONResponse({"error": str(exc)}, status_code=404)
+
+    @app.get("/healthz")
+    async def healthz():
+        return {"status": "ok"}
+
+    @app.get("/readyz")
+    async def readyz():
+        error = warm_up_error()
+        if error is not None:
+            return JSONResponse({"status": "error", "error": str(error)}, status_code=503)
+        if not is_ready():
+            return JSONResponse({"status": "loading"}, status_code=503)
+        return {"status": "ready", "documents": len(get_vector_store().list_sources()),
+                "startup": startup_timings}
+
+    @app.post("/query")
+    async def query(request: QueryRequest):
+        result = await engine.aquery(request.query, executor=retrieval_pool, collections=request.collections)
+        response = result["response"]
+        if not response["success"]:
+            return JSONResponse({"error": response["error"], "contexts": result["contexts"]}, status_code=502)
+        return {"answer": response["content"], "contexts": result["contexts"],
+                "cached": result.get("cached", False), "prompt_tokens": result.get("prompt_tokens", 0)}
+
+    @app.post("/query/stream")
+    async def query_stream(request: QueryRequest):
+        events = asyncio.Queue()
+
+        def on_contexts(contexts):
+            events.put_nowait(_sse("contexts", {"contexts": contexts}))
+
+        def callback(content_delta, is_done):
+            if content_delta and is_done:
+                # 结束时带内容的只有错误信息
+                events.put_nowait(_sse("error", {"error": content_delta}))
+                events.put_nowait(None)
+            elif is_done:
+                events.put_nowait(_sse("done", {}))
+                events.put_nowait(None)
+            else:
+                events.put_nowait(_sse("delta", {"delta": content_delta}))
+
+        async def run():
+            try:
+                await engine.astream_query(request.query, callback, executor=retrieval_pool,
+                                           on_contexts=on_contexts, collections=request.collections)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                events.put_nowait(_sse("error", {"error": str(e)}))
+                events.put_nowait(None)
+
+        async def stream():
+            task = asyncio.ensure_future(run())
+            try:
+                while True:
+                    event = await events.get()
+                    if event is None:
+                        break
+                    yield event
+            finally:
+                # 客户端断开时取消回答，关闭与大模型的连接
+                task.cancel()
+
+        return StreamingResponse(stream(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    @app.post("/ingest")
+    async def ingest(request: IngestRequest, authorization: Optional[str] = Header(None)):
+        denied = check_admin(authorization)
+        if denied is not None:
+            return denied
+        loop = asyncio.get_running_loop()
+        collection = request.collection
+        if collection:
+            try:
+                get_collection_manager().validate_name(collection)
+            except ValueError as e:
+                return JSONResponse({"error": str(e)}, status_code=400)
+        if request.paths:
+            paths, error = resolve_ingest_paths(request.paths, ingest_dir)
+            if error:
+                return JSONResponse({"error": error}, status_code=400)
+            results = await loop.run_in_executor(
+                ingest_pool, lambda: run_on_collection(collection, lambda sync: sync.add_files(paths), create=True))
+            return {"results": results}
+        if request.source and request.text is not None:
+            result = await loop.run_in_executor(ingest_pool, ingest_text, request.source, request.text, collection)
+            return {"results": [result]}
+        return JSONResponse({"error": "需要提供paths，或同时提供source和text"}, status_code=400)
+
+    @app.get("/documents")
+    async def documents(collection: str = DEFAULT_COLLECTION):
+        loop = asyncio.get_running_loop()
+        store = await loop.run_in_executor(retrieval_pool, get_collection_manager().get, collection)
+        return {"collection": collection, "documents": store.list_documents()}
+
+    @app.delete("/documents")
+    async def delete_document(source: str, collection: str = DEFAULT_COLLECTION,
+                              authorization: Optional[str] = Header(None)):
+        denied = check_admin(authorization)
+        if denied is not None:
+            return denied
+        loop = asyncio.get_running_loop()
+        removed = await loop.run_in_executor(
+            ingest_pool, lambda: run_on_collection(collection, lambda sync: sync.remove_source(source)))
+        if not removed:
+            return JSONResponse({"error": f"文档不存在: {source}"}, status_code=404)
+        return {"source": source, "chunks": removed}
+
+    @app.get("/collections")
+    async def collections():
+        loop = asyncio.get_running_loop()
+        return {"collections": await loop.run_in_executor(retrieval_pool, get_collection_manager().list_collections)}
+
+    @app.delete("/collections/{name}")
+    async def delete_collection(name: str, authorization: Optional[str] = Header(None)):
+        denied = check_admin(authorization)
+        if denied is not None:
+            return denied
+        loop = asyncio.get_running_loop()
+        try:
+            deleted = await loop.run_in_executor(ingest_pool, get_collection_manager().delete, name)
+        except RuntimeError as e:
+            return JSONResponse({"error": str(e)}, status_code=409)
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+        if not deleted:
+            return JSONResponse({"error": f"集合不存在: {name}"}, status_code=404)
+        return {"collection": name, "deleted": True}
+
+    @app.post("/collections/{name}/unload")
+    async def unload_collection(name: str, authorization: Optional[str] = Header(None)):
+        denied = check_admin(authorization)
+        if denied is not None:
+            return denied
+        manager = get_collection_manager()
+        if not manager.exists(name):
+            return JSONResponse({"error": f"集合不存在: {name}"}, status_code=404)
+        return {"collection": name, "unloaded": manager.unload(name)}
+
+    @app.get("/metrics")
+    async def metrics():
+        return PlainTextResponse(tracing.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="RAG问答HTTP服务")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--api-key", default=os.environ.get("DASHSCOPE_API_KEY", config.API_KEY),
+                        help="大模型API Key（默认读取环境变量DASHSCOPE_API_KEY）")
+    parser.add_argument("--admin-token", default=os.environ.get("SERVER_ADMIN_TOKEN", SERVER_ADMIN_TOKEN),
+                        help="导入、删除、卸载接口需要的令牌（默认读取环境变量SERVER_ADMIN_TOKEN），为空时这些接口不可用")
+    parser.add_argument("--workers", type=int, default=SERVER_RETRIEVAL_WORKERS, help="检索线程数")
+    parser.add_argument("--log-level", default=config.LOG_LEVEL, help="日志级别（DEBUG/INFO/WARNING/ERROR）")
+    parser.add_argument("--log-format", default=config.LOG_FORMAT, choices=("text", "json"), help="日志格式")
+    parser.add_argument("--trace", action="store_true", default=config.TRACING_ENABLED,
+                        help="记录每次问答各阶段的耗时，写入JSONL并在/metrics中汇总")
+    args = parser.parse_args(argv)
+
+    import uvicorn
+
+    setup_logging(args.log_level, args.log_format)
+    tracing.configure(enabled=args.trace)
+    ensure_directories()
+    # 在后台加载嵌入模型和索引，服务立即开始接受请求（/readyz在加载完成前返回503）
+    start_warm_up()
+    on_ready(lambda error: logger.info(format_startup_report()))
+
+    engine = RAGEngine(query_batching=QUERY_BATCH_ENABLED)
+    if args.api_key:
+        engine.llm_service.update_api_key(args.api_key)
+    if not args.admin_token:
+        logger.warning("未配置管理令牌（--admin-token），导入、删除和卸载接口不可用")
+    app = create_app(engine, retrieval_workers=args.workers, admin_token=args.admin_token)
+
+    # 服务运行在大模型客户端所在的共享事件循环中，两者共用HTTP连接池
+    server = uvicorn.Server(uvicorn.Config(app, host=args.host, port=args.port, log_level="info"))
+    future = async_runtime.submit(server.serve())
+    try:
+        future.result()
+    except KeyboardInterrupt:
+        server.should_exit = True
+        future.result()
+
+
+if __name__ == "__main__":
+    # 打包后的程序在Windows上启动导入子进程时需要
+    multiprocessing.freeze_support()
+    sys.exit(main())
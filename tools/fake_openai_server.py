@@ -0,0 +1,184 @@
+"""本地的OpenAI兼容模拟服务
+
+实现 POST /v1/chat/completions（普通和流式），可以注入首token延迟、token间隔、错误码、
+Retry-After和卡住不返回的请求，用于在不访问DashScope的情况下测试超时、重试和对冲请求，
+也可以作为基准测试中的大模型。
+
+用法:
+    python tools/fake_openai_server.py --port 8765 --first-token-delay 0.5 --tokens-per-second 50
+    python tools/fake_openai_server.py --error-rate 0.3 --error-status 429 --retry-after 1
+    python tools/fake_openai_server.py --stall-rate 0.2   # 20%的请求永远不返回首token
+
+然后把 config.BASE_URL 指向 http://127.0.0.1:8765/v1（API Key任意）。
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_ANSWER = "这是模拟服务返回的回答，用于测试流式输出、超时和重试。"
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.options["verbose"]:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_POST(self):
+        options = self.server.options
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"未知路径: {self.path}"}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        self.server.record("requests")
+
+        # 注入错误
+        if random.random() < options["error_rate"]:
+            self.server.record("errors")
+            headers = {"Retry-After": str(options["retry_after"])} if options["retry_after"] is not None else None
+            self._send_json(options["error_status"], {"error": {"message": "模拟的错误", "type": "fake_error"}}, headers)
+            return
+
+        # 注入卡住的请求：不返回任何内容，直到客户端断开或服务关闭
+        if random.random() < options["stall_rate"]:
+            self.server.record("stalled")
+            self.server.shutdown_event.wait(options["stall_seconds"])
+            return
+
+        time.sleep(options["first_token_delay"] + random.uniform(0, options["jitter"]))
+        tokens = list(options["answer"])
+        model = request.get("model", "fake-model")
+
+        if not request.get("stream"):
+            time.sleep(len(tokens) / options["tokens_per_second"] if options["tokens_per_second"] else 0)
+            self._send_json(200, {
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": options["answer"]},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)}
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        interval = 1.0 / options["tokens_per_second"] if options["tokens_per_second"] else 0
+        sent = 0
+        try:
+            for token in tokens:
+                chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                         "model": model,
+                         "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+                self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                sent += 1
+                if interval:
+                    time.sleep(interval)
+            self._write_chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端中途停止了回答
+            self.server.record("cancelled")
+        self.server.record("tokens", sent)
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, options):
+        super().__init__(address, FakeOpenAIHandler)
+        self.options = options
+        self.shutdown_event = threading.Event()
+        self.counters = {"requests": 0, "errors": 0, "stalled": 0, "cancelled": 0, "tokens": 0}
+        self._counter_lock = threading.Lock()
+
+    def record(self, name, amount=1):
+        with self._counter_lock:
+            self.counters[name] += amount
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def stop(self):
+        self.shutdown_event.set()
+        self.shutdown()
+        self.server_close()
+
+
+def start_server(host="127.0.0.1", port=0, answer=DEFAULT_ANSWER, first_token_delay=0.0, jitter=0.0,
+                 tokens_per_second=0.0, error_rate=0.0, error_status=500, retry_after=None,
+                 stall_rate=0.0, stall_seconds=3600.0, verbose=False):
+    """在后台线程中启动模拟服务并返回服务对象（port为0时自动选择端口，见server.base_url）
+
+    Args:
+        answer: 回答文本，流式输出时每个字符作为一个token
+        first_token_delay: 首token前的固定延迟（秒）
+        jitter: 首token延迟上额外的随机延迟上限（秒）
+        tokens_per_second: 流式输出速率，0表示不限速
+        error_rate: 直接返回错误的请求比例
+        error_status: 注入错误的HTTP状态码
+        retry_after: 注入错误时返回的Retry-After（秒），None表示不返回
+        stall_rate: 永远不返回首token的请求比例
+        stall_seconds: 卡住的请求最多保持的时间（秒）
+    """
+    options = {
+        "answer": answer, "first_token_delay": first_token_delay, "jitter": jitter,
+        "tokens_per_second": tokens_per_second, "error_rate": error_rate, "error_status": error_status,
+        "retry_after": retry_after, "stall_rate": stall_rate, "stall_seconds": stall_seconds, "verbose": verbose
+    }
+    server = FakeOpenAIServer((host, port), options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OpenAI兼容的模拟大模型服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--answer", default=DEFAULT_ANSWER, help="回答文本（每个字符一个token）")
+    parser.add_argument("--first-token-delay", type=float, default=0.0, help="首token延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="首token额外随机延迟上限（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="流式输出速率，0表示不限速")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回错误的请求比例")
+    parser.add_argument("--error-status", type=int, default=500, help="注入错误的HTTP状态码")
+    parser.add_argument("--retry-after", type=float, default=None, help="注入错误时返回的Retry-After（秒）")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="永远不返回首token的请求比例")
+    parser.add_argument("--verbose", action="store_true", help="打印每个请求")
+    args = parser.parse_args(argv)
+
+    server = start_server(args.host, args.port, args.answer, args.first_token_delay, args.jitter,
+                          args.tokens_per_second, args.error_rate, args.error_status, args.retry_after,
+                          args.stall_rate, verbose=args.verbose)
+    print(f"模拟服务已启动: {server.base_url}（Ctrl+C 停止）")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print(f"统计: {server.counters}")
+        server.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,12 +4,17 @@ import tkinter as tk
 from tkinter import filedialog, scrolledtext, messagebox  # 添加messagebox
 import customtkinter as ctk
 from modules.rag_engine import RAGEngine
-from modules.document_loader import DocumentLoader
-from modules.vector_store import VectorStore
-from modules.llm_service import LLMService 
-from config import KNOWLEDGE_BASE_DIR, API_KEY 
+from modules.llm_service import CancelToken
+from modules.store_registry import get_vector_store, is_ready, on_ready
+from modules.kb_sync import KnowledgeBaseSync
+from modules.logger import get_logger
+from ui.stream_buffer import StreamRenderBuffer
+from ui.chat_view import ChatView
+from config import KNOWLEDGE_BASE_DIR, API_KEY, KB_SYNC_ON_STARTUP, KB_SYNC_WATCH_INTERVAL
 from datetime import datetime
 
+logger = get_logger(__name__)
+
 class AppUI(ctk.CTk):
     def __init__(self):
         super().__init__()
@@ -19,9 +24,12 @@ class AppUI(ctk.CTk):
         ctk.set_default_color_theme("blue")
         
         # 初始化组件
+        # 向量存储（含嵌入模型）全进程共享一份，由后台预热线程加载，窗口不等待加载完成
         self.rag_engine = RAGEngine()
-        self.document_loader = DocumentLoader()
-        self.vector_store = VectorStore()
+        self._kb_sync = None
+        self._kb_sync_lock = threading.Lock()
+        # 正在进行的回答，点击"停止"时全部取消
+        self._active_queries = set()
         
         # 设置窗口
         self.title("乐乐的RAG学习助手 - 马斯陶专属定制")
@@ -46,6 +54,37 @@ class AppUI(ctk.CTk):
         
         # 显示欢迎消息
         self.after(500, lambda: self.add_message("系统", "欢迎进入伟大的马斯陶先生给乐乐写的 rag 项目！"))
+        
+        # 嵌入模型和索引加载完成后刷新文档列表并同步知识库目录
+        on_ready(lambda error: self.after(0, lambda: self._on_store_ready(error)))
+    
+    @property
+    def vector_store(self):
+        """共享的向量存储，预热未完成时阻塞到加载完成（不要在界面线程中提前访问）"""
+        return get_vector_store()
+    
+    @property
+    def kb_sync(self):
+        """知识库目录同步器，首次使用时创建"""
+        with self._kb_sync_lock:
+            if self._kb_sync is None:
+                self._kb_sync = KnowledgeBaseSync(self.vector_store)
+            return self._kb_sync
+    
+    def _on_store_ready(self, error):
+        """后台预热完成（在界面线程中调用）"""
+        if error is not None:
+            self.add_message("系统", f"❌ 加载嵌入模型或知识库失败: {error}")
+            return
+        self.update_documents_list(show_message=False)
+        
+        # 同步知识库目录（只导入新增或变化的文件），并按配置定期轮询
+        if KB_SYNC_ON_STARTUP:
+            threading.Thread(target=self._sync_knowledge_base, daemon=True).start()
+        self.kb_sync.start_watching(
+            KB_SYNC_WATCH_INTERVAL,
+            on_change=lambda summary: self.after(0, lambda: self._show_sync_summary(summary))
+        )
     
     def create_widgets(self):
         # 创建两个主要框架
@@ -63,6 +102,14 @@ class AppUI(ctk.CTk):
         add_doc_btn = ctk.CTkButton(left_frame, text="添加文档", command=self.add_document)
         add_doc_btn.pack(pady=5, fill=tk.X, padx=20)
         
+        # 同步知识库目录按钮
+        sync_kb_btn = ctk.CTkButton(left_frame, text="同步知识库目录", command=self.sync_knowledge_base)
+        sync_kb_btn.pack(pady=5, fill=tk.X, padx=20)
+        
+        # 删除选中文档按钮
+        delete_doc_btn = ctk.CTkButton(left_frame, text="删除选中文档", command=self.delete_selected_document)
+        delete_doc_btn.pack(pady=5, fill=tk.X, padx=20)
+        
         # 清空知识库按钮
         clear_kb_btn = ctk.CTkButton(left_frame, text="清空知识库", command=self.clear_knowledge_base)
         clear_kb_btn.pack(pady=5, fill=tk.X, padx=20)
@@ -73,6 +120,8 @@ class AppUI(ctk.CTk):
         
         # 文档列表区域
         self.docs_listbox = tk.Listbox(left_frame, bg="#F0F0F0", fg="#333333", selectbackground="#007BFF")
+        # 列表中每一行对应的来源名称（显示文本带有片段数）
+        self._listed_sources = []
         self.docs_listbox.pack(fill=tk.BOTH, expand=True, padx=20, pady=5)
         self.update_documents_list(show_message=False)  # 初始化时不显示消息
         
@@ -92,6 +141,8 @@ class AppUI(ctk.CTk):
         )
         self.chat_history.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
         self.chat_history.config(state=tk.DISABLED)
+        # 聊天记录保存在控件之外，控件只渲染最近的一段，滚动到顶部时再加载更早的消息
+        self.chat_view = ChatView(self.chat_history, self.message_styles)
         
         # 美化输入区域
         input_frame = ctk.CTkFrame(right_frame)
@@ -115,6 +166,16 @@ class AppUI(ctk.CTk):
         )
         send_button.pack(side=tk.RIGHT, padx=5)
         
+        stop_button = ctk.CTkButton(
+            input_frame,
+            text="停止",
+            width=60,
+            font=("Arial", 12),
+            fg_color="#9E9E9E",
+            command=self.stop_answer
+        )
+        stop_button.pack(side=tk.RIGHT, padx=5)
+        
         # 在左侧框架顶部添加API Key配置区域
         api_frame = ctk.CTkFrame(left_frame)
         api_frame.pack(fill=tk.X, padx=20, pady=(0, 20))
@@ -171,11 +232,19 @@ class AppUI(ctk.CTk):
         self.add_message("你", query)
         
         # 在后台处理请求
-        threading.Thread(target=self._process_query, args=(query,)).start()
+        threading.Thread(target=self._process_query, args=(query,), daemon=True).start()
+    
+    def stop_answer(self):
+        """停止正在进行的回答（关闭与大模型的连接，不再为剩余的token计费）"""
+        tokens = list(self._active_queries)
+        for token in tokens:
+            token.cancel()
+        if tokens:
+            self.add_message("系统", "⏹ 已停止回答")
     
     def add_document(self):
-        """添加文档到知识库"""
-        file_path = filedialog.askopenfilename(
+        """添加文档到知识库（可多选，多个文件会并行解析）"""
+        file_paths = filedialog.askopenfilenames(
             title="选择文档",
             filetypes=[
                 ("文本文件", "*.txt"),
@@ -185,69 +254,135 @@ class AppUI(ctk.CTk):
             ]
         )
         
-        if file_path:
+        if file_paths:
             # 在后台处理文档
-            self.add_message("系统", f"开始处理文档: {os.path.basename(file_path)}")
-            threading.Thread(target=self._process_document, args=(file_path,)).start()
+            names = "、".join(os.path.basename(path) for path in file_paths[:3])
+            more = f" 等 {len(file_paths)} 个文件" if len(file_paths) > 3 else ""
+            self.add_message("系统", f"开始处理文档: {names}{more}")
+            threading.Thread(target=self._process_documents, args=(list(file_paths),), daemon=True).start()
 
-    def _process_document(self, file_path):
+    def _process_documents(self, file_paths):
         """在后台处理文档"""
         try:
-            # 加载文档
-            text = self.document_loader.load_document(file_path)
-            self.after(0, lambda: self.add_message("系统", f"文档加载成功，文本长度: {len(text)} 字符"))
+            # 单个文件时显示向量化进度（最多约10条进度消息）
+            last_reported = [0]
             
-            # 分割文本
-            chunks = self.document_loader.split_text(text)
-            self.after(0, lambda: self.add_message("系统", f"文本分割完成，共 {len(chunks)} 个片段"))
+            def progress_callback(done, total):
+                if done - last_reported[0] >= max(1, total // 10) or done == total:
+                    last_reported[0] = done
+                    self.after(0, lambda: self.add_message("系统", f"向量化进度: {done}/{total} ({done * 100 // total}%)"))
             
-            # 添加到向量存储
-            source_name = os.path.basename(file_path)
-            success = self.vector_store.add_texts(chunks, source_name)
+            # 每个文件完成后立即显示结果，单个文件失败不影响其他文件
+            def on_file_done(result):
+                source_name = result["source"]
+                if result["status"] == "duplicate":
+                    message = f"⚠️ 文档 '{source_name}' 与已导入的 '{result['duplicate_of']}' 内容相同，已跳过"
+                elif result["status"] == "failed":
+                    message = f"❌ 文档 '{source_name}' 添加失败: {result['error']}"
+                elif result["status"] == "empty":
+                    message = f"❌ 文档 '{source_name}' 没有可添加的文本内容"
+                else:
+                    action = "替换" if result["status"] == "replaced" else "添加"
+                    message = f"✅ 文档 '{source_name}' 已成功{action}到知识库，共 {result['chunks']} 个片段"
+                self.after(0, lambda: self.add_message("系统", message))
             
-            if success:
-                self.after(0, lambda: self.add_message("系统", f"✅ 文档 '{source_name}' 已成功添加到知识库"))
-                # 更新文档列表，并显示消息
-                self.after(0, lambda: self.update_documents_list(show_message=True))
-            else:
-                self.after(0, lambda: self.add_message("系统", f"❌ 文档 '{source_name}' 添加失败"))
+            # 内容与已导入文件相同的文档不会重复导入；再次添加同一个文件会替换旧内容，不同文件重名时自动加序号
+            self.kb_sync.add_files(
+                file_paths,
+                on_file_done=on_file_done,
+                progress_callback=progress_callback if len(file_paths) == 1 else None
+            )
+            # 更新文档列表，并显示消息
+            self.after(0, lambda: self.update_documents_list(show_message=True))
                 
         except Exception as e:
             self.after(0, lambda: self.add_message("系统", f"处理文档时出错: {str(e)}"))
 
+    def sync_knowledge_base(self):
+        """同步知识库目录"""
+        self.add_message("系统", f"开始同步知识库目录: {KNOWLEDGE_BASE_DIR}")
+        threading.Thread(target=self._sync_knowledge_base, args=(True,), daemon=True).start()
+
+    def _sync_knowledge_base(self, always_report=False):
+        """在后台同步知识库目录"""
+        try:
+            summary = self.kb_sync.sync()
+            if always_report or summary["added"] or summary["changed"] or summary["deleted"] or summary["failed"]:
+                self.after(0, lambda: self._show_sync_summary(summary))
+        except Exception as e:
+            self.after(0, lambda: self.add_message("系统", f"同步知识库目录时出错: {str(e)}"))
+
+    def _show_sync_summary(self, summary):
+        """显示同步结果并刷新文档列表"""
+        self.add_message("系统", f"📁 知识库目录同步完成: 新增 {summary['added']}，更新 {summary['changed']}，"
+                               f"删除 {summary['deleted']}，重复 {summary['duplicate']}，无文本 {summary['empty']}，"
+                               f"未变化 {summary['unchanged']}")
+        for source_name, error in summary["failed"].items():
+            self.add_message("系统", f"❌ 文档 '{source_name}' 同步失败: {error}")
+        self.update_documents_list()
+
     def clear_knowledge_base(self):
         """清空知识库"""
+        if not is_ready():
+            self.add_message("系统", "⏳ 知识库正在加载，请稍后再试")
+            return
         confirm = tk.messagebox.askyesno("确认", "确定要清空知识库吗？此操作不可恢复。")
         if confirm:
             try:
                 self.vector_store.clear()
+                self.kb_sync.reset()
                 self.add_message("系统", "✅ 知识库已清空")
                 # 更新文档列表，并显示消息
                 self.update_documents_list(show_message=True)
             except Exception as e:
                 self.add_message("系统", f"清空知识库时出错: {str(e)}")
 
+    def delete_selected_document(self):
+        """删除列表中选中的文档，只删除它的向量，其余文档不受影响"""
+        if not is_ready():
+            self.add_message("系统", "⏳ 知识库正在加载，请稍后再试")
+            return
+        selection = self.docs_listbox.curselection()
+        if not selection or selection[0] >= len(self._listed_sources):
+            self.add_message("系统", "请先在文档列表中选择要删除的文档")
+            return
+        source_name = self._listed_sources[selection[0]]
+        if not tk.messagebox.askyesno("确认", f"确定要从知识库中删除文档 '{source_name}' 吗？"):
+            return
+        try:
+            removed = self.kb_sync.remove_source(source_name)
+            self.add_message("系统", f"🗑️ 已删除文档 '{source_name}'（{removed} 个片段）")
+            self.update_documents_list()
+        except Exception as e:
+            self.add_message("系统", f"删除文档时出错: {str(e)}")
+
     def update_documents_list(self, show_message=False):
         """更新已加载文档列表"""
         try:
             # 清空当前列表
             self.docs_listbox.delete(0, tk.END)
+            self._listed_sources = []
+            
+            # 后台预热未完成时不等待，加载完成后会再次刷新
+            if not is_ready():
+                self.docs_listbox.insert(tk.END, "正在加载知识库...")
+                return
+            
+            # 获取所有文档的来源和片段数（从文档表中直接读取，不遍历片段）
+            chunk_counts = {}
+            for document in self.vector_store.list_documents():
+                chunk_counts[document["source"]] = chunk_counts.get(document["source"], 0) + document["chunks"]
+            sources = list(chunk_counts)
             
             # 如果向量存储为空，则显示提示信息
-            if not self.vector_store.texts:
+            if not sources:
                 self.docs_listbox.insert(tk.END, "暂无文档")
                 return
-                
-            # 获取所有文档的来源信息
-            sources = set()
-            for text in self.vector_store.texts:
-                if "\n\n" in text:
-                    source = text.split("\n\n")[0].replace("来源: ", "")
-                    sources.add(source)
             
             # 按字母顺序排序并显示
             for source in sorted(sources):
-                self.docs_listbox.insert(tk.END, source)
+                self.docs_listbox.insert(tk.END, f"{source}（{chunk_counts[source]}段）")
+                self._listed_sources.append(source)
                 
             # 如果有文档且需要显示消息，显示数量
             if sources and show_message:
@@ -256,101 +391,54 @@ class AppUI(ctk.CTk):
             if show_message:
                 self.add_message("系统", f"更新文档列表时出错: {str(e)}")
             else:
-                print(f"更新文档列表时出错: {str(e)}")
+                logger.warning(f"更新文档列表时出错: {str(e)}")
 
     def add_message(self, sender, message, message_id=None):
-        """向聊天历史添加消息"""
-        # 获取发送者的样式
-        style = self.message_styles.get(sender, {"bg": "#F5F5F5", "fg": "#333333", "prefix": ""})
-        
-        # 启用编辑
-        self.chat_history.config(state=tk.NORMAL)
-        
-        # 添加时间戳
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        
-        # 如果提供了消息ID，将其存储为标签
-        tag_prefix = message_id if message_id else f"{sender}_{timestamp}"
-        
-        self.chat_history.insert(tk.END, f"[{timestamp}] ", f"timestamp_{tag_prefix}")
-        
-        # 添加发送者和消息
-        sender_text = f"{style['prefix']}{sender}: "
-        self.chat_history.insert(tk.END, sender_text, f"sender_{tag_prefix}")
-        self.chat_history.insert(tk.END, f"{message}\n\n", f"message_{tag_prefix}")
-        
-        # 应用样式标签
-        self.chat_history.tag_config(f"timestamp_{tag_prefix}", foreground="#999999")
-        self.chat_history.tag_config(f"sender_{tag_prefix}", foreground=style["fg"], font=("Arial", 11, "bold"))
-        self.chat_history.tag_config(f"message_{tag_prefix}", foreground=style["fg"])
-        
-        # 滚动到底部
-        self.chat_history.see(tk.END)
-        
-        # 禁用编辑
-        self.chat_history.config(state=tk.DISABLED)
-        
-        return tag_prefix
+        """向聊天历史添加消息，返回消息ID"""
+        return self.chat_view.add_message(sender, message, message_id)
 
     def update_message(self, message_id, content_delta=None, is_done=False):
         """更新现有消息的内容"""
         if not message_id:
             return
-            
-        # 启用编辑
-        self.chat_history.config(state=tk.NORMAL)
-        
-        # 获取消息标签的位置
         try:
-            tag_ranges = self.chat_history.tag_ranges(f"message_{message_id}")
-            if not tag_ranges:
-                # 如果标签不存在，可能是第一次更新，先添加消息
+            if self.chat_view.history.get(message_id) is None:
+                # 如果消息不存在，可能是第一次更新，先添加消息
                 if content_delta:
                     self.add_message("助手", content_delta, message_id=message_id)
                 return
-                
-            start_index = tag_ranges[0]
-            end_index = tag_ranges[1]
-            
             if content_delta:
-                # 在消息末尾添加新内容（在换行符之前）
-                insert_pos = f"{end_index} - 2 chars"
-                self.chat_history.insert(insert_pos, content_delta)
-                
-            if is_done:
-                # 流式输出完成，可以在这里添加任何完成标记
-                pass
-                
-            # 滚动到底部
-            self.chat_history.see(tk.END)
-        except (IndexError, TclError) as e:
-            print(f"更新消息时出错: {e}")
-        
-        # 禁用编辑
-        self.chat_history.config(state=tk.DISABLED)
+                # 在消息末尾添加新内容
+                self.chat_view.append_text(message_id, content_delta)
+        except (IndexError, tk.TclError) as e:
+            logger.warning(f"更新消息时出错: {e}")
 
     def _process_query(self, query):
         """在后台处理查询"""
+        cancel_token = CancelToken()
+        self._active_queries.add(cancel_token)
         try:
             # 调用RAG引擎处理查询
             # 首先显示正在思考的消息
             self.after(0, lambda: self.add_message("系统", "🤔 正在思考中..."))
+            if not is_ready():
+                # 检索会等待后台加载完成后继续，不会失败
+                self.after(0, lambda: self.add_message("系统", "⏳ 嵌入模型和知识库仍在加载，加载完成后自动回答"))
             
             # 创建一个消息ID用于后续更新
             response_id = f"response_{datetime.now().strftime('%H%M%S')}"
             
-            # 流式输出的回调函数
-            def stream_callback(content_delta, is_done):
-                if is_done:
-                    # 流式输出完成
-                    self.after(0, lambda: self.update_message(response_id, is_done=True))
-                else:
-                    # 更新消息
-                    self.after(0, lambda: self.update_message(response_id, content_delta))
+            # 流式输出先写入缓冲，界面线程按固定间隔合并刷新，而不是每个token调度一次
+            stream_buffer = StreamRenderBuffer(
+                self,
+                lambda text, is_done: self.update_message(response_id, text, is_done=is_done)
+            )
             
             # 调用流式查询
-            result = self.rag_engine.stream_query(query, stream_callback)
+            result = self.rag_engine.stream_query(query, stream_buffer.callback, cancel_token)
             
+            if result.get("cancelled"):
+                return
             if result["has_context"]:
                 # 显示检索到的上下文信息
                 self.after(0, lambda: self.add_message("系统", "📚 检索到以下相关内容:"))
@@ -364,4 +452,6 @@ class AppUI(ctk.CTk):
                 self.after(0, lambda: self.add_message("系统", "⚠️ 未检索到相关知识，将使用模型的通用知识回答"))
             
         except Exception as e:
-            self.after(0, lambda: self.add_message("系统", f"处理查询时出错: {str(e)}"))
\ No newline at end of file
+            self.after(0, lambda: self.add_message("系统", f"处理查询时出错: {str(e)}"))
+        finally:
+            self._active_queries.discard(cancel_token)
\ No newline at end of file
@@ -0,0 +1,75 @@
+import itertools
+from datetime import datetime
+from config import CHAT_HISTORY_MAX_MESSAGES
+
+
+class ChatMessage:
+    """一条聊天消息"""
+    __slots__ = ("id", "sender", "timestamp", "text")
+
+    def __init__(self, message_id, sender, text, timestamp=None):
+        self.id = message_id
+        self.sender = sender
+        self.text = text
+        self.timestamp = timestamp or datetime.now().strftime("%H:%M:%S")
+
+
+class ChatHistory:
+    """聊天记录，独立于界面控件保存全部消息
+
+    消息按序号编号（从0开始递增，不会因淘汰而改变），超过max_messages条后成批淘汰最早的消息，
+    保证长时间会话的内存占用有上限。
+    """
+    def __init__(self, max_messages=CHAT_HISTORY_MAX_MESSAGES):
+        self.max_messages = max_messages
+        self._messages = []
+        self._by_id = {}
+        # _messages[0]的序号
+        self.base = 0
+        self._ids = itertools.count()
+
+    def __len__(self):
+        """已添加过的消息总数（含已淘汰的），即下一条消息的序号"""
+        return self.base + len(self._messages)
+
+    def add(self, sender, text, message_id=None):
+        """添加一条消息并返回它"""
+        if message_id is None or message_id in self._by_id:
+            message_id = f"msg_{next(self._ids)}"
+        message = ChatMessage(message_id, sender, text)
+        self._messages.append(message)
+        self._by_id[message_id] = message
+
+        # 超出上限时一次淘汰十分之一，避免每条消息都移动整个列表
+        if len(self._messages) > self.max_messages:
+            drop = len(self._messages) - self.max_messages + self.max_messages // 10
+            for old in self._messages[:drop]:
+                del self._by_id[old.id]
+            del self._messages[:drop]
+            self.base += drop
+        return message
+
+    def append_text(self, message_id, content_delta):
+        """向已有消息追加文本，消息不存在（或已被淘汰）时返回None"""
+        message = self._by_id.get(message_id)
+        if message is not None:
+            message.text += content_delta
+        return message
+
+    def get(self, message_id):
+        return self._by_id.get(message_id)
+
+    def at(self, position):
+        """按序号取消息"""
+        return self._messages[position - self.base]
+
+    def index_of(self, message_id):
+        """消息的序号，不存在时返回None"""
+        message = self._by_id.get(message_id)
+        if message is None:
+            return None
+        # 流式更新的几乎总是最近的消息，从后往前找
+        for i in range(len(self._messages) - 1, -1, -1):
+            if self._messages[i] is message:
+                return self.base + i
+        return None
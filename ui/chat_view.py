@@ -0,0 +1,201 @@
+import tkinter as tk
+from collections import deque
+from config import CHAT_RENDER_WINDOW, CHAT_PAGE_SIZE
+from ui.chat_model import ChatHistory
+
+
+class ChatView:
+    """在文本控件中渲染聊天记录的一个窗口
+
+    控件中最多同时显示window_size条连续的消息，滚动到顶部（或底部）时再按页加载更早（或更新）的消息，
+    超出窗口的消息从另一端移除。样式标签按发送者共享，每个发送者只有一组标签，
+    控件中的文本量和标签数不随会话长度增长。
+    """
+    def __init__(self, text_widget, styles, history=None, window_size=CHAT_RENDER_WINDOW,
+                 page_size=CHAT_PAGE_SIZE):
+        """
+        Args:
+            text_widget: 用于显示的ScrolledText控件
+            styles: 发送者 -> {"fg": 颜色, "prefix": 前缀}
+            history: 聊天记录模型，默认新建
+            window_size: 控件中最多渲染的消息数
+            page_size: 滚动到边缘时每次加载的消息数
+        """
+        self.text = text_widget
+        self.styles = styles
+        self.history = history if history is not None else ChatHistory()
+        self.window_size = window_size
+        self.page_size = page_size
+
+        # 已渲染的消息ID（按显示顺序）及每条消息占用的行数
+        self._rendered = deque()
+        self._lines = {}
+        # 第一条已渲染消息的序号
+        self._start = 0
+        self._configured_senders = set()
+        self._paging = False
+
+        self.text.tag_config("timestamp", foreground="#999999")
+        # 截获滚动位置，滚到边缘时加载更多消息
+        self.text.configure(yscrollcommand=self._on_yscroll)
+
+    def _default_style(self):
+        return {"fg": "#333333", "prefix": ""}
+
+    def _sender_tags(self, sender):
+        """每个发送者只配置一次样式标签"""
+        if sender not in self._configured_senders:
+            style = self.styles.get(sender, self._default_style())
+            self.text.tag_config(f"sender_{sender}", foreground=style["fg"], font=("Arial", 11, "bold"))
+            self.text.tag_config(f"message_{sender}", foreground=style["fg"])
+            self._configured_senders.add(sender)
+        return f"sender_{sender}", f"message_{sender}"
+
+    def _render(self, message, index):
+        """在index处插入一条消息，返回它占用的行数"""
+        style = self.styles.get(message.sender, self._default_style())
+        sender_tag, message_tag = self._sender_tags(message.sender)
+        self.text.insert(index,
+                         f"[{message.timestamp}] ", "timestamp",
+                         f"{style['prefix']}{message.sender}: ", sender_tag,
+                         f"{message.text}\n\n", message_tag)
+        lines = message.text.count("\n") + 2
+        self._lines[message.id] = lines
+        return lines
+
+    def _first_line_of(self, message_id):
+        """已渲染消息的起始行号"""
+        line = 1
+        for rendered_id in self._rendered:
+            if rendered_id == message_id:
+                return line
+            line += self._lines[rendered_id]
+        return None
+
+    def _end(self):
+        """最后一条已渲染消息之后的序号"""
+        return self._start + len(self._rendered)
+
+    def _following(self):
+        """是否正在显示最新的消息"""
+        return self._end() == len(self.history)
+
+    def _trim_top(self):
+        removed = 0
+        while len(self._rendered) > self.window_size:
+            removed += self._lines.pop(self._rendered.popleft())
+            self._start += 1
+        if removed:
+            self.text.delete("1.0", f"{removed + 1}.0")
+
+    def _trim_bottom(self):
+        if len(self._rendered) <= self.window_size:
+            return
+        while len(self._rendered) > self.window_size:
+            self._lines.pop(self._rendered.pop())
+        first_removed = 1 + sum(self._lines[message_id] for message_id in self._rendered)
+        self.text.delete(f"{first_removed}.0", tk.END)
+
+    def add_message(self, sender, text, message_id=None):
+        """添加一条消息并显示最新的消息，返回消息ID"""
+        following = self._following()
+        message = self.history.add(sender, text, message_id)
+
+        self.text.config(state=tk.NORMAL)
+        if following:
+            self._rendered.append(message.id)
+            self._render(message, tk.END)
+            self._trim_top()
+        else:
+            # 正在浏览更早的消息时，新消息到来跳回最新的一屏
+            self._render_latest()
+        self.text.see(tk.END)
+        self.text.config(state=tk.DISABLED)
+        return message.id
+
+    def append_text(self, message_id, content_delta):
+        """向已有消息追加文本（流式输出），消息不在当前窗口中时只更新记录"""
+        message = self.history.append_text(message_id, content_delta)
+        if message is None or message_id not in self._lines:
+            return message is not None
+        first_line = self._first_line_of(message_id)
+        lines = self._lines[message_id]
+
+        self.text.config(state=tk.NORMAL)
+        # 消息末尾是一个空行，追加位置在倒数第二行的行尾
+        self.text.insert(f"{first_line + lines - 2}.end", content_delta, self._sender_tags(message.sender)[1])
+        self._lines[message_id] = lines + content_delta.count("\n")
+        if self._rendered and self._rendered[-1] == message_id:
+            self.text.see(tk.END)
+        self.text.config(state=tk.DISABLED)
+        return True
+
+    def _render_latest(self):
+        """清空控件并渲染最新的window_size条消息"""
+        self.text.delete("1.0", tk.END)
+        self._rendered.clear()
+        self._lines.clear()
+        end = len(self.history)
+        self._start = max(self.history.base, end - self.window_size)
+        for position in range(self._start, end):
+            message = self.history.at(position)
+            self._rendered.append(message.id)
+            self._render(message, tk.END)
+
+    def _on_yscroll(self, first, last):
+        self.text.vbar.set(first, last)
+        if self._paging:
+            return
+        if float(first) <= 0.0 and self._start > self.history.base:
+            self._paging = True
+            self.text.after_idle(self._page_up)
+        elif float(last) >= 1.0 and not self._following():
+            self._paging = True
+            self.text.after_idle(self._page_down)
+
+    def _page_up(self):
+        """在顶部加载更早的一页消息，保持当前看到的内容不动"""
+        try:
+            count = min(self.page_size, self._start - self.history.base)
+            if count <= 0:
+                return
+            self.text.config(state=tk.NORMAL)
+            added = 0
+            for position in range(self._start - 1, self._start - count - 1, -1):
+                message = self.history.at(position)
+                self._rendered.appendleft(message.id)
+                added += self._render(message, "1.0")
+            self._start -= count
+            self._trim_bottom()
+            self.text.config(state=tk.DISABLED)
+            self.text.yview(f"{added + 1}.0")
+        finally:
+            self._paging = False
+
+    def _page_down(self):
+        """在底部加载更新的一页消息"""
+        try:
+            end = self._end()
+            count = min(self.page_size, len(self.history) - end)
+            if count <= 0:
+                return
+            if self._start + len(self._rendered) < self.history.base:
+                # 当前窗口的消息已全部被淘汰，直接显示最新的
+                self.text.config(state=tk.NORMAL)
+                self._render_latest()
+                self.text.config(state=tk.DISABLED)
+                return
+            first_visible = self.text.index("@0,0")
+            self.text.config(state=tk.NORMAL)
+            for position in range(end, end + count):
+                message = self.history.at(position)
+                self._rendered.append(message.id)
+                self._render(message, tk.END)
+            removed_before = sum(self._lines[message_id] for message_id in
+                                 list(self._rendered)[:max(0, len(self._rendered) - self.window_size)])
+            self._trim_top()
+            self.text.config(state=tk.DISABLED)
+            line = int(first_visible.split(".")[0]) - removed_before
+            self.text.yview(f"{max(line, 1)}.0")
+        finally:
+            self._paging = False
@@ -0,0 +1,61 @@
+import threading
+from config import STREAM_RENDER_INTERVAL_MS
+
+
+class StreamRenderBuffer:
+    """流式回答的渲染缓冲
+
+    大模型线程调用append()写入增量文本，界面线程每隔interval_ms毫秒最多刷新一次，
+    把这段时间内收到的全部增量一次性交给render。无论token到达多快，每秒的界面刷新次数都有上限。
+    """
+    def __init__(self, widget, render, interval_ms=STREAM_RENDER_INTERVAL_MS):
+        """
+        Args:
+            widget: 用于调度刷新的Tk控件（调用其after方法）
+            render: 在界面线程中调用的渲染函数，接收参数(text, is_done)
+            interval_ms: 两次刷新之间的最小间隔（毫秒）
+        """
+        self.widget = widget
+        self.render = render
+        self.interval_ms = interval_ms
+        self._lock = threading.Lock()
+        self._parts = []
+        self._scheduled = False
+        self._done = False
+        self._closed = False
+
+    def append(self, content_delta):
+        """写入一段增量文本（可在任意线程调用）"""
+        if not content_delta:
+            return
+        with self._lock:
+            self._parts.append(content_delta)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self.widget.after(self.interval_ms, self._flush)
+
+    def finish(self):
+        """流式输出结束，立即刷新剩余内容（可在任意线程调用）"""
+        with self._lock:
+            self._done = True
+        self.widget.after(0, self._flush)
+
+    def callback(self, content_delta, is_done):
+        """与RAGEngine.stream_query的回调参数一致，可以直接作为回调传入"""
+        # 结束时也可能带有内容（如错误信息）
+        self.append(content_delta)
+        if is_done:
+            self.finish()
+
+    def _flush(self):
+        """在界面线程中把缓冲的增量一次性渲染出来"""
+        with self._lock:
+            if self._closed:
+                return
+            text = "".join(self._parts)
+            self._parts = []
+            self._scheduled = False
+            is_done = self._closed = self._done
+        if text or is_done:
+            self.render(text, is_done)